@@ -6,3 +6,4 @@ from channel import models
 admin.site.register(models.Channel)
 admin.site.register(models.ChannelMember)
 admin.site.register(models.ChannelMessage)
+admin.site.register(models.PurgeJob)
@@ -1,5 +1,30 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class ChannelConfig(AppConfig):
     name = 'channel'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from channel import models
+        from channel import signals
+
+        for sender in (models.Channel, User):
+            pre_delete.connect(
+                signals.delete_messages, sender=sender,
+                dispatch_uid="channel.signals.delete_messages"
+            )
+        pre_delete.connect(
+            signals.remove_owner, sender=User,
+            dispatch_uid="channel.signals.remove_owner"
+        )
+        post_save.connect(
+            signals.add_member, sender=models.ChannelMember,
+            dispatch_uid="channel.signals.add_member"
+        )
+        post_delete.connect(
+            signals.remove_member, sender=models.ChannelMember,
+            dispatch_uid="channel.signals.remove_member"
+        )
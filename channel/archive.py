@@ -0,0 +1,183 @@
+""" Cold storage of old channel messages
+
+archive_messages moves messages older than ARCHIVE_AFTER_DAYS, by whole
+months, out of ChannelMessage into one ChannelMessageArchive segment per
+channel and month, on the channel's shard. A segment is the month's
+messages as zlib compressed JSON. Readers merge segments with the messages
+table, where a message posted to an archived day after archiving takes
+precedence until the next archive run folds it in. Decoded segments are
+kept in a per-process LRU cache, keyed on their write time.
+"""
+import datetime as dtt
+import functools
+import json
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from channel import models
+from channel import shards
+import standup.db
+from standup import settings
+
+
+#: User id, date posted and message of an archived message
+ArchivedMessage = Tuple[int, dtt.date, str]
+
+
+def get_month_start(dt: dtt.date) -> dtt.date:
+    """ Returns first day of month of date """
+    return dt.replace(day=1)
+
+
+def encode_segment(rows: Iterable[Tuple[int, int, str]]) -> bytes:
+    """ Compresses (user id, day of month, message) rows of a segment """
+    return zlib.compress(
+        json.dumps(sorted(rows, key=lambda row: (row[1], row[0]))).encode(
+            "utf-8"
+        )
+    )
+
+
+def decode_segment(data: bytes) -> List[Tuple[int, int, str]]:
+    """ Decompresses (user id, day of month, message) rows of a segment """
+    return [
+        (user_id, day, message)
+        for user_id, day, message in json.loads(
+            zlib.decompress(bytes(data)).decode("utf-8")
+        )
+    ]
+
+
+def archives_for(channel_id: int) -> QuerySet:
+    """ Returns archive segments of channel, from its shard """
+    return models.ChannelMessageArchive.objects.using(
+        shards.get_shard(channel_id)
+    ).filter(channel_id=channel_id)
+
+
+@functools.lru_cache(maxsize=settings.ARCHIVE_CACHE_SEGMENTS)
+def load_segment(
+        channel_id: int, segment_id: int, dt_archived: dtt.datetime
+) -> Tuple[Tuple[int, int, str], ...]:
+    """ Returns decoded rows of segment, cached until it is rewritten """
+    data = archives_for(channel_id).values_list("data", flat=True).get(
+        pk=segment_id
+    )
+    return tuple(decode_segment(data))
+
+
+def get_messages(
+        channel_id: int, dt_start: Optional[dtt.date] = None,
+        dt_end: Optional[dtt.date] = None
+) -> List[ArchivedMessage]:
+    """ Returns archived messages of channel in optional date range """
+    if dt_start is not None and (
+            dt_start >= get_month_start(timezone.now().date())
+    ):
+        # Current month is never archived
+        return []
+
+    segments = archives_for(channel_id)
+    if dt_start is not None:
+        segments = segments.filter(dt_month__gte=get_month_start(dt_start))
+    if dt_end is not None:
+        segments = segments.filter(dt_month__lte=dt_end)
+
+    messages = []
+    for segment_id, dt_month, dt_archived in segments.values_list(
+            "pk", "dt_month", "dt_archived"
+    ):
+        for user_id, day, message in load_segment(
+                channel_id, segment_id, dt_archived
+        ):
+            dt_posted = dt_month.replace(day=day)
+            if dt_start is not None and dt_posted < dt_start:
+                continue
+            if dt_end is not None and dt_posted > dt_end:
+                continue
+            messages.append((user_id, dt_posted, message))
+    return messages
+
+
+def get_messages_in(
+        channel_ids: Iterable[int], dt_start: dtt.date, dt_end: dtt.date
+) -> Dict[int, List[ArchivedMessage]]:
+    """ Returns archived messages of channels in date range, by channel
+
+    Segments are read with one query per shard, and decoded without the
+    segment cache, for jobs reading many channels once.
+    """
+    messages: Dict[int, List[ArchivedMessage]] = {}
+    if dt_start >= get_month_start(timezone.now().date()):
+        return messages
+
+    for alias, shard_channel_ids in shards.group_by_shard(
+            channel_ids
+    ).items():
+        for channel_id, dt_month, data in (
+                models.ChannelMessageArchive.objects.using(alias).filter(
+                    channel_id__in=shard_channel_ids,
+                    dt_month__gte=get_month_start(dt_start),
+                    dt_month__lte=dt_end
+                ).values_list("channel_id", "dt_month", "data")
+        ):
+            for user_id, day, message in decode_segment(data):
+                dt_posted = dt_month.replace(day=day)
+                if dt_start <= dt_posted <= dt_end:
+                    messages.setdefault(channel_id, []).append(
+                        (user_id, dt_posted, message)
+                    )
+    return messages
+
+
+def archive_channel(channel_id: int, dt_before: dtt.date) -> int:
+    """ Moves messages of channel into archive segments
+
+    Only months that ended before the month of dt_before are archived.
+    Each month is moved in a transaction of its own, merged into the
+    month's segment if it was archived before.
+
+    :return: Number of messages archived
+    """
+    alias = shards.get_shard(channel_id)
+    old_messages = shards.messages_for(channel_id).filter(
+        dt_posted__lt=get_month_start(dt_before)
+    )
+
+    archived = 0
+    for dt_month in old_messages.dates("dt_posted", "month"):
+        with standup.db.immediate_atomic(alias):
+            month_messages = old_messages.filter(
+                dt_posted__year=dt_month.year, dt_posted__month=dt_month.month
+            )
+            segment = archives_for(channel_id).filter(
+                dt_month=dt_month
+            ).first()
+
+            rows: Dict[Tuple[int, int], str] = {}
+            if segment is not None:
+                for user_id, day, message in decode_segment(segment.data):
+                    rows[(user_id, day)] = message
+            n_messages = 0
+            for user_id, dt_posted, message in month_messages.values_list(
+                    "user_id", "dt_posted", "message"
+            ):
+                rows[(user_id, dt_posted.day)] = message
+                n_messages += 1
+
+            if segment is None:
+                segment = models.ChannelMessageArchive(
+                    channel_id=channel_id, dt_month=dt_month
+                )
+            segment.data = encode_segment(
+                (user_id, day, message)
+                for (user_id, day), message in rows.items()
+            )
+            segment.count = len(rows)
+            segment.save(using=alias)
+            month_messages.delete()
+        archived += n_messages
+    return archived
@@ -0,0 +1,155 @@
+""" Cache of the days served by list_logs, stored pre-serialized
+
+Each past day of a channel is cached as the JSON of its list_logs messages,
+so a month of logs is assembled from cache gets and a query for today.
+Writes through save_channel_message and upsert_messages delete the bucket
+of their (channel, date) once their transaction commits. Days past
+EDIT_FREEZE_DAYS no longer take posts, so their buckets only change
+through imports, or expire after DAY_CACHE_SECONDS. That expiry also
+bounds a bucket loaded just as a write to its day commits.
+
+Buckets are only cached with a CACHE_BACKEND shared by all processes, as
+writes of commands and other workers could not delete them from a cache
+local to each process.
+"""
+import datetime as dtt
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from channel import archive
+from channel import shards
+from standup import metrics
+from standup import settings
+from standup import timing
+
+
+#: Prefix of bucket keys, to be bumped when their format changes
+KEY_PREFIX = "daylog:1"
+
+#: Cache backends not shared between processes
+LOCAL_BACKENDS = (
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+def get_key(channel_id: int, dt: dtt.date) -> str:
+    """ Returns cache key of channel's bucket for day """
+    return "%s:%d:%s" % (KEY_PREFIX, channel_id, dt.isoformat())
+
+
+def is_enabled() -> bool:
+    """ Checks if buckets are cached, only with a shared cache backend """
+    return (
+        settings.DAY_CACHE_SECONDS > 0
+        and settings.CACHE_BACKEND not in LOCAL_BACKENDS
+    )
+
+
+def is_frozen(dt_posted: dtt.date, today: dtt.date) -> bool:
+    """ Checks if day is past the edit window """
+    return settings.EDIT_FREEZE_DAYS is not None and (
+        dt_posted < today - dtt.timedelta(settings.EDIT_FREEZE_DAYS)
+    )
+
+
+def load_messages(
+        channel_id: int, dt_start: dtt.date, dt_end: dtt.date,
+        since: Optional[dtt.datetime] = None
+) -> Dict[dtt.date, List[Dict]]:
+    """ Returns channel's messages in date range per day, in list_logs form
+
+    Archived messages come first, replaced by any live message of the same
+    user and day. Archives never change, so with since, only live messages
+    created or edited after it are returned.
+    """
+    messages = shards.messages_for(channel_id).filter(
+        dt_posted__gte=dt_start, dt_posted__lte=dt_end
+    )
+    if since is None:
+        logs = {
+            (user_id, dt_posted): message
+            for user_id, dt_posted, message in archive.get_messages(
+                channel_id, dt_start, dt_end
+            )
+        }
+    else:
+        logs = {}
+        messages = messages.filter(dt_updated__gt=since)
+
+    messages = messages.values_list("user_id", "dt_posted", "message")
+    for user_id, dt_posted, message in messages:
+        logs[(user_id, dt_posted)] = message
+
+    users = User.objects.in_bulk({user_id for user_id, _ in logs})
+    days: Dict[dtt.date, List[Dict]] = {}
+    for (user_id, dt_posted), message in logs.items():
+        user = users.get(user_id)
+        if user is None:
+            # Archived message of deleted user
+            continue
+        days.setdefault(dt_posted, []).append({
+            "user": {
+                "email": user.email,
+                "first_name": user.first_name,
+                "last_name": user.last_name
+            },
+            "message": message
+        })
+    return days
+
+
+def get_buckets(
+        channel_id: int, dates: List[dtt.date], today: dtt.date
+) -> Dict[dtt.date, str]:
+    """ Returns serialized messages of channel for each date
+
+    Days before today are read from the cache, missing days are loaded in
+    one query over their range and cached. Without a shared cache, all
+    days are loaded.
+    """
+    keys = {}
+    if is_enabled():
+        keys = {get_key(channel_id, dt): dt for dt in dates if dt < today}
+    buckets = {}
+    if keys:
+        with timing.phase("cache"):
+            buckets = {
+                keys[key]: bucket
+                for key, bucket in cache.get_many(list(keys)).items()
+            }
+    for dt in keys.values():
+        metrics.record_cache("daylog", dt in buckets)
+
+    missing = [dt for dt in dates if dt not in buckets]
+    if not missing:
+        return buckets
+
+    with timing.phase("query"):
+        days = load_messages(channel_id, min(missing), max(missing))
+    new_buckets = {}
+    for dt in missing:
+        buckets[dt] = json.dumps(days.get(dt, []), cls=DjangoJSONEncoder)
+        if get_key(channel_id, dt) in keys:
+            new_buckets[get_key(channel_id, dt)] = buckets[dt]
+    if new_buckets:
+        with timing.phase("cache"):
+            cache.set_many(new_buckets, settings.DAY_CACHE_SECONDS)
+    return buckets
+
+
+def invalidate(days: Iterable[Tuple[int, dtt.date]], using: str = "default"):
+    """ Deletes buckets of (channel id, date) pairs
+
+    Deferred until the current transaction of database commits, so that a
+    concurrent list_logs cannot cache the day again before the write shows.
+    """
+    if not is_enabled():
+        return
+    keys = [get_key(channel_id, dt) for channel_id, dt in set(days)]
+    transaction.on_commit(lambda: cache.delete_many(keys), using=using)
@@ -0,0 +1,299 @@
+""" Weekly digests of channel standups, rendered as PDF or XLSX
+
+Channels are read in batches, in the main process: get_members reads the
+members of a batch in one query, and get_messages its week of messages
+with one query per shard, then build_digest lays out each channel's week.
+Rendering is CPU bound, so render_digests runs it in
+a pool of DIGEST_WORKERS processes and keeps the output under DIGEST_DIR,
+keyed by channel, week, DIGEST_VERSION and a digest of the data, so a week
+edited after rendering is rendered again. reportlab and XlsxWriter are only
+imported by the renderers, in the pool's processes.
+"""
+import concurrent.futures
+import datetime as dtt
+import hashlib
+import io
+import itertools
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core import mail
+
+from channel import archive
+from channel import models
+from channel import shards
+from standup import settings
+
+
+#: Version of rendered digests, bumped when their layout changes
+DIGEST_VERSION = 1
+
+#: File extension and mimetype of each digest format
+FORMATS = {
+    "pdf": "application/pdf",
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+}
+
+#: Data of a digest, see build_digest
+Digest = Dict
+
+#: Messages of a channel's week by author id and date
+WeekMessages = Dict[Tuple[int, dtt.date], str]
+
+
+def get_week_start(dt: dtt.date) -> dtt.date:
+    """ Returns Monday of week of date """
+    return dt - dtt.timedelta(dt.weekday())
+
+
+def get_members(
+        channels: List[models.Channel]
+) -> Dict[int, List[models.ChannelMember]]:
+    """ Returns memberships of channels with their users, in one query
+
+    :return: Memberships by channel id, ordered by email address
+    """
+    members: Dict[int, List[models.ChannelMember]] = {}
+    for member in models.ChannelMember.objects.filter(
+            channel_id__in=[channel.pk for channel in channels]
+    ).select_related("user").order_by("user__email"):
+        members.setdefault(member.channel_id, []).append(member)
+    return members
+
+
+def get_messages(
+        channel_ids: List[int], dt_week: dtt.date
+) -> Dict[int, WeekMessages]:
+    """ Returns week of messages of channels, archived ones included
+
+    Messages are read with one query per shard holding channels. They are
+    not joined to their authors, which are on the default database.
+
+    :param channel_ids: IDs of channels
+    :param dt_week: Monday of week
+    :return: Messages by channel id
+    """
+    dt_end = dt_week + dtt.timedelta(6)
+    messages: Dict[int, WeekMessages] = {}
+    for channel_id, archived in archive.get_messages_in(
+            channel_ids, dt_week, dt_end
+    ).items():
+        for user_id, dt_posted, message in archived:
+            messages.setdefault(channel_id, {})[(user_id, dt_posted)] = (
+                message
+            )
+    # Live messages replace archived ones of the same day
+    for shard_messages in shards.messages_in(channel_ids):
+        for channel_id, user_id, dt_posted, message in shard_messages.filter(
+                dt_posted__gte=dt_week, dt_posted__lte=dt_end
+        ).values_list("channel_id", "user_id", "dt_posted", "message"):
+            messages.setdefault(channel_id, {})[(user_id, dt_posted)] = (
+                message
+            )
+    return messages
+
+
+def build_digest(
+        channel: models.Channel, dt_week: dtt.date,
+        members: List[models.ChannelMember], messages: WeekMessages
+) -> Digest:
+    """ Returns week of channel's standups, a row per member
+
+    :param channel: Channel of digest, with its owner selected
+    :param dt_week: Monday of week
+    :param members: Memberships of channel, see get_members
+    :param messages: Messages of channel's week, see get_messages
+    """
+    days = [dt_week + dtt.timedelta(i) for i in range(7)]
+    users = [channel.owner] if channel.owner is not None else []
+    users += [
+        member.user for member in members
+        if member.user_id != channel.owner_id
+    ]
+
+    return {
+        "channel": channel.name,
+        "week": dt_week.isoformat(),
+        "days": [dt.isoformat() for dt in days],
+        "rows": [
+            {
+                "name": " ".join(
+                    name for name in (user.first_name, user.last_name) if name
+                ) or user.email,
+                "email": user.email,
+                "messages": [messages.get((user.pk, dt), "") for dt in days]
+            }
+            for user in users
+        ]
+    }
+
+
+def render_pdf(digest: Digest) -> bytes:
+    """ Renders digest as a PDF table, a row per member """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import (
+        Paragraph, SimpleDocTemplate, Table, TableStyle
+    )
+    from xml.sax.saxutils import escape
+
+    styles = getSampleStyleSheet()
+    cell = styles["BodyText"]
+    cell.fontSize = 7
+    cell.leading = 9
+
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(
+        buffer, pagesize=landscape(A4), title="%s %s" % (
+            digest["channel"], digest["week"]
+        )
+    )
+    rows = [[""] + digest["days"]] + [
+        [Paragraph(escape(row["name"]), cell)] + [
+            Paragraph(escape(message).replace("\n", "<br/>"), cell)
+            for message in row["messages"]
+        ]
+        for row in digest["rows"]
+    ]
+    table = Table(rows, repeatRows=1, colWidths=[90] + [95] * 7)
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]))
+    document.build([
+        Paragraph(escape("%s: week of %s" % (
+            digest["channel"], digest["week"]
+        )), styles["Heading2"]),
+        table
+    ])
+    return buffer.getvalue()
+
+
+def render_xlsx(digest: Digest) -> bytes:
+    """ Renders digest as a worksheet, a row per member """
+    import xlsxwriter
+
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {"in_memory": True})
+    worksheet = workbook.add_worksheet(digest["week"])
+    header = workbook.add_format({"bold": True})
+    wrap = workbook.add_format({"text_wrap": True, "valign": "top"})
+
+    worksheet.write_row(0, 0, ["Name", "Email"] + digest["days"], header)
+    worksheet.set_column(0, 1, 24)
+    worksheet.set_column(2, 8, 40, wrap)
+    for i, row in enumerate(digest["rows"], 1):
+        worksheet.write_row(
+            i, 0, [row["name"], row["email"]] + row["messages"]
+        )
+    worksheet.freeze_panes(1, 2)
+    workbook.close()
+    return buffer.getvalue()
+
+
+#: Renderer of each format, run in worker processes
+RENDERERS = {"pdf": render_pdf, "xlsx": render_xlsx}
+
+
+def get_path(channel_id: int, digest: Digest, fmt: str) -> str:
+    """ Returns cache path of digest rendered in format """
+    data_hash = hashlib.sha256(
+        json.dumps(digest, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return os.path.join(
+        settings.DIGEST_DIR, str(channel_id), "%s.v%d.%s.%s" % (
+            digest["week"], DIGEST_VERSION, data_hash, fmt
+        )
+    )
+
+
+def save_output(path: str, output: bytes):
+    """ Writes rendered digest to cache, replacing renders of older data """
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        fh.write(output)
+    os.replace(tmp_path, path)
+
+    # Renders of the week from older data or versions
+    week, fmt = name.split(".")[0], name.rsplit(".", 1)[1]
+    for other in os.listdir(directory):
+        if other != name and other.startswith(week + ".") and (
+                other.endswith("." + fmt)
+        ):
+            os.remove(os.path.join(directory, other))
+
+
+def render_digests(
+        digests: List[Tuple[int, Digest]], fmt: str,
+        workers: Optional[int] = None
+) -> List[str]:
+    """ Renders digests in a process pool, reusing cached renders
+
+    :param digests: Channel id and data of each digest
+    :param fmt: Format to render, a key of RENDERERS
+    :param workers: Processes rendering, defaults to DIGEST_WORKERS
+    :return: Path of each rendered digest, in order
+    """
+    paths = [
+        get_path(channel_id, digest, fmt) for channel_id, digest in digests
+    ]
+    missing = [
+        (path, digest)
+        for path, (_, digest) in zip(paths, digests)
+        if not os.path.exists(path)
+    ]
+    if missing:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers or settings.DIGEST_WORKERS or None
+        ) as pool:
+            outputs = pool.map(
+                RENDERERS[fmt], [digest for _, digest in missing]
+            )
+            for (path, _), output in zip(missing, outputs):
+                save_output(path, output)
+    return paths
+
+
+def get_recipients(
+        channel: models.Channel, members: List[models.ChannelMember]
+) -> List[str]:
+    """ Returns addresses of channel's owner and active moderators
+
+    :param channel: Channel, with its owner selected
+    :param members: Memberships of channel, see get_members
+    """
+    recipients = [channel.owner.email] if channel.owner is not None else []
+    recipients += [
+        member.user.email for member in members
+        if member.is_mod and member.user.is_active
+        and member.user_id != channel.owner_id
+    ]
+    return recipients
+
+
+def send_digests(
+        messages: Iterable[mail.EmailMessage], batch_size: int = 100
+) -> int:
+    """ Sends digest emails in batches over one connection
+
+    Messages are consumed a batch at a time, so their attachments need not
+    all be in memory at once.
+
+    :return: Number of emails sent
+    """
+    messages = iter(messages)
+    sent = 0
+    with mail.get_connection() as connection:
+        while True:
+            batch = list(itertools.islice(messages, batch_size))
+            if not batch:
+                break
+            sent += connection.send_messages(batch) or 0
+    return sent
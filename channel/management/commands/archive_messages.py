@@ -0,0 +1,43 @@
+import datetime as dtt
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from channel import archive
+from channel import models
+from standup import settings
+
+
+class Command(BaseCommand):
+    """ Moves old channel messages to compressed archive segments """
+    help = "Archive messages older than ARCHIVE_AFTER_DAYS, by whole months"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.ARCHIVE_AFTER_DAYS,
+            help="Age in days of messages to archive"
+        )
+        parser.add_argument(
+            "--channel", type=int, action="append", dest="channels",
+            help="ID of channel to archive, may be repeated. Defaults to all"
+        )
+
+    def handle(self, *args, **options):
+        dt_before = timezone.now().date() - dtt.timedelta(options["days"])
+        channel_ids = options["channels"]
+        if not channel_ids:
+            channel_ids = models.Channel.objects.order_by("pk").values_list(
+                "pk", flat=True
+            )
+
+        total = 0
+        for channel_id in channel_ids:
+            archived = archive.archive_channel(channel_id, dt_before)
+            total += archived
+            if archived:
+                self.stdout.write("Archived %d messages of channel %d" % (
+                    archived, channel_id
+                ))
+        self.stdout.write("Archived %d messages before %s" % (
+            total, archive.get_month_start(dt_before)
+        ))
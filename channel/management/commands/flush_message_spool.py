@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from channel import spool
+
+
+class Command(BaseCommand):
+    """ Writes messages queued by burst posting to the database """
+    help = "Group-commit spooled channel messages in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Messages committed per transaction"
+        )
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep flushing until interrupted"
+        )
+        parser.add_argument(
+            "--interval", type=float, default=0.5,
+            help="Seconds to wait when spool is empty, with --loop"
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            t_start = time.monotonic()
+            flushed = spool.flush(options["batch_size"])
+            total += flushed
+            if flushed:
+                self.stdout.write("Flushed %d messages in %.1fms" % (
+                    flushed, (time.monotonic() - t_start) * 1000
+                ))
+            elif not options["loop"]:
+                break
+            else:
+                time.sleep(options["interval"])
+
+        self.stdout.write("Flushed %d messages" % total)
@@ -0,0 +1,212 @@
+import csv
+import itertools
+import json
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Lower
+
+from channel import models
+from channel import utils
+
+
+class Command(BaseCommand):
+    """ Bulk imports historical standup messages from JSONL or CSV
+
+    Each record needs the fields:
+        - channel: Channel ID, or channel name if unique across owners
+        - user_email: Account address of message author
+        - date: ISO date the message was posted for
+        - message: Message text
+
+    Records are checked like messages posted to message_channel: records
+    whose author is not the owner or a member of their channel, or whose
+    message is longer than MAX_MESSAGE_LENGTH, are skipped.
+    """
+    help = "Bulk import standup messages from a JSONL or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL or CSV file to import")
+        parser.add_argument(
+            "--format", choices=["jsonl", "csv"], default=None,
+            help="Input format, guessed from file extension by default"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="Records committed per transaction"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Rows per bulk INSERT/UPDATE statement"
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"]
+        if fmt is None:
+            fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+        #: Lookup caches shared across chunks
+        self.user_ids: Dict[str, Optional[int]] = {}
+        self.channel_ids: Dict[str, Optional[int]] = {}
+        self.member_ids: Dict[int, Set[int]] = {}
+        self.non_members: Set[Tuple[int, int]] = set()
+
+        created = updated = skipped = total = 0
+        t_start = time.monotonic()
+        with open(path, newline="", encoding="utf-8") as fh:
+            records = self.read_records(fh, fmt)
+            while True:
+                chunk = list(itertools.islice(records, options["chunk_size"]))
+                if not chunk:
+                    break
+
+                rows = self.resolve_chunk(chunk)
+                n_created, n_updated = utils.upsert_messages(
+                    rows, batch_size=options["batch_size"]
+                )
+                created += n_created
+                updated += n_updated
+                skipped += len(chunk) - len(rows)
+                total += len(chunk)
+
+                elapsed = time.monotonic() - t_start
+                self.stdout.write(
+                    "%d records (%d created, %d updated, %d skipped) "
+                    "%.0f records/s" % (
+                        total, created, updated, skipped,
+                        total / elapsed if elapsed else 0
+                    )
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d records in %.1fs" % (
+                total, time.monotonic() - t_start
+            )
+        ))
+
+    @staticmethod
+    def read_records(fh, fmt: str) -> Iterator[Dict]:
+        """ Yields records from input file as dictionaries """
+        if fmt == "csv":
+            yield from csv.DictReader(fh)
+            return
+
+        for line_no, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise CommandError("Invalid JSON on line %d" % line_no)
+
+    def resolve_chunk(self, chunk: List[Dict]) -> List:
+        """ Resolves users and channels for chunk of records
+
+        Unknown keys are fetched in one query per model, then cached.
+        """
+        emails = {
+            str(record.get("user_email", "")).lower() for record in chunk
+        }
+        self.cache_users(emails - self.user_ids.keys())
+
+        channel_keys = {str(record.get("channel", "")) for record in chunk}
+        self.cache_channels(channel_keys - self.channel_ids.keys())
+        channel_ids = {self.channel_ids[key] for key in channel_keys}
+        self.cache_members(channel_ids - {None} - self.member_ids.keys())
+
+        rows = []
+        for record in chunk:
+            user_id = self.user_ids.get(
+                str(record.get("user_email", "")).lower()
+            )
+            channel_id = self.channel_ids.get(str(record.get("channel", "")))
+            if user_id is None or channel_id is None:
+                continue
+            if user_id not in self.member_ids[channel_id]:
+                if (channel_id, user_id) not in self.non_members:
+                    self.non_members.add((channel_id, user_id))
+                    self.stderr.write("Not a member of channel %s: %s" % (
+                        record["channel"], record["user_email"]
+                    ))
+                continue
+            try:
+                dt_posted = utils.parse_iso_date_str(record["date"])
+            except (KeyError, ValueError, TypeError, AttributeError):
+                continue
+            message = record.get("message")
+            if message is None:
+                continue
+            message = str(message)
+            if len(message) > utils.MAX_MESSAGE_LENGTH:
+                self.stderr.write("Message too long: %s %s %s" % (
+                    record["channel"], record["user_email"], record["date"]
+                ))
+                continue
+            rows.append((user_id, channel_id, dt_posted, message))
+        return rows
+
+    def cache_users(self, emails):
+        """ Caches user ids for email addresses """
+        if not emails:
+            return
+        for email in emails:
+            self.user_ids[email] = None
+
+        # Case-insensitive, preferring an exact match of mixed case addresses
+        users = User.objects.annotate(lower_email=Lower("email")).filter(
+            lower_email__in=emails
+        ).order_by("pk")
+        for email, lower_email, pk in users.values_list(
+                "email", "lower_email", "pk"
+        ):
+            if self.user_ids[lower_email] is None or email == lower_email:
+                self.user_ids[lower_email] = pk
+
+        for email in sorted(emails):
+            if self.user_ids[email] is None:
+                self.stderr.write("Unknown user: %s" % email)
+
+    def cache_channels(self, keys):
+        """ Caches channel ids for channel ids or names """
+        if not keys:
+            return
+        for key in keys:
+            self.channel_ids[key] = None
+
+        id_keys = [int(key) for key in keys if key.isdigit()]
+        for pk in models.Channel.objects.filter(
+                pk__in=id_keys
+        ).values_list("pk", flat=True):
+            self.channel_ids[str(pk)] = pk
+
+        name_keys = [key for key in keys if not key.isdigit()]
+        by_name: Dict[str, List[int]] = {}
+        for name, pk in models.Channel.objects.filter(
+                name__in=name_keys
+        ).values_list("name", "pk"):
+            by_name.setdefault(name, []).append(pk)
+        for key in sorted(keys):
+            pks = by_name.get(key, [])
+            if len(pks) == 1:
+                self.channel_ids[key] = pks[0]
+            elif len(pks) > 1:
+                self.stderr.write("Ambiguous channel name: %s" % key)
+            elif self.channel_ids[key] is None:
+                self.stderr.write("Unknown channel: %s" % key)
+
+    def cache_members(self, channel_ids):
+        """ Caches ids of owner and members of channels """
+        if not channel_ids:
+            return
+        for pk, owner_id in models.Channel.objects.filter(
+                pk__in=channel_ids
+        ).values_list("pk", "owner_id"):
+            self.member_ids[pk] = {owner_id} - {None}
+        for channel_id, user_id in models.ChannelMember.objects.filter(
+                channel_id__in=channel_ids
+        ).values_list("channel_id", "user_id"):
+            self.member_ids[channel_id].add(user_id)
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from channel import models
+from channel import shards
+from standup import settings
+
+
+class Command(BaseCommand):
+    """ Moves messages, archives and tombstones to their channel's shard """
+    help = (
+        "Move messages after DB_SHARDS changes, or out of the default "
+        "database when sharding is first enabled. Run migrate for each "
+        "shard first"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Messages moved per transaction"
+        )
+        parser.add_argument(
+            "--from-shards", type=int, default=0,
+            help="Shard count before the change, to drain removed shards"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report channels that would be moved"
+        )
+
+    def handle(self, *args, **options):
+        sources = ["default"] + settings.MESSAGE_SHARDS
+        for i in range(settings.DB_SHARDS, options["from_shards"]):
+            # Removed shards are no longer configured
+            alias = "shard_%d" % i
+            connections.databases[alias] = dict(
+                settings.DATABASES["default"], NAME=settings.DB_SHARD_NAME % i
+            )
+            sources.append(alias)
+
+        total = 0
+        for source in sources:
+            channel_ids = set()
+            for model in (
+                    models.ChannelMessage, models.ChannelMessageArchive,
+                    models.ChannelMessageTombstone
+            ):
+                channel_ids.update(
+                    model.objects.using(source).values_list(
+                        "channel_id", flat=True
+                    ).distinct()
+                )
+            for channel_id in sorted(channel_ids):
+                target = shards.get_shard(channel_id)
+                if target == source:
+                    continue
+                if options["dry_run"]:
+                    self.stdout.write("Would move channel %d: %s -> %s" % (
+                        channel_id, source, target
+                    ))
+                    continue
+
+                moved = shards.move_channel(
+                    channel_id, source, target, options["batch_size"]
+                )
+                total += moved
+                self.stdout.write(
+                    "Moved %d rows of channel %d: %s -> %s"
+                    % (moved, channel_id, source, target)
+                )
+
+        self.stdout.write("Moved %d rows" % total)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from channel import models
+from channel import rollups
+
+
+class Command(BaseCommand):
+    """ Rebuilds participation rollups from channel messages """
+    help = "Backfill or repair per-channel participation rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--channel", type=int, action="append", dest="channels",
+            help="ID of channel to rebuild, may be repeated. Defaults to all"
+        )
+
+    def handle(self, *args, **options):
+        channel_ids = options["channels"]
+        if not channel_ids:
+            channel_ids = models.Channel.objects.order_by("pk").values_list(
+                "pk", flat=True
+            )
+
+        for channel_id in channel_ids:
+            rollups.rebuild(channel_id)
+            self.stdout.write("Rebuilt channel %d" % channel_id)
@@ -0,0 +1,86 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from channel import models
+from channel import purge
+from standup import idempotency
+from standup import settings
+
+
+class Command(BaseCommand):
+    """ Deletes channels and users queued for purging, in batches """
+    help = (
+        "Purge channels and users marked for deletion, channels archived "
+        "for PURGE_AFTER_DAYS, and expired idempotency keys"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--channel", type=int, action="append", dest="channels",
+            default=[], help="ID of channel to mark for purging, may be "
+            "repeated"
+        )
+        parser.add_argument(
+            "--user", type=int, action="append", dest="users", default=[],
+            help="ID of user to mark for purging, may be repeated"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.PURGE_BATCH_SIZE,
+            help="Rows deleted per transaction"
+        )
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep purging until interrupted"
+        )
+        parser.add_argument(
+            "--interval", type=float, default=60,
+            help="Seconds to wait when no purge is pending, with --loop"
+        )
+
+    def handle(self, *args, **options):
+        for channel_id in options["channels"]:
+            try:
+                purge.mark_channel(models.Channel.objects.get(pk=channel_id))
+            except models.Channel.DoesNotExist:
+                raise CommandError("No channel %d" % channel_id)
+        for user_id in options["users"]:
+            try:
+                purge.mark_user(User.objects.get(pk=user_id))
+            except User.DoesNotExist:
+                raise CommandError("No user %d" % user_id)
+
+        while True:
+            expired = purge.mark_expired_channels(timezone.now())
+            if expired:
+                self.stdout.write("Marked %d expired channels" % expired)
+            expired = idempotency.delete_expired(timezone.now())
+            if expired:
+                self.stdout.write(
+                    "Deleted %d expired idempotency keys" % expired
+                )
+
+            jobs = list(models.PurgeJob.objects.filter(
+                dt_finished__isnull=True
+            ).order_by("pk"))
+            for job in jobs:
+                t_start = time.monotonic()
+                self.stdout.write("Purging %s %d" % (job.kind, job.target_id))
+                purge.run_job(job, options["batch_size"], self.report)
+                self.stdout.write("Purged %s %d, %d rows in %.1fs" % (
+                    job.kind, job.target_id, job.deleted,
+                    time.monotonic() - t_start
+                ))
+
+            if not options["loop"]:
+                break
+            if not jobs:
+                time.sleep(options["interval"])
+
+    def report(self, job: models.PurgeJob, deleted: int):
+        """ Writes progress of job after a batch """
+        self.stdout.write("  %s: %d rows, %d total" % (
+            job.step, deleted, job.deleted
+        ))
@@ -0,0 +1,103 @@
+import datetime as dtt
+
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from channel import digest
+from channel import models
+from channel import utils
+from standup import settings
+
+
+class Command(BaseCommand):
+    """ Mails weekly standup digests to channel owners and moderators """
+    help = "Render and mail each channel's digest of a week"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--week", help="ISO date in week of digest, defaults to last week"
+        )
+        parser.add_argument(
+            "--format", choices=sorted(digest.RENDERERS), default="pdf",
+            help="Format of attached digest"
+        )
+        parser.add_argument(
+            "--channel", type=int, action="append", dest="channels",
+            help="ID of channel to mail, may be repeated. Defaults to all"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=settings.DIGEST_WORKERS,
+            help="Processes rendering digests, the number of cores if 0"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Channels read, and emails sent, per batch"
+        )
+
+    def handle(self, *args, **options):
+        if options["week"]:
+            try:
+                dt = utils.parse_iso_date_str(options["week"])
+            except ValueError:
+                raise CommandError("Bad value for week, must be ISO")
+        else:
+            dt = timezone.now().date() - dtt.timedelta(7)
+        dt_week = digest.get_week_start(dt)
+        fmt = options["format"]
+
+        channels = models.Channel.objects.filter(
+            archived=False
+        ).select_related("owner").order_by("pk")
+        if options["channels"]:
+            channels = channels.filter(pk__in=options["channels"])
+        channels = list(channels)
+
+        recipients = {}
+        digests = []
+        batch_size = options["batch_size"]
+        for i in range(0, len(channels), batch_size):
+            batch = channels[i:i + batch_size]
+            members = digest.get_members(batch)
+            for channel in batch:
+                channel_recipients = digest.get_recipients(
+                    channel, members.get(channel.pk, [])
+                )
+                if channel_recipients:
+                    recipients[channel.pk] = channel_recipients
+            batch = [channel for channel in batch if channel.pk in recipients]
+            messages = digest.get_messages(
+                [channel.pk for channel in batch], dt_week
+            )
+            digests += [
+                (channel.pk, digest.build_digest(
+                    channel, dt_week, members.get(channel.pk, []),
+                    messages.get(channel.pk, {})
+                ))
+                for channel in batch
+            ]
+        paths = digest.render_digests(digests, fmt, options["workers"])
+
+        def build_messages():
+            for (channel_id, data), path in zip(digests, paths):
+                message = mail.EmailMessage(
+                    subject="Standup digest: %s, week of %s" % (
+                        data["channel"], data["week"]
+                    ),
+                    body="Standups of %s for the week of %s are attached." % (
+                        data["channel"], data["week"]
+                    ),
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=recipients[channel_id]
+                )
+                with open(path, "rb") as fh:
+                    message.attach(
+                        "%s-%s.%s" % (data["channel"], data["week"], fmt),
+                        fh.read(), digest.FORMATS[fmt]
+                    )
+                yield message
+
+        sent = digest.send_digests(build_messages(), options["batch_size"])
+        self.stdout.write("Sent %d digests of week %s" % (
+            sent, dt_week.isoformat()
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from channel import reminders
+from channel import utils
+
+
+class Command(BaseCommand):
+    """ Notifies channel members who have not posted their standup """
+    help = "Remind members without a message for a date, once per user"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", help="ISO date of standup, defaults to today"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Channels read, and notifications inserted, at a time"
+        )
+
+    def handle(self, *args, **options):
+        if options["date"]:
+            try:
+                dt = utils.parse_iso_date_str(options["date"])
+            except ValueError:
+                raise CommandError("Bad value for date, must be ISO")
+        else:
+            dt = timezone.now().date()
+
+        notified = reminders.send_reminders(dt, options["batch_size"])
+        self.stdout.write("Reminded %d users for %s" % (
+            notified, dt.isoformat()
+        ))
@@ -0,0 +1,133 @@
+""" Mentions of channel members in messages
+
+A mention is "@" followed by a member's email address, or by the part of
+it before the "@", e.g. "@alice" for alice@example.com. Mentions are
+resolved against the members message_channel already loaded, stored in
+the ChannelMention index of the default database and notified in bulk.
+Messages are identified by channel, author and date, which survive the
+moves of shard rebalancing and archiving that change message ids. Editing
+a message updates its mentions, and notifies only users newly mentioned.
+"""
+import datetime as dtt
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from channel import archive
+from channel import models
+from channel import shards
+import notification.models
+
+
+#: Mention of an email address, or of its local part
+MENTION_PATTERN = re.compile(
+    r"(?<![\w@.])@([\w.%+-]+(?:@[\w-]+(?:\.[\w-]+)+)?)"
+)
+
+#: Channel id, author id and date identifying a message
+MessageKey = Tuple[int, int, dtt.date]
+
+
+def find_mentions(message: str, members: Iterable[User]) -> Set[int]:
+    """ Returns ids of members mentioned in message """
+    if "@" not in message:
+        return set()
+    tokens = {
+        token.rstrip(".").lower()
+        for token in MENTION_PATTERN.findall(message)
+    }
+    return {
+        member.pk
+        for member in members
+        if member is not None and (
+            member.email.lower() in tokens
+            or member.email.lower().split("@")[0] in tokens
+        )
+    }
+
+
+def record_mentions(
+        author: User, channel: models.Channel, dt_posted: dtt.date,
+        message: str, members: Iterable[User]
+) -> int:
+    """ Updates mention index for a saved message and notifies new mentions
+
+    :param author: User who posted message
+    :param channel: Channel of message
+    :param dt_posted: Date of message
+    :param message: Message text
+    :param members: Members of channel, owner included
+    :return: Number of users newly mentioned
+    """
+    mentioned = find_mentions(message, members) - {author.pk}
+    mentions = models.ChannelMention.objects.filter(
+        channel=channel, author=author, dt_posted=dt_posted
+    )
+    if not mentioned:
+        # Only an edit can have mentions to remove
+        mentions.delete()
+        return 0
+
+    with transaction.atomic():
+        existing = set(mentions.values_list("user_id", flat=True))
+        removed = existing - mentioned
+        if removed:
+            mentions.filter(user_id__in=removed).delete()
+        added = sorted(mentioned - existing)
+        models.ChannelMention.objects.bulk_create([
+            models.ChannelMention(
+                user_id=user_id, channel=channel, author=author,
+                dt_posted=dt_posted
+            )
+            for user_id in added
+        ], ignore_conflicts=True)
+        notification.models.Notification.objects.bulk_create([
+            notification.models.Notification(
+                user_id=user_id,
+                title="Mention: %s" % channel.name[:16],
+                role="MENTION",
+                message=("%s %s (%s) mentioned you in %s on %s: %s" % (
+                    author.first_name, author.last_name, author.email,
+                    channel.name, dt_posted.isoformat(), message
+                ))[:4096]
+            )
+            for user_id in added
+        ])
+    return len(added)
+
+
+def get_messages(keys: List[MessageKey]) -> Dict[MessageKey, str]:
+    """ Returns text of messages by key, with one query per shard
+
+    Messages not found live are looked up in the archive.
+    """
+    texts: Dict[MessageKey, str] = {}
+    by_shard = shards.group_by_shard({channel_id for channel_id, _, _ in keys})
+    for alias, channel_ids in by_shard.items():
+        filters = Q()
+        for channel_id, user_id, dt_posted in keys:
+            if channel_id in channel_ids:
+                filters |= Q(
+                    channel_id=channel_id, user_id=user_id,
+                    dt_posted=dt_posted
+                )
+        for channel_id, user_id, dt_posted, message in (
+                models.ChannelMessage.objects.using(alias).filter(
+                    filters
+                ).values_list("channel_id", "user_id", "dt_posted", "message")
+        ):
+            texts[(channel_id, user_id, dt_posted)] = message
+
+    for key in keys:
+        if key not in texts:
+            channel_id, user_id, dt_posted = key
+            for archived_user_id, _, message in archive.get_messages(
+                    channel_id, dt_posted, dt_posted
+            ):
+                if archived_user_id == user_id:
+                    texts[key] = message
+    return texts
+
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0007_channelparticipation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='channelmessage',
+            name='channel',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='channel.Channel'),
+        ),
+        migrations.AlterField(
+            model_name='channelmessage',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0008_channelmessage_shardable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelMessageArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt_month', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('dt_archived', models.DateTimeField(auto_now=True)),
+                ('channel', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='channel.Channel')),
+            ],
+            options={
+                'unique_together': {('channel', 'dt_month')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0009_channelmessagearchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channelmessage',
+            name='dt_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='channelmessage',
+            index_together={('channel', 'dt_updated')},
+        ),
+        migrations.CreateModel(
+            name='ChannelMessageTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt_posted', models.DateField()),
+                ('user_email', models.EmailField(max_length=254)),
+                ('dt_removed', models.DateTimeField(auto_now_add=True)),
+                ('channel', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='channel.Channel')),
+            ],
+            options={
+                'index_together': {('channel', 'dt_removed')},
+            },
+        ),
+    ]
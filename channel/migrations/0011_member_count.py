@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_members(apps, schema_editor):
+    Channel = apps.get_model("channel", "Channel")
+    db_alias = schema_editor.connection.alias
+    channels = Channel.objects.using(db_alias).annotate(
+        n_members=Count("channelmember")
+    ).filter(n_members__gt=0)
+    for channel in channels.iterator():
+        Channel.objects.using(db_alias).filter(pk=channel.pk).update(
+            member_count=channel.n_members + 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0010_message_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='member_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(count_members, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:27
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_retention(apps, schema_editor):
+    # Retention of channels archived before now starts with the migration
+    Channel = apps.get_model("channel", "Channel")
+    Channel.objects.using(schema_editor.connection.alias).filter(
+        archived=True
+    ).update(dt_archived=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0011_member_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='dt_archived',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_retention, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PurgeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('channel', 'Channel'), ('user', 'User')], max_length=16)),
+                ('target_id', models.IntegerField()),
+                ('step', models.CharField(blank=True, default='', max_length=64)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('dt_created', models.DateTimeField(auto_now_add=True)),
+                ('dt_updated', models.DateTimeField(auto_now=True)),
+                ('dt_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'target_id')},
+            },
+        ),
+    ]
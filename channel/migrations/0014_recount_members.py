@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:10
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def recount_members(apps, schema_editor):
+    """ Uncounts owners deleted before member_count followed them """
+    Channel = apps.get_model("channel", "Channel")
+    db_alias = schema_editor.connection.alias
+    channels = Channel.objects.using(db_alias).annotate(
+        n_members=Count("channelmember")
+    )
+    for channel in channels.iterator():
+        member_count = channel.n_members + (channel.owner_id is not None)
+        if channel.member_count != member_count:
+            Channel.objects.using(db_alias).filter(pk=channel.pk).update(
+                member_count=member_count
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('channel', '0013_channelmention'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_members, migrations.RunPython.noop),
+    ]
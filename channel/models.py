@@ -15,6 +15,12 @@ class Channel(models.Model):
     #: Soft delete
     archived = models.BooleanField(default=False)
 
+    #: When channel was archived, to purge it after PURGE_AFTER_DAYS
+    dt_archived = models.DateTimeField(null=True, blank=True)
+
+    #: Number of members, owner included. Kept by channel.signals
+    member_count = models.PositiveIntegerField(default=1)
+
     def __str__(self):
         return self.name
 
@@ -74,11 +80,18 @@ class ChannelMessage(models.Model):
     #: Message body posted
     message = models.CharField(max_length=4096)
 
-    #: Author of message
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+    #: Author of message. Without constraint, messages may be on a shard
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=False, db_constraint=False
+    )
 
     #: Message's channel
-    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=False)
+    channel = models.ForeignKey(
+        Channel, on_delete=models.CASCADE, null=False, db_constraint=False
+    )
+
+    #: Last time message was created or edited, for delta sync
+    dt_updated = models.DateTimeField(auto_now=True, null=False)
 
     def __str__(self):
         return "[%s] %s %s: %s" % (
@@ -87,3 +100,145 @@ class ChannelMessage(models.Model):
 
     class Meta:
         unique_together = ("user", "channel", "dt_posted")
+        index_together = ("channel", "dt_updated")
+
+
+class ChannelMessageTombstone(models.Model):
+    """ Record of a removed message, for delta sync """
+    #: Channel of removed message. Without constraint, may be on a shard
+    channel = models.ForeignKey(
+        Channel, on_delete=models.CASCADE, null=False, db_constraint=False
+    )
+
+    #: Date removed message was posted for
+    dt_posted = models.DateField(null=False)
+
+    #: Email address of removed message's author, who may no longer exist
+    user_email = models.EmailField(null=False)
+
+    #: Time of removal
+    dt_removed = models.DateTimeField(auto_now_add=True, null=False)
+
+    def __str__(self):
+        return "[%s] %s %s" % (
+            self.channel.name, self.dt_posted, self.user_email
+        )
+
+    class Meta:
+        index_together = ("channel", "dt_removed")
+
+
+class ChannelParticipation(models.Model):
+    """ Monthly rollup of the days a user posted to a channel """
+    #: Posting user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+
+    #: Channel posted to
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=False)
+
+    #: Year of rollup
+    year = models.PositiveSmallIntegerField(null=False)
+
+    #: Month of rollup, 1-12
+    month = models.PositiveSmallIntegerField(null=False)
+
+    #: Bitmap of days posted, bit 0 is the first of the month
+    days = models.IntegerField(default=0, null=False)
+
+    def __str__(self):
+        return "%s: %s %04d-%02d" % (
+            self.channel.name, self.user.email, self.year, self.month
+        )
+
+    class Meta:
+        unique_together = ("channel", "year", "month", "user")
+
+
+class ChannelMessageArchive(models.Model):
+    """ Compressed month of a channel's messages, see channel.archive """
+    #: Archived channel. Without constraint, archives may be on a shard
+    channel = models.ForeignKey(
+        Channel, on_delete=models.CASCADE, null=False, db_constraint=False
+    )
+
+    #: First day of archived month
+    dt_month = models.DateField(null=False)
+
+    #: Number of messages in segment
+    count = models.PositiveIntegerField(default=0, null=False)
+
+    #: Segment data, see channel.archive.encode_segment
+    data = models.BinaryField(null=False)
+
+    #: Last time segment was written
+    dt_archived = models.DateTimeField(auto_now=True, null=False)
+
+    def __str__(self):
+        return "%s: %s" % (self.channel.name, self.dt_month.strftime("%Y-%m"))
+
+    class Meta:
+        unique_together = ("channel", "dt_month")
+
+
+class PurgeJob(models.Model):
+    """ Deletion of a channel or user in batches, see channel.purge """
+    KIND_CHANNEL = "channel"
+    KIND_USER = "user"
+
+    #: Kind of entity purged
+    kind = models.CharField(max_length=16, choices=(
+        (KIND_CHANNEL, "Channel"), (KIND_USER, "User")
+    ))
+
+    #: ID of channel or user purged
+    target_id = models.IntegerField()
+
+    #: Table currently being deleted from, empty until started
+    step = models.CharField(max_length=64, default="", blank=True)
+
+    #: Rows deleted so far
+    deleted = models.PositiveIntegerField(default=0)
+
+    #: When purge was requested
+    dt_created = models.DateTimeField(auto_now_add=True)
+
+    #: Last progress of purge
+    dt_updated = models.DateTimeField(auto_now=True)
+
+    #: When entity was deleted, null while purge is pending
+    dt_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s %d: %s" % (self.kind, self.target_id, self.step or "-")
+
+    class Meta:
+        unique_together = ("kind", "target_id")
+
+
+class ChannelMention(models.Model):
+    """ Mention of a user in a message, see channel.mentions """
+    #: Mentioned user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+
+    #: Channel of message
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=False)
+
+    #: Author of message
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=False, related_name="+"
+    )
+
+    #: Date of message, which is unique per author and channel
+    dt_posted = models.DateField(null=False)
+
+    #: When mention was first made
+    dt_created = models.DateTimeField(auto_now_add=True, null=False)
+
+    def __str__(self):
+        return "%s: %s %s" % (
+            self.user.email, self.channel.name, self.dt_posted
+        )
+
+    class Meta:
+        unique_together = ("channel", "author", "dt_posted", "user")
+        index_together = ("user", "dt_posted")
@@ -0,0 +1,204 @@
+""" Deletion of channels and users in bounded batches
+
+Deleting a Channel or User row cascades through every table referring to
+it in one transaction, which holds locks for as long as a large channel
+takes. Instead, mark_channel and mark_user record a PurgeJob, and run_job
+deletes the rows depending on the entity table by table, in transactions
+of at most PURGE_BATCH_SIZE rows by primary key, before deleting the
+entity itself, whose cascade then finds little left. Progress is saved on
+the job after each batch, and an interrupted purge resumes when run again.
+Channels archived for PURGE_AFTER_DAYS are marked by mark_expired_channels.
+"""
+import datetime as dtt
+import functools
+from typing import Callable, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from channel import daycache
+from channel import models
+from channel import shards
+import notification.models
+import standup.db
+from standup import settings
+
+
+#: Name, database, rows and optional hook run on each batch before its
+#: deletion, of a step of a purge
+Step = Tuple[str, str, QuerySet, Optional[Callable[[str, QuerySet], None]]]
+
+
+def mark_channel(channel: models.Channel) -> models.PurgeJob:
+    """ Archives channel and queues it for purging """
+    channel.archived = True
+    if channel.dt_archived is None:
+        channel.dt_archived = timezone.now()
+    channel.save()
+    job, _ = models.PurgeJob.objects.get_or_create(
+        kind=models.PurgeJob.KIND_CHANNEL, target_id=channel.pk
+    )
+    return job
+
+
+def mark_user(user: User) -> models.PurgeJob:
+    """ Deactivates user and queues it for purging """
+    user.is_active = False
+    user.save()
+    job, _ = models.PurgeJob.objects.get_or_create(
+        kind=models.PurgeJob.KIND_USER, target_id=user.pk
+    )
+    return job
+
+
+def mark_expired_channels(now: dtt.datetime) -> int:
+    """ Queues channels archived for PURGE_AFTER_DAYS for purging
+
+    :return: Number of channels queued
+    """
+    if settings.PURGE_AFTER_DAYS is None:
+        return 0
+    channel_ids = list(models.Channel.objects.filter(
+        archived=True,
+        dt_archived__lt=now - dtt.timedelta(settings.PURGE_AFTER_DAYS)
+    ).exclude(
+        pk__in=models.PurgeJob.objects.filter(
+            kind=models.PurgeJob.KIND_CHANNEL
+        ).values("target_id")
+    ).values_list("pk", flat=True))
+    models.PurgeJob.objects.bulk_create([
+        models.PurgeJob(kind=models.PurgeJob.KIND_CHANNEL, target_id=pk)
+        for pk in channel_ids
+    ], ignore_conflicts=True)
+    return len(channel_ids)
+
+
+def is_purging(channel: models.Channel) -> bool:
+    """ Checks if channel is queued for purging """
+    return models.PurgeJob.objects.filter(
+        kind=models.PurgeJob.KIND_CHANNEL, target_id=channel.pk
+    ).exists()
+
+
+def tombstone_messages(user_email: str, alias: str, messages: QuerySet):
+    """ Records removal of batch of messages of user for delta sync """
+    days = list(messages.values_list("channel_id", "dt_posted"))
+    models.ChannelMessageTombstone.objects.using(alias).bulk_create([
+        models.ChannelMessageTombstone(
+            channel_id=channel_id, dt_posted=dt_posted, user_email=user_email
+        )
+        for channel_id, dt_posted in days
+    ])
+    daycache.invalidate(days, alias)
+
+
+def get_steps(job: models.PurgeJob) -> List[Step]:
+    """ Returns steps deleting rows depending on entity of job, in order """
+    steps: List[Step] = []
+    if job.kind == models.PurgeJob.KIND_CHANNEL:
+        alias = shards.get_shard(job.target_id)
+        for model in (
+                models.ChannelMessage, models.ChannelMessageArchive,
+                models.ChannelMessageTombstone
+        ):
+            steps.append((
+                model._meta.model_name, alias,
+                model.objects.using(alias).filter(channel_id=job.target_id),
+                None
+            ))
+        filters = {"channel_id": job.target_id}
+        mentions = models.ChannelMention.objects.filter(**filters)
+        # Invites go with their notifications
+        notifications = notification.models.Notification.objects.filter(
+            channelinvite__channel_id=job.target_id
+        )
+    else:
+        # Messages of user may be in channels of every shard
+        user_email = User.objects.filter(pk=job.target_id).values_list(
+            "email", flat=True
+        ).first() or ""
+        for alias in shards.get_shards():
+            steps.append((
+                "channelmessage", alias,
+                models.ChannelMessage.objects.using(alias).filter(
+                    user_id=job.target_id
+                ),
+                functools.partial(tombstone_messages, user_email)
+            ))
+        filters = {"user_id": job.target_id}
+        mentions = models.ChannelMention.objects.filter(
+            Q(user_id=job.target_id) | Q(author_id=job.target_id)
+        )
+        notifications = notification.models.Notification.objects.filter(
+            **filters
+        )
+
+    steps.append((
+        "channelparticipation", "default",
+        models.ChannelParticipation.objects.filter(**filters), None
+    ))
+    steps.append(("channelmention", "default", mentions, None))
+    steps.append(("notification", "default", notifications, None))
+    steps.append((
+        "channelinvite", "default",
+        models.ChannelInvite.objects.filter(**filters), None
+    ))
+    steps.append((
+        "channelmember", "default",
+        models.ChannelMember.objects.filter(**filters), None
+    ))
+    return steps
+
+
+def delete_batch(step: Step, batch_size: int) -> int:
+    """ Deletes the next batch of rows of step in a transaction
+
+    :return: Number of rows deleted, 0 once step is done
+    """
+    _, alias, rows, before_delete = step
+    with standup.db.immediate_atomic(alias):
+        pks = list(
+            rows.order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if pks:
+            batch = rows.model.objects.using(alias).filter(pk__in=pks)
+            if before_delete is not None:
+                before_delete(alias, batch)
+            batch.delete()
+    return len(pks)
+
+
+def run_job(
+        job: models.PurgeJob, batch_size: int,
+        progress: Optional[Callable[[models.PurgeJob, int], None]] = None
+):
+    """ Purges entity of job, then marks job finished
+
+    :param job: Job to run, pending or interrupted
+    :param batch_size: Rows deleted per transaction
+    :param progress: Optional function called with job and rows deleted
+    after each batch
+    """
+    for step in get_steps(job):
+        job.step = step[0]
+        while True:
+            deleted = delete_batch(step, batch_size)
+            if not deleted:
+                break
+            job.deleted += deleted
+            job.save(update_fields=["step", "deleted", "dt_updated"])
+            if progress is not None:
+                progress(job, deleted)
+
+    if job.kind == models.PurgeJob.KIND_CHANNEL:
+        model = models.Channel
+    else:
+        model = User
+    with transaction.atomic():
+        # Cascades to rows added since their step ran
+        model.objects.filter(pk=job.target_id).delete()
+        job.step = "done"
+        job.dt_finished = timezone.now()
+        job.save()
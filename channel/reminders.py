@@ -0,0 +1,122 @@
+""" Reminders for members who have not posted their standup for a date
+
+send_reminders reads channels in batches of primary keys. For each batch
+and message shard, one query of the default database selects memberships
+of active users, owners included, that have no message on the date. With
+messages in the default database their absence is checked by a subquery,
+a shard database is read for the posters of its channels first, which
+the query excludes. Missing channels are gathered per
+user across all batches, so a user of several channels gets a single
+notification naming them, and a Reminder row per user and date keeps later
+runs from sending it again. Meant to be run by one scheduled job at a time.
+"""
+import datetime as dtt
+from typing import Dict, List, Tuple
+
+from django.db.models import Exists, OuterRef
+
+from channel import models
+from channel import shards
+import notification.models
+import standup.db
+
+
+def find_missing(
+        channels: List[Tuple[int, str]], dt: dtt.date
+) -> Dict[int, List[str]]:
+    """ Returns names of channels each member has not posted to on date
+
+    :param channels: ID and name of channels
+    :param dt: Date of standup
+    :return: Channel names by user id
+    """
+    names = dict(channels)
+    pairs = []
+    for alias, channel_ids in shards.group_by_shard(names).items():
+        members = models.ChannelMember.objects.filter(
+            channel_id__in=channel_ids, user__is_active=True
+        )
+        owners = models.Channel.objects.filter(
+            pk__in=channel_ids, owner__is_active=True
+        )
+        posted = models.ChannelMessage.objects.using(alias).filter(
+            dt_posted=dt
+        )
+        if alias == "default":
+            members = members.annotate(posted=Exists(posted.filter(
+                channel_id=OuterRef("channel_id"), user_id=OuterRef("user_id")
+            ))).filter(posted=False)
+            owners = owners.annotate(posted=Exists(posted.filter(
+                channel_id=OuterRef("pk"), user_id=OuterRef("owner_id")
+            ))).filter(posted=False)
+        else:
+            # Shards cannot be joined, their posters are excluded by channel
+            posters: Dict[int, List[int]] = {}
+            for channel_id, user_id in posted.filter(
+                    channel_id__in=channel_ids
+            ).values_list("channel_id", "user_id").distinct():
+                posters.setdefault(channel_id, []).append(user_id)
+            for channel_id, user_ids in posters.items():
+                members = members.exclude(
+                    channel_id=channel_id, user_id__in=user_ids
+                )
+                owners = owners.exclude(pk=channel_id, owner_id__in=user_ids)
+        pairs += members.values_list("channel_id", "user_id").union(
+            owners.values_list("pk", "owner_id")
+        )
+
+    missing: Dict[int, List[str]] = {}
+    for channel_id, user_id in sorted(pairs):
+        missing.setdefault(user_id, []).append(names[channel_id])
+    return missing
+
+
+def send_reminders(dt: dtt.date, batch_size: int = 500) -> int:
+    """ Notifies members of active channels who did not post on date
+
+    :param dt: Date of standup
+    :param batch_size: Channels read, and notifications inserted, at a time
+    :return: Number of users notified
+    """
+    missing: Dict[int, List[str]] = {}
+    last_pk = 0
+    while True:
+        channels = list(
+            models.Channel.objects.filter(
+                archived=False, pk__gt=last_pk
+            ).order_by("pk").values_list("pk", "name")[:batch_size]
+        )
+        if not channels:
+            break
+        last_pk = channels[-1][0]
+        for user_id, channel_names in find_missing(channels, dt).items():
+            missing.setdefault(user_id, []).extend(channel_names)
+
+    user_ids = sorted(missing)
+    notified = 0
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i:i + batch_size]
+        with standup.db.immediate_atomic():
+            reminded = set(
+                notification.models.Reminder.objects.filter(
+                    user_id__in=batch, dt_date=dt
+                ).values_list("user_id", flat=True)
+            )
+            batch = [user_id for user_id in batch if user_id not in reminded]
+            notification.models.Notification.objects.bulk_create([
+                notification.models.Notification(
+                    user_id=user_id,
+                    title="Standup Reminder: %s" % dt.isoformat(),
+                    role="REMINDER",
+                    message="You have not posted your standup for %s to %s" % (
+                        dt.isoformat(), ", ".join(missing[user_id])
+                    )[:4096]
+                )
+                for user_id in batch
+            ])
+            notification.models.Reminder.objects.bulk_create([
+                notification.models.Reminder(user_id=user_id, dt_date=dt)
+                for user_id in batch
+            ], ignore_conflicts=True)
+        notified += len(batch)
+    return notified
@@ -0,0 +1,199 @@
+import calendar
+import datetime as dtt
+import itertools
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from channel import archive
+from channel import models
+from channel import shards
+
+
+#: Channel id, year and month of a rollup
+MonthKey = Tuple[int, int, int]
+
+#: Years stats can be built for, as the previous year is loaded too
+MIN_STATS_YEAR = dtt.MINYEAR + 1
+MAX_STATS_YEAR = dtt.MAXYEAR
+
+
+def record_post(channel_id: int, user_id: int, dt_posted: dtt.date):
+    """ Marks day as posted in user's monthly participation rollup """
+    bit = 1 << (dt_posted.day - 1)
+    rollups = models.ChannelParticipation.objects.filter(
+        channel_id=channel_id, user_id=user_id,
+        year=dt_posted.year, month=dt_posted.month
+    )
+    if rollups.update(days=F("days").bitor(bit)):
+        return
+
+    try:
+        with transaction.atomic():
+            models.ChannelParticipation.objects.create(
+                channel_id=channel_id, user_id=user_id,
+                year=dt_posted.year, month=dt_posted.month, days=bit
+            )
+    except IntegrityError:
+        # Row created by concurrent post
+        rollups.update(days=F("days").bitor(bit))
+
+
+def rebuild(
+        channel_id: int, months: Optional[Iterable[Tuple[int, int]]] = None
+):
+    """ Recomputes participation rollups of channel from its messages,
+    archived or not
+
+    :param channel_id: ID of channel to rebuild
+    :param months: Optional (year, month) pairs to limit rebuild to
+    """
+    messages = shards.messages_for(channel_id)
+    rollups = models.ChannelParticipation.objects.filter(channel_id=channel_id)
+    dt_start = dt_end = None
+    if months is not None:
+        months = set(months)
+        if not months:
+            return
+        dt_start = dtt.date(*min(months), 1)
+        year, month = max(months)
+        dt_end = dtt.date(year, month, calendar.monthrange(year, month)[1])
+        messages = messages.filter(
+            dt_posted__gte=dt_start, dt_posted__lte=dt_end
+        )
+
+    posts = itertools.chain(
+        messages.values_list("user_id", "dt_posted"),
+        (
+            (user_id, dt_posted) for user_id, dt_posted, _
+            in archive.get_messages(channel_id, dt_start, dt_end)
+        )
+    )
+    bitmaps: Dict[Tuple[int, int, int], int] = {}
+    for user_id, dt_posted in posts:
+        if months and (dt_posted.year, dt_posted.month) not in months:
+            continue
+        key = (user_id, dt_posted.year, dt_posted.month)
+        bitmaps[key] = bitmaps.get(key, 0) | 1 << (dt_posted.day - 1)
+
+    with transaction.atomic():
+        if months is None:
+            rollups.delete()
+        else:
+            for year, month in months:
+                rollups.filter(year=year, month=month).delete()
+        models.ChannelParticipation.objects.bulk_create([
+            models.ChannelParticipation(
+                channel_id=channel_id, user_id=user_id,
+                year=year, month=month, days=days
+            )
+            for (user_id, year, month), days in bitmaps.items()
+        ], batch_size=500)
+
+
+def refresh_months(keys: Iterable[MonthKey]):
+    """ Rebuilds rollups for given (channel id, year, month) keys """
+    by_channel: Dict[int, Set[Tuple[int, int]]] = {}
+    for channel_id, year, month in keys:
+        by_channel.setdefault(channel_id, set()).add((year, month))
+    for channel_id, months in by_channel.items():
+        rebuild(channel_id, months)
+
+
+def get_posted_days(
+        channel: models.Channel, dt_start: dtt.date, dt_end: dtt.date
+) -> Dict[int, Set[dtt.date]]:
+    """ Returns set of days posted per user id in date range """
+    rollups = models.ChannelParticipation.objects.filter(
+        channel=channel, year__gte=dt_start.year, year__lte=dt_end.year
+    ).values_list("user_id", "year", "month", "days")
+
+    posted: Dict[int, Set[dtt.date]] = {}
+    for user_id, year, month, days in rollups:
+        user_days = posted.setdefault(user_id, set())
+        day = 1
+        while days:
+            if days & 1:
+                dt = dtt.date(year, month, day)
+                if dt_start <= dt <= dt_end:
+                    user_days.add(dt)
+            days >>= 1
+            day += 1
+    return posted
+
+
+def get_longest_streak(days: Set[dtt.date]) -> int:
+    """ Returns longest run of consecutive posting days """
+    longest = 0
+    for dt in days:
+        if dt - dtt.timedelta(1) in days:
+            continue
+        # Start of a streak
+        length = 1
+        while dt + dtt.timedelta(length) in days:
+            length += 1
+        longest = max(longest, length)
+    return longest
+
+
+def get_current_streak(days: Set[dtt.date], today: dtt.date) -> int:
+    """ Returns run of consecutive posting days up to today
+
+    The streak still counts if the user has not posted yet today.
+    """
+    current = 0
+    dt = today if today in days else today - dtt.timedelta(1)
+    while dt in days:
+        current += 1
+        dt -= dtt.timedelta(1)
+    return current
+
+
+def get_channel_stats(
+        channel: models.Channel, members: List[User], year: int,
+        today: dtt.date
+) -> Dict:
+    """ Builds participation stats for channel members over a year
+
+    Current streaks may run over from the previous year, so its rollups are
+    loaded as well.
+    """
+    dt_year_start = dtt.date(year, 1, 1)
+    dt_year_end = dtt.date(year, 12, 31)
+    posted = get_posted_days(
+        channel, dtt.date(year - 1, 1, 1), min(dt_year_end, today)
+    )
+    n_days = max((min(dt_year_end, today) - dt_year_start).days + 1, 0)
+
+    heatmap = [0] * ((dt_year_end - dt_year_start).days + 1)
+    stats = []
+    for member in members:
+        days = posted.get(member.pk, set())
+        year_days = {dt for dt in days if dt.year == year}
+        for dt in year_days:
+            heatmap[(dt - dt_year_start).days] += 1
+
+        stats.append({
+            "user": {
+                "email": member.email,
+                "first_name": member.first_name,
+                "last_name": member.last_name
+            },
+            "days_posted": len(year_days),
+            "rate": round(len(year_days) / n_days, 4) if n_days else 0,
+            "current_streak": get_current_streak(
+                days, min(dt_year_end, today)
+            ),
+            "longest_streak": get_longest_streak(year_days),
+        })
+
+    return {
+        "year": year,
+        "members": stats,
+        "heatmap": {
+            "dt_start": dt_year_start,
+            "counts": heatmap,
+        },
+    }
@@ -0,0 +1,141 @@
+""" Placement of channel messages across database shards
+
+With MESSAGE_SHARDS configured, ChannelMessage rows live in the shard of
+their channel, get_shard, and every other model stays in the default
+database. The router sends saves of a message to its shard, but querysets
+carry no channel, so code reading or bulk writing messages picks the
+database itself through messages_for, messages_in or get_shard. Shards
+hold no users or channels to join, so related rows of messages are loaded
+with prefetch_related, which the router sends to the default database.
+
+Notifications are meant to be sharded by user id the same way once they
+outgrow the default database, by adding them to SHARD_KEYS.
+"""
+from typing import Dict, Iterable, List
+
+from django.db.models import QuerySet
+
+from channel import models
+import standup.db
+from standup import settings
+
+
+#: Attribute holding the shard key of each sharded model
+SHARD_KEYS = {
+    "channel.channelmessage": "channel_id",
+    "channel.channelmessagearchive": "channel_id",
+    "channel.channelmessagetombstone": "channel_id",
+}
+
+
+def get_shards() -> List[str]:
+    """ Returns aliases of databases holding channel messages """
+    return settings.MESSAGE_SHARDS or ["default"]
+
+
+def get_shard(key: int) -> str:
+    """ Returns alias of shard holding rows of shard key, e.g. channel id """
+    shards = get_shards()
+    return shards[int(key) % len(shards)]
+
+
+def group_by_shard(keys: Iterable[int]) -> Dict[str, List[int]]:
+    """ Groups shard keys by alias of their shard """
+    groups: Dict[str, List[int]] = {}
+    for key in keys:
+        groups.setdefault(get_shard(key), []).append(key)
+    return groups
+
+
+def messages_for(channel_id: int) -> QuerySet:
+    """ Returns messages of channel, from its shard """
+    return models.ChannelMessage.objects.using(
+        get_shard(channel_id)
+    ).filter(channel_id=channel_id)
+
+
+def messages_in(channel_ids: Iterable[int]) -> List[QuerySet]:
+    """ Returns messages of channels as one queryset per shard """
+    return [
+        models.ChannelMessage.objects.using(alias).filter(
+            channel_id__in=shard_channel_ids
+        )
+        for alias, shard_channel_ids in group_by_shard(channel_ids).items()
+    ]
+
+
+def move_channel(
+        channel_id: int, source: str, target: str, batch_size: int = 1000
+) -> int:
+    """ Moves messages, archives and tombstones of channel between databases
+
+    Each batch is committed to the target before it is deleted from the
+    source, so an interrupted move can be run again. Copies get new ids,
+    and a row already in the target, saved after the channel's shard
+    changed, is kept over its older copy. Copies of tombstones are stamped
+    with the time of the move, so delta sync clients that synced past their
+    removal on the source are sent them again from the target.
+
+    :return: Number of messages, segments and tombstones moved
+    """
+    moved = 0
+    for model, fields in (
+            (models.ChannelMessage, ("user_id", "dt_posted", "message")),
+            (models.ChannelMessageArchive, (
+                "dt_month", "count", "data", "dt_archived"
+            )),
+            (models.ChannelMessageTombstone, ("dt_posted", "user_email")),
+    ):
+        source_rows = model.objects.using(source).filter(
+            channel_id=channel_id
+        )
+        while True:
+            batch = list(source_rows.order_by("pk")[:batch_size])
+            if not batch:
+                break
+
+            with standup.db.immediate_atomic(target):
+                model.objects.using(target).bulk_create([
+                    model(channel_id=channel_id, **{
+                        field: getattr(row, field) for field in fields
+                    })
+                    for row in batch
+                ], ignore_conflicts=True)
+            with standup.db.immediate_atomic(source):
+                source_rows.filter(pk__in=[row.pk for row in batch]).delete()
+            moved += len(batch)
+    return moved
+
+
+class ShardRouter:
+    """ Routes sharded models to their shard, everything else to default """
+    @staticmethod
+    def is_sharded(model) -> bool:
+        return model._meta.label_lower in SHARD_KEYS
+
+    def db_for_read(self, model, **hints):
+        if not settings.MESSAGE_SHARDS:
+            return None
+        if not self.is_sharded(model):
+            # Also for relations of rows read from a shard
+            return "default"
+
+        instance = hints.get("instance")
+        if isinstance(instance, model):
+            key = getattr(instance, SHARD_KEYS[model._meta.label_lower])
+            if key is not None:
+                return get_shard(key)
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.is_sharded(type(obj1)) or self.is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.MESSAGE_SHARDS:
+            # Default database keeps its message table to rebalance from
+            return None
+        return "%s.%s" % (app_label, model_name) in SHARD_KEYS
@@ -0,0 +1,78 @@
+from django.db.models import F
+
+from channel import daycache
+from channel import models
+from channel import shards
+from standup import settings
+
+
+def delete_messages(sender, instance, **kwargs):
+    """ Removes messages of a deleted channel or user
+
+    Connected to pre_delete of Channel and User. Messages of a deleted user
+    leave tombstones for delta sync of their channels. With message shards,
+    messages are deleted here, as the cascade of the default database does
+    not reach other databases. Archived messages of a deleted user are left
+    in their segments, and skipped by readers.
+    """
+    if isinstance(instance, models.Channel):
+        if settings.MESSAGE_SHARDS:
+            alias = shards.get_shard(instance.pk)
+            for model in (
+                    models.ChannelMessage, models.ChannelMessageArchive,
+                    models.ChannelMessageTombstone
+            ):
+                model.objects.using(alias).filter(
+                    channel_id=instance.pk
+                ).delete()
+        return
+
+    for alias in shards.get_shards():
+        messages = models.ChannelMessage.objects.using(alias).filter(
+            user_id=instance.pk
+        )
+        days = list(messages.values_list("channel_id", "dt_posted"))
+        models.ChannelMessageTombstone.objects.using(alias).bulk_create([
+            models.ChannelMessageTombstone(
+                channel_id=channel_id, dt_posted=dt_posted,
+                user_email=instance.email
+            )
+            for channel_id, dt_posted in days
+        ])
+        daycache.invalidate(days, alias)
+        if settings.MESSAGE_SHARDS:
+            messages.delete()
+
+
+def remove_owner(sender, instance, **kwargs):
+    """ Uncounts a deleted user from member_count of the channels it owns
+
+    Connected to pre_delete of User, before owner of its channels is set to
+    null.
+    """
+    models.Channel.objects.filter(owner_id=instance.pk).update(
+        member_count=F("member_count") - 1
+    )
+
+
+def add_member(sender, instance, created, raw=False, **kwargs):
+    """ Counts a new membership in member_count of its channel
+
+    Connected to post_save of ChannelMember. Fixtures loaded raw carry the
+    counts of their channels already.
+    """
+    if created and not raw:
+        models.Channel.objects.filter(pk=instance.channel_id).update(
+            member_count=F("member_count") + 1
+        )
+
+
+def remove_member(sender, instance, **kwargs):
+    """ Uncounts a deleted membership from member_count of its channel
+
+    Connected to post_delete of ChannelMember, so also runs for memberships
+    removed by the cascade of a deleted user.
+    """
+    models.Channel.objects.filter(pk=instance.channel_id).update(
+        member_count=F("member_count") - 1
+    )
@@ -0,0 +1,102 @@
+""" Durable local spool of channel messages for burst posting
+
+With BURST_POSTING set, message_channel validates a post and appends it to
+a SQLite queue file instead of writing ChannelMessage. The
+flush_message_spool command drains the queue in batches through
+upsert_messages, committing many posts per database transaction. The
+spool is local, so the flusher and all web workers must share a host.
+"""
+import datetime as dtt
+import sqlite3
+import threading
+import time
+from typing import List, Tuple
+
+from channel import utils
+from standup import settings
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    dt_posted TEXT NOT NULL,
+    message TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spool_channel_user
+    ON spool (channel_id, user_id, dt_posted);
+"""
+
+_local = threading.local()
+
+
+def connect() -> sqlite3.Connection:
+    """ Returns spool connection of current thread """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            settings.MESSAGE_SPOOL_PATH, timeout=30, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # Posts are acknowledged once spooled, so they must reach the disk
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def enqueue(
+        user_id: int, channel_id: int, dt_posted: dtt.date, message: str
+) -> int:
+    """ Appends message to spool, returning its spool id """
+    cursor = connect().execute(
+        "INSERT INTO spool (user_id, channel_id, dt_posted, message, ts) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (user_id, channel_id, dt_posted.isoformat(), message, time.time())
+    )
+    return cursor.lastrowid
+
+
+def get_pending(
+        user_id: int, channel_id: int, dt_start: dtt.date, dt_end: dtt.date
+) -> List[Tuple[dtt.date, str]]:
+    """ Returns user's spooled messages for channel in date range
+
+    Later posts for the same date come last.
+    """
+    rows = connect().execute(
+        "SELECT dt_posted, message FROM spool WHERE channel_id = ? "
+        "AND user_id = ? AND dt_posted >= ? AND dt_posted <= ? ORDER BY id",
+        (channel_id, user_id, dt_start.isoformat(), dt_end.isoformat())
+    )
+    return [
+        (dtt.date.fromisoformat(dt_posted), message)
+        for dt_posted, message in rows
+    ]
+
+
+def flush(batch_size: int = 500) -> int:
+    """ Writes oldest batch of spooled messages to database
+
+    Rows are removed from the spool only after their database transaction
+    commits. If the flusher dies in between, the batch is written again,
+    which upsert_messages makes harmless.
+
+    :return: Number of spooled messages flushed
+    """
+    conn = connect()
+    rows = conn.execute(
+        "SELECT id, user_id, channel_id, dt_posted, message FROM spool "
+        "ORDER BY id LIMIT ?", (batch_size,)
+    ).fetchall()
+    if not rows:
+        return 0
+
+    utils.upsert_messages([
+        (user_id, channel_id, dtt.date.fromisoformat(dt_posted), message)
+        for _, user_id, channel_id, dt_posted, message in rows
+    ], batch_size=batch_size)
+    conn.execute("DELETE FROM spool WHERE id <= ?", (rows[-1][0],))
+    return len(rows)
@@ -1,3 +1,1186 @@
-from django.test import TestCase
+import datetime as dtt
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+
+from channel import archive
+from channel import daycache
+from channel import digest
+from channel import mentions
+from channel import models
+from channel import purge
+from channel import reminders
+from channel import rollups
+from channel import shards
+from channel import spool
+from channel import utils
+from channel.management.commands import import_standups
+import notification.models
+from standup import settings
+from standup.testing import ApiTestCase
+import standup.utils
+
+
+class ImportStandupsTest(ApiTestCase):
+    def import_records(self, records, fmt="jsonl"):
+        """ Runs import_standups on records, returning its stderr """
+        fd, path = tempfile.mkstemp(suffix="." + fmt)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w", newline="") as fh:
+            if fmt == "csv":
+                fh.write("channel,user_email,date,message\n")
+                for record in records:
+                    fh.write(",".join(
+                        str(record[field]) for field in (
+                            "channel", "user_email", "date", "message"
+                        )
+                    ) + "\n")
+            else:
+                for record in records:
+                    fh.write(json.dumps(record) + "\n")
+        stderr = io.StringIO()
+        call_command(
+            "import_standups", path, stdout=io.StringIO(), stderr=stderr
+        )
+        return stderr.getvalue()
+
+    def get_messages(self):
+        return dict(
+            shards.messages_for(self.channel.pk).values_list(
+                "dt_posted", "message"
+            )
+        )
+
+    def test_creates_and_updates_messages(self):
+        records = [
+            {
+                "channel": self.channel.pk, "user_email": "MILO@example.com",
+                "date": "2020-01-0%d" % day, "message": "day %d" % day
+            }
+            for day in (1, 2)
+        ]
+        self.import_records(records)
+        records[1]["message"] = "edited"
+        self.import_records(records)
+
+        self.assertEqual(self.get_messages(), {
+            dtt.date(2020, 1, 1): "day 1", dtt.date(2020, 1, 2): "edited"
+        })
+        self.assertEqual(
+            models.ChannelParticipation.objects.get(
+                user=self.member, year=2020, month=1
+            ).days, 0b11
+        )
+
+    def test_resolves_channel_by_name_in_csv(self):
+        self.import_records([{
+            "channel": "team", "user_email": "olive@example.com",
+            "date": "2020-01-01", "message": "hello"
+        }], fmt="csv")
+        self.assertEqual(
+            self.get_messages(), {dtt.date(2020, 1, 1): "hello"}
+        )
+
+    def test_skips_invalid_records(self):
+        User.objects.create_user(
+            username="nina@example.com", email="nina@example.com"
+        )
+        stderr = self.import_records([
+            {
+                "channel": self.channel.pk, "user_email": "nina@example.com",
+                "date": "2020-01-01", "message": "not a member"
+            },
+            {
+                "channel": self.channel.pk, "user_email": "milo@example.com",
+                "date": "2020-01-02",
+                "message": "x" * (utils.MAX_MESSAGE_LENGTH + 1)
+            },
+            {
+                "channel": self.channel.pk, "user_email": "nobody@example.com",
+                "date": "2020-01-03", "message": "unknown user"
+            },
+            {
+                "channel": "missing", "user_email": "milo@example.com",
+                "date": "2020-01-04", "message": "unknown channel"
+            },
+            {
+                "channel": self.channel.pk, "user_email": "milo@example.com",
+                "date": "yesterday", "message": "bad date"
+            },
+        ])
+
+        self.assertEqual(self.get_messages(), {})
+        self.assertIn("Not a member of channel", stderr)
+        self.assertIn("Message too long", stderr)
+        self.assertIn("Unknown user: nobody@example.com", stderr)
+        self.assertIn("Unknown channel: missing", stderr)
+
+    def test_resolves_users_in_one_query(self):
+        for name in ("Nina", "Otto"):
+            user = User.objects.create_user(
+                username=name, email="%s@Example.com" % name
+            )
+            models.ChannelMember.objects.create(
+                user=user, channel=self.channel
+            )
+        command = import_standups.Command(stderr=io.StringIO())
+        command.user_ids = {}
+        with self.assertNumQueries(1):
+            command.cache_users({
+                "nina@example.com", "otto@example.com", "pia@example.com"
+            })
+        self.assertIsNotNone(command.user_ids["nina@example.com"])
+        self.assertIsNotNone(command.user_ids["otto@example.com"])
+        self.assertIsNone(command.user_ids["pia@example.com"])
+
+    def test_reports_ambiguous_channel_once(self):
+        models.Channel.objects.create(owner=self.member, name="team")
+        stderr = self.import_records([{
+            "channel": "team", "user_email": "olive@example.com",
+            "date": "2020-01-01", "message": "hello"
+        }])
+        self.assertEqual(stderr.strip(), "Ambiguous channel name: team")
+        self.assertEqual(self.get_messages(), {})
+
+    def test_message_channel_rejects_long_message(self):
+        response, body = self.call(
+            "post", "/channel/message", channel_id=self.channel.pk,
+            dt_posted=dtt.date.today().isoformat(),
+            message="x" * (utils.MAX_MESSAGE_LENGTH + 1)
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(body["error"], "MESSAGE_TOO_LONG")
+
+
+class ChannelStatsTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for dt in ("2019-12-31", "2020-01-01", "2020-01-02", "2020-01-05"):
+            utils.save_channel_message(
+                self.member, self.channel, utils.parse_iso_date_str(dt), "x"
+            )
+
+    def test_stats_of_year(self):
+        response, body = self.call(
+            "get", "/channel/stats", channel_id=self.channel.pk, year=2020
+        )
+        self.assertEqual(response.status_code, 200)
+        stats = {
+            member["user"]["email"]: member
+            for member in body["payload"]["members"]
+        }
+        self.assertEqual(stats["milo@example.com"]["days_posted"], 3)
+        self.assertEqual(stats["milo@example.com"]["longest_streak"], 2)
+        self.assertEqual(stats["olive@example.com"]["days_posted"], 0)
+        self.assertEqual(
+            body["payload"]["heatmap"]["counts"][:5], [1, 1, 0, 0, 1]
+        )
+
+    def test_current_streak_waits_for_today(self):
+        today = dtt.date(2020, 3, 10)
+        days = {today - dtt.timedelta(1), today - dtt.timedelta(2)}
+        self.assertEqual(rollups.get_current_streak(days, today), 2)
+        self.assertEqual(rollups.get_current_streak(
+            days | {today}, today
+        ), 3)
+        self.assertEqual(rollups.get_current_streak(
+            days, today + dtt.timedelta(1)
+        ), 0)
+
+    def test_rebuild_restores_rollups(self):
+        expected = set(models.ChannelParticipation.objects.values_list(
+            "user_id", "year", "month", "days"
+        ))
+        models.ChannelParticipation.objects.all().delete()
+        call_command(
+            "rebuild_participation", channel=[self.channel.pk],
+            stdout=io.StringIO()
+        )
+        self.assertEqual(set(models.ChannelParticipation.objects.values_list(
+            "user_id", "year", "month", "days"
+        )), expected)
+
+    def test_rejects_bad_year(self):
+        for year in (1, 10000, "last"):
+            response, body = self.call(
+                "get", "/channel/stats", channel_id=self.channel.pk,
+                year=year
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(body["message"], "Bad value for year")
+
+    def test_requires_membership(self):
+        User.objects.create_user(
+            username="nina@example.com", email="nina@example.com"
+        )
+        response, _ = self.call(
+            "get", "/channel/stats", email="nina@example.com",
+            channel_id=self.channel.pk
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class TimelineTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ops = models.Channel.objects.create(owner=self.member, name="ops")
+        models.ChannelMember.objects.create(user=self.owner, channel=self.ops)
+        other = models.Channel.objects.create(owner=self.member, name="other")
+        archived = models.Channel.objects.create(
+            owner=self.owner, name="old", archived=True
+        )
+        for day in (1, 2, 3):
+            dt = dtt.date(2020, 1, day)
+            for channel in (self.channel, self.ops, other, archived):
+                utils.save_channel_message(
+                    self.member, channel, dt, "%s %d" % (channel.name, day)
+                )
+
+    def list_pages(self, **args):
+        messages = []
+        cursor = None
+        while True:
+            if cursor:
+                args["cursor"] = cursor
+            response, body = self.call("get", "/channel/timeline", **args)
+            self.assertEqual(response.status_code, 200)
+            messages += [m["message"] for m in body["payload"]["messages"]]
+            cursor = body["payload"]["cursor"]
+            if cursor is None:
+                return messages
+
+    def test_lists_member_channels_in_pages(self):
+        self.assertEqual(
+            self.list_pages(
+                dt_start="2020-01-03", dt_end="2020-01-01", limit=2
+            ),
+            ["team 1", "ops 1", "team 2", "ops 2", "team 3", "ops 3"]
+        )
+
+    def test_pages_across_archived_months(self):
+        self.addCleanup(archive.load_segment.cache_clear)
+        for channel in (self.channel, self.ops):
+            utils.save_channel_message(
+                self.member, channel, dtt.date(2020, 2, 1),
+                "%s february" % channel.name
+            )
+            archive.archive_channel(channel.pk, dtt.date(2020, 2, 15))
+        # Posted after archiving, replacing the archived message
+        utils.save_channel_message(
+            self.member, self.ops, dtt.date(2020, 1, 3), "ops edited"
+        )
+        self.assertEqual(
+            self.list_pages(
+                dt_start="2020-01-02", dt_end="2020-02-01", limit=2
+            ),
+            [
+                "team 2", "ops 2", "team 3", "ops edited", "team february",
+                "ops february"
+            ]
+        )
+
+    def test_rejects_bad_arguments(self):
+        dates = {"dt_start": "2020-01-01", "dt_end": "2020-01-03"}
+        for args in (
+                dict(dates, cursor=5),
+                dict(dates, cursor="not base64!"),
+                dict(dates, cursor=utils.encode_cursor("x", 1)),
+                dict(dates, cursor=utils.encode_cursor("2020-01-01", 1)),
+                dict(dates, limit=0),
+                {"dt_start": "2020-01-01", "dt_end": "January"},
+                {"dt_start": "2000-01-01", "dt_end": "2020-01-01"},
+        ):
+            response, _ = self.call("get", "/channel/timeline", **args)
+            self.assertEqual(response.status_code, 400, args)
+
+
+class BurstPostingTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_settings(
+            BURST_POSTING=True,
+            MESSAGE_SPOOL_PATH=os.path.join(directory, "spool.sqlite3")
+        )
+        self.addCleanup(self.close_spool)
+        self.today = dtt.date.today()
+
+    @staticmethod
+    def close_spool():
+        conn = getattr(spool._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            del spool._local.conn
+
+    def list_messages(self, email):
+        response, body = self.call(
+            "get", "/channel/logs/list", email=email,
+            channel_id=self.channel.pk, dt_start=self.today.isoformat(),
+            dt_end=self.today.isoformat()
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            message["message"]
+            for message in body["payload"]["logs"][0]["messages"]
+        ]
+
+    def test_queues_post_until_flushed(self):
+        for message in ("draft", "final"):
+            response, body = self.call(
+                "post", "/channel/message", email="milo@example.com",
+                channel_id=self.channel.pk, dt_posted=self.today.isoformat(),
+                message=message
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                body["payload"], {"message_id": None, "queued": True}
+            )
+        self.assertFalse(shards.messages_for(self.channel.pk).exists())
+
+        # Only the author sees spooled posts
+        self.assertEqual(self.list_messages("milo@example.com"), ["final"])
+        self.assertEqual(self.list_messages("olive@example.com"), [])
+
+        stdout = io.StringIO()
+        call_command("flush_message_spool", stdout=stdout)
+        self.assertIn("Flushed 2 messages", stdout.getvalue())
+        self.assertEqual(
+            list(shards.messages_for(self.channel.pk).values_list(
+                "user_id", "dt_posted", "message"
+            )),
+            [(self.member.pk, self.today, "final")]
+        )
+        self.assertEqual(spool.get_pending(
+            self.member.pk, self.channel.pk, self.today, self.today
+        ), [])
+
+    def test_flushes_in_batches(self):
+        for day in (1, 2, 3):
+            spool.enqueue(
+                self.member.pk, self.channel.pk, dtt.date(2020, 1, day),
+                "day %d" % day
+            )
+        self.assertEqual(spool.flush(batch_size=2), 2)
+        self.assertEqual(spool.get_pending(
+            self.member.pk, self.channel.pk,
+            dtt.date(2020, 1, 1), dtt.date(2020, 1, 31)
+        ), [(dtt.date(2020, 1, 3), "day 3")])
+        self.assertEqual(spool.flush(batch_size=2), 1)
+        self.assertEqual(spool.flush(batch_size=2), 0)
+        self.assertEqual(shards.messages_for(self.channel.pk).count(), 3)
+
+    def test_rejects_non_members_before_queueing(self):
+        User.objects.create_user(
+            username="nina@example.com", email="nina@example.com"
+        )
+        response, _ = self.call(
+            "post", "/channel/message", email="nina@example.com",
+            channel_id=self.channel.pk, dt_posted=self.today.isoformat(),
+            message="hello"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(spool.flush(), 0)
+
+
+class ShardingTest(ApiTestCase):
+    def test_places_channels_by_id(self):
+        self.patch_settings(MESSAGE_SHARDS=["shard_0", "shard_1"])
+        self.assertEqual(shards.get_shard(4), "shard_0")
+        self.assertEqual(shards.get_shard("7"), "shard_1")
+        self.assertEqual(
+            shards.group_by_shard([1, 2, 3]),
+            {"shard_1": [1, 3], "shard_0": [2]}
+        )
+
+    def test_unsharded_uses_default(self):
+        self.patch_settings(MESSAGE_SHARDS=[])
+        self.assertEqual(shards.get_shard(5), "default")
+        router = shards.ShardRouter()
+        self.assertIsNone(router.db_for_write(
+            models.ChannelMessage, instance=models.ChannelMessage(channel_id=5)
+        ))
+
+    def test_router_keeps_other_models_on_default(self):
+        self.patch_settings(MESSAGE_SHARDS=["shard_0", "shard_1"])
+        router = shards.ShardRouter()
+        self.assertEqual(router.db_for_write(
+            models.ChannelMessage, instance=models.ChannelMessage(channel_id=3)
+        ), "shard_1")
+        self.assertEqual(
+            router.db_for_read(User, instance=self.member), "default"
+        )
+        self.assertTrue(router.allow_migrate(
+            "shard_0", "channel", model_name="channelmessage"
+        ))
+        self.assertFalse(router.allow_migrate(
+            "shard_0", "channel", model_name="channel"
+        ))
+        self.assertIsNone(router.allow_migrate(
+            "default", "channel", model_name="channelmessage"
+        ))
+
+    @unittest.skipUnless(settings.MESSAGE_SHARDS, "Sharding disabled")
+    def test_saves_messages_on_shard(self):
+        message = utils.save_channel_message(
+            self.member, self.channel, dtt.date(2020, 1, 1), "hello"
+        )
+        shard = shards.get_shard(self.channel.pk)
+        self.assertEqual(message._state.db, shard)
+        self.assertTrue(
+            models.ChannelMessage.objects.using(shard).filter(
+                pk=message.pk
+            ).exists()
+        )
+        self.assertFalse(
+            models.ChannelMessage.objects.using("default").exists()
+        )
+
+        channel_id = self.channel.pk
+        self.channel.delete()
+        self.assertFalse(shards.messages_for(channel_id).exists())
+
+    @unittest.skipUnless(settings.MESSAGE_SHARDS, "Sharding disabled")
+    def test_rebalance_moves_messages_to_shard(self):
+        models.ChannelMessage.objects.using("default").create(
+            channel_id=self.channel.pk, user_id=self.member.pk,
+            dt_posted=dtt.date(2020, 1, 1), message="before sharding"
+        )
+        stdout = io.StringIO()
+        call_command("rebalance_shards", dry_run=True, stdout=stdout)
+        self.assertIn(
+            "Would move channel %d" % self.channel.pk, stdout.getvalue()
+        )
+        self.assertTrue(
+            models.ChannelMessage.objects.using("default").exists()
+        )
+
+        call_command("rebalance_shards", stdout=io.StringIO())
+        self.assertFalse(
+            models.ChannelMessage.objects.using("default").exists()
+        )
+        self.assertEqual(
+            list(shards.messages_for(self.channel.pk).values_list(
+                "message", flat=True
+            )),
+            ["before sharding"]
+        )
+
+
+class ArchiveTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(archive.load_segment.cache_clear)
+        for dt, message in (
+                ("2020-01-30", "january"), ("2020-01-31", "last of january"),
+                ("2020-02-03", "february"),
+        ):
+            utils.save_channel_message(
+                self.member, self.channel, utils.parse_iso_date_str(dt),
+                message
+            )
+
+    def list_messages(self, dt_start, dt_end):
+        cache.clear()
+        response, body = self.call(
+            "get", "/channel/logs/list", channel_id=self.channel.pk,
+            dt_start=dt_start, dt_end=dt_end
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (log["date"], message["message"])
+            for log in body["payload"]["logs"]
+            for message in log["messages"]
+        ]
+
+    def test_archives_whole_months(self):
+        self.assertEqual(
+            archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 20)),
+            2
+        )
+        self.assertEqual(
+            list(shards.messages_for(self.channel.pk).values_list(
+                "message", flat=True
+            )),
+            ["february"]
+        )
+        segment = archive.archives_for(self.channel.pk).get()
+        self.assertEqual(segment.dt_month, dtt.date(2020, 1, 1))
+        self.assertEqual(segment.count, 2)
+        self.assertEqual(
+            archive.get_messages(
+                self.channel.pk, dtt.date(2020, 1, 31), dtt.date(2020, 2, 29)
+            ),
+            [(self.member.pk, dtt.date(2020, 1, 31), "last of january")]
+        )
+        self.assertEqual(
+            archive.get_messages_in(
+                [self.channel.pk], dtt.date(2020, 1, 1), dtt.date(2020, 1, 30)
+            ),
+            {self.channel.pk: [
+                (self.member.pk, dtt.date(2020, 1, 30), "january")
+            ]}
+        )
+
+    def test_lists_archived_and_live_messages(self):
+        archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 20))
+        self.assertEqual(self.list_messages("2020-01-31", "2020-02-03"), [
+            ("2020-01-31", "last of january"), ("2020-02-03", "february")
+        ])
+
+        # Posts to archived days win until they are archived too
+        utils.save_channel_message(
+            self.member, self.channel, dtt.date(2020, 1, 31), "edited"
+        )
+        self.assertEqual(
+            self.list_messages("2020-01-31", "2020-01-31"),
+            [("2020-01-31", "edited")]
+        )
+        self.assertEqual(
+            archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 20)),
+            1
+        )
+        segment = archive.archives_for(self.channel.pk).get()
+        self.assertEqual(segment.count, 2)
+        self.assertEqual(
+            self.list_messages("2020-01-31", "2020-01-31"),
+            [("2020-01-31", "edited")]
+        )
+
+    def test_rebuilt_rollups_count_archived_messages(self):
+        archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 20))
+        rollups.rebuild(self.channel.pk)
+        self.assertEqual(
+            models.ChannelParticipation.objects.get(
+                user=self.member, year=2020, month=1
+            ).days, 0b11 << 29
+        )
+
+    def test_command_archives_old_months(self):
+        utils.save_channel_message(
+            self.member, self.channel, dtt.date.today(), "today"
+        )
+        stdout = io.StringIO()
+        call_command(
+            "archive_messages", days=0, channels=[self.channel.pk],
+            stdout=stdout
+        )
+        self.assertIn(
+            "Archived 3 messages of channel %d" % self.channel.pk,
+            stdout.getvalue()
+        )
+        self.assertEqual(
+            list(shards.messages_for(self.channel.pk).values_list(
+                "message", flat=True
+            )),
+            ["today"]
+        )
+
+
+class DayCacheTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        # Buckets are only cached with a shared backend
+        self.patch_settings(
+            CACHE_BACKEND="django.core.cache.backends.memcached.MemcachedCache"
+        )
+        self.today = dtt.date.today()
+        self.yesterday = self.today - dtt.timedelta(1)
+        utils.save_channel_message(
+            self.member, self.channel, self.yesterday, "yesterday"
+        )
+
+    def list_messages(self):
+        response, body = self.call(
+            "get", "/channel/logs/list", channel_id=self.channel.pk,
+            dt_start=self.today.isoformat(),
+            dt_end=self.yesterday.isoformat()
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (log["date"], message["message"])
+            for log in body["payload"]["logs"]
+            for message in log["messages"]
+        ]
+
+    def test_caches_past_days(self):
+        dates = [self.yesterday, self.today]
+        buckets = daycache.get_buckets(self.channel.pk, dates, self.today)
+        self.assertEqual(
+            json.loads(buckets[self.yesterday])[0]["message"], "yesterday"
+        )
+        self.assertEqual(buckets[self.today], "[]")
+        self.assertIsNone(
+            cache.get(daycache.get_key(self.channel.pk, self.today))
+        )
+
+        # Yesterday comes from the cache, today is loaded again
+        utils.save_channel_message(
+            self.member, self.channel, self.today, "today"
+        )
+        cache.set(daycache.get_key(self.channel.pk, self.yesterday), "[1]")
+        buckets = daycache.get_buckets(self.channel.pk, dates, self.today)
+        self.assertEqual(buckets[self.yesterday], "[1]")
+        self.assertEqual(
+            json.loads(buckets[self.today])[0]["message"], "today"
+        )
+
+    def test_posts_invalidate_their_day(self):
+        self.assertEqual(
+            self.list_messages(), [(self.yesterday.isoformat(), "yesterday")]
+        )
+        with mock.patch.object(
+                daycache.transaction, "on_commit",
+                lambda func, using=None: func()
+        ):
+            response, _ = self.call(
+                "post", "/channel/message", email="milo@example.com",
+                channel_id=self.channel.pk,
+                dt_posted=self.yesterday.isoformat(), message="edited"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.list_messages(), [(self.yesterday.isoformat(), "edited")]
+        )
+
+    def test_skips_cache_with_local_backend(self):
+        self.patch_settings(
+            CACHE_BACKEND="django.core.cache.backends.locmem.LocMemCache"
+        )
+        self.assertFalse(daycache.is_enabled())
+        self.assertEqual(
+            self.list_messages(), [(self.yesterday.isoformat(), "yesterday")]
+        )
+        self.assertIsNone(
+            cache.get(daycache.get_key(self.channel.pk, self.yesterday))
+        )
+
+        # A write of another process deletes nothing from this process'
+        # cache, the next read still sees it
+        shards.messages_for(self.channel.pk).filter(
+            dt_posted=self.yesterday
+        ).update(message="elsewhere")
+        self.assertEqual(
+            self.list_messages(), [(self.yesterday.isoformat(), "elsewhere")]
+        )
+
+    def test_rejects_posts_past_freeze(self):
+        dt_posted = self.today - dtt.timedelta(8)
+        self.assertTrue(daycache.is_frozen(dt_posted, self.today))
+        response, body = self.call(
+            "post", "/channel/message", email="milo@example.com",
+            channel_id=self.channel.pk, dt_posted=dt_posted.isoformat(),
+            message="late"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(body["error"], "DATE_FROZEN")
+
+        self.patch_settings(EDIT_FREEZE_DAYS=None)
+        self.assertFalse(daycache.is_frozen(dt_posted, self.today))
+
+
+class DeltaSyncTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch_settings(SYNC_CURSOR_LAG_SECONDS=0)
+        self.today = dtt.date.today()
+        self.yesterday = self.today - dtt.timedelta(1)
+        self.nina = User.objects.create_user(
+            username="nina@example.com", email="nina@example.com"
+        )
+        models.ChannelMember.objects.create(
+            user=self.nina, channel=self.channel
+        )
+        for user in (self.member, self.nina):
+            utils.save_channel_message(
+                user, self.channel, self.yesterday, "by %s" % user.email
+            )
+
+    def sync(self, since=None):
+        args = {"since": since} if since is not None else {}
+        response, body = self.call(
+            "get", "/channel/logs/list", channel_id=self.channel.pk,
+            dt_start=self.yesterday.isoformat(),
+            dt_end=self.today.isoformat(), **args
+        )
+        return response, body["payload"]
+
+    def test_lists_changes_since_cursor(self):
+        response, payload = self.sync()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(payload["logs"][0]["messages"]), 2)
+
+        utils.save_channel_message(
+            self.member, self.channel, self.today, "today"
+        )
+        response, payload = self.sync(payload["cursor"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (log["date"], message["message"])
+                for log in payload["logs"] for message in log["messages"]
+            ],
+            [(self.today.isoformat(), "today")]
+        )
+        self.assertEqual(payload["removed"], [])
+
+        response, payload = self.sync(payload["cursor"])
+        self.assertEqual((payload["logs"], payload["removed"]), ([], []))
+
+    def test_lists_messages_of_deleted_users_as_removed(self):
+        _, payload = self.sync()
+        self.nina.delete()
+        _, payload = self.sync(payload["cursor"])
+        self.assertEqual(payload["removed"], [
+            {"date": self.yesterday.isoformat(), "email": "nina@example.com"}
+        ])
+        self.assertFalse(
+            shards.messages_for(self.channel.pk).filter(
+                user_id=self.nina.pk
+            ).exists()
+        )
+
+    def test_rejects_bad_cursor(self):
+        for since in ("not a cursor", 5, utils.encode_cursor("yesterday")):
+            response, _ = self.call(
+                "get", "/channel/logs/list", channel_id=self.channel.pk,
+                dt_start=self.today.isoformat(),
+                dt_end=self.today.isoformat(), since=since
+            )
+            self.assertEqual(response.status_code, 400, since)
+
+    @unittest.skipUnless(settings.MESSAGE_SHARDS, "Sharding disabled")
+    def test_rebalance_moves_tombstones(self):
+        models.ChannelMessageTombstone.objects.using("default").create(
+            channel_id=self.channel.pk, dt_posted=self.yesterday,
+            user_email="gone@example.com"
+        )
+        call_command("rebalance_shards", stdout=io.StringIO())
+        self.assertFalse(
+            models.ChannelMessageTombstone.objects.using("default").exists()
+        )
+        self.assertTrue(
+            models.ChannelMessageTombstone.objects.using(
+                shards.get_shard(self.channel.pk)
+            ).filter(user_email="gone@example.com").exists()
+        )
+
+
+class ChannelMembersTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.others = [
+            User.objects.create_user(
+                username=email, email=email, first_name=email[0].upper()
+            )
+            for email in ("nina@example.com", "otto@example.com")
+        ]
+        for user in self.others:
+            models.ChannelMember.objects.create(
+                user=user, channel=self.channel, role="dev"
+            )
+
+    def get_member_count(self):
+        return models.Channel.objects.get(pk=self.channel.pk).member_count
+
+    def test_lists_members_in_pages(self):
+        emails = []
+        cursor = None
+        while True:
+            args = {"cursor": cursor} if cursor else {}
+            response, body = self.call(
+                "get", "/channel/members", email=self.member.email,
+                channel_id=self.channel.pk, limit=2, **args
+            )
+            self.assertEqual(response.status_code, 200)
+            payload = body["payload"]
+            self.assertEqual(payload["member_count"], 4)
+            self.assertEqual(payload["owner"]["email"], "olive@example.com")
+            emails += [member["email"] for member in payload["members"]]
+            cursor = payload["cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(
+            emails,
+            ["milo@example.com", "nina@example.com", "otto@example.com"]
+        )
+        self.assertEqual(payload["members"][0]["role"], "dev")
+        self.assertFalse(payload["members"][0]["is_mod"])
+
+    def test_rejects_bad_arguments(self):
+        for args, status in (
+                ({"channel_id": self.channel.pk, "limit": 0}, 400),
+                ({"channel_id": self.channel.pk, "cursor": 5}, 400),
+                ({"channel_id": self.channel.pk, "cursor": "nope"}, 400),
+                ({"channel_id": "team"}, 400),
+                ({"channel_id": self.channel.pk + 100}, 404),
+        ):
+            response, _ = self.call("get", "/channel/members", **args)
+            self.assertEqual(response.status_code, status, args)
+
+        user = User.objects.create_user(
+            username="pia@example.com", email="pia@example.com"
+        )
+        response, _ = self.call(
+            "get", "/channel/members", email=user.email,
+            channel_id=self.channel.pk
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_counts_joins_and_leaves(self):
+        self.assertEqual(self.get_member_count(), 4)
+        models.ChannelMember.objects.filter(user=self.others[0]).delete()
+        self.assertEqual(self.get_member_count(), 3)
+        self.others[1].delete()
+        self.assertEqual(self.get_member_count(), 2)
+        self.owner.delete()
+        self.assertEqual(self.get_member_count(), 1)
+
+        channel = models.Channel.objects.get(pk=self.channel.pk)
+        self.assertIsNone(channel.owner)
+
+    def test_recount_uncounts_deleted_owners(self):
+        models.Channel.objects.filter(pk=self.channel.pk).update(
+            owner=None, member_count=10
+        )
+        migration = importlib.import_module(
+            "channel.migrations.0014_recount_members"
+        )
+        migration.recount_members(
+            django_apps, mock.Mock(connection=mock.Mock(alias="default"))
+        )
+        self.assertEqual(self.get_member_count(), 3)
+
+
+class PurgeTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for day in (1, 2, 3):
+            utils.save_channel_message(
+                self.member, self.channel, dtt.date(2020, 1, day), "x"
+            )
+
+    def test_purges_channel_in_batches(self):
+        job = purge.mark_channel(self.channel)
+        self.assertTrue(purge.is_purging(self.channel))
+        progress = []
+        purge.run_job(job, 2, lambda job, deleted: progress.append(
+            (job.step, deleted)
+        ))
+
+        self.assertEqual(progress, [
+            ("channelmessage", 2), ("channelmessage", 1),
+            ("channelparticipation", 1), ("channelmember", 1),
+        ])
+        job.refresh_from_db()
+        self.assertEqual((job.step, job.deleted), ("done", 5))
+        self.assertIsNotNone(job.dt_finished)
+        self.assertFalse(
+            models.Channel.objects.filter(pk=self.channel.pk).exists()
+        )
+        self.assertFalse(shards.messages_for(self.channel.pk).exists())
+        self.assertTrue(User.objects.filter(pk=self.member.pk).exists())
+
+    def test_purges_user_with_tombstones(self):
+        stdout = io.StringIO()
+        call_command("run_purges", users=[self.member.pk], stdout=stdout)
+        self.assertIn(
+            "Purged user %d, 5 rows" % self.member.pk, stdout.getvalue()
+        )
+        self.assertFalse(User.objects.filter(pk=self.member.pk).exists())
+        self.assertEqual(
+            models.ChannelMessageTombstone.objects.using(
+                shards.get_shard(self.channel.pk)
+            ).filter(user_email=self.member.email).count(),
+            3
+        )
+        self.assertEqual(
+            models.Channel.objects.get(pk=self.channel.pk).member_count, 1
+        )
+
+        with self.assertRaises(CommandError):
+            call_command("run_purges", users=[self.member.pk])
+
+    def test_marks_expired_channels(self):
+        now = timezone.now()
+        models.Channel.objects.filter(pk=self.channel.pk).update(
+            archived=True, dt_archived=now - dtt.timedelta(91)
+        )
+        models.Channel.objects.create(
+            owner=self.owner, name="recent", archived=True,
+            dt_archived=now - dtt.timedelta(89)
+        )
+        self.patch_settings(PURGE_AFTER_DAYS=None)
+        self.assertEqual(purge.mark_expired_channels(now), 0)
+        self.patch_settings(PURGE_AFTER_DAYS=90)
+        self.assertEqual(purge.mark_expired_channels(now), 1)
+        self.assertEqual(purge.mark_expired_channels(now), 0)
+        self.assertTrue(purge.is_purging(self.channel))
+
+    def test_purging_channel_cannot_be_restored(self):
+        purge.mark_channel(self.channel)
+        response, body = self.call(
+            "post", "/channel/create", user_email="olive@example.com",
+            channel_name="team"
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(body["error"], "CHANNEL_PURGING")
+        self.assertTrue(
+            models.Channel.objects.get(pk=self.channel.pk).archived
+        )
+
+
+class RemindersTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dt = dtt.date(2020, 1, 6)
+        self.nina, self.pia, self.quinn = [
+            User.objects.create_user(username=email, email=email)
+            for email in (
+                "nina@example.com", "pia@example.com", "quinn@example.com"
+            )
+        ]
+        ops = models.Channel.objects.create(owner=self.owner, name="ops")
+        old = models.Channel.objects.create(
+            owner=self.owner, name="old", archived=True
+        )
+        for user, channel in (
+                (self.nina, ops), (self.pia, old), (self.quinn, ops)
+        ):
+            models.ChannelMember.objects.create(user=user, channel=channel)
+        self.quinn.is_active = False
+        self.quinn.save()
+        utils.save_channel_message(self.member, self.channel, self.dt, "x")
+
+    def get_reminders(self):
+        return dict(
+            notification.models.Notification.objects.filter(
+                role="REMINDER"
+            ).values_list("user__email", "message")
+        )
+
+    def test_reminds_each_missing_member_once(self):
+        self.assertEqual(reminders.send_reminders(self.dt, batch_size=1), 2)
+        self.assertEqual(self.get_reminders(), {
+            "olive@example.com":
+                "You have not posted your standup for 2020-01-06 to team, ops",
+            "nina@example.com":
+                "You have not posted your standup for 2020-01-06 to ops",
+        })
+
+        self.assertEqual(reminders.send_reminders(self.dt), 0)
+        self.assertEqual(len(self.get_reminders()), 2)
+
+    def test_finds_missing_in_one_query_per_shard(self):
+        channels = list(
+            models.Channel.objects.filter(archived=False).order_by(
+                "pk"
+            ).values_list("pk", "name")
+        )
+        groups = shards.group_by_shard(pk for pk, _ in channels)
+        # One query of the default database per shard
+        with self.assertNumQueries(len(groups)):
+            missing = reminders.find_missing(channels, self.dt)
+        self.assertEqual(missing, {
+            self.owner.pk: ["team", "ops"], self.nina.pk: ["ops"]
+        })
+
+    def test_command_takes_date(self):
+        stdout = io.StringIO()
+        call_command("send_reminders", date="2020-01-06", stdout=stdout)
+        self.assertIn("Reminded 2 users for 2020-01-06", stdout.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command("send_reminders", date="Monday")
+
+
+class DigestTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(archive.load_segment.cache_clear)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_settings(DIGEST_DIR=directory)
+        self.dt_week = dtt.date(2020, 1, 6)
+        models.ChannelMember.objects.filter(user=self.member).update(
+            is_mod=True
+        )
+        utils.save_channel_message(
+            self.member, self.channel, dtt.date(2020, 1, 7), "tuesday"
+        )
+        utils.save_channel_message(
+            self.owner, self.channel, dtt.date(2020, 1, 8), "archived"
+        )
+        archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 1))
+        utils.save_channel_message(
+            self.member, self.channel, dtt.date(2020, 1, 12), "sunday"
+        )
+
+    def build_digest(self):
+        channel = models.Channel.objects.select_related("owner").get(
+            pk=self.channel.pk
+        )
+        with self.assertNumQueries(1):
+            members = digest.get_members([channel])[channel.pk]
+        messages = digest.get_messages([channel.pk], self.dt_week)
+        return digest.build_digest(
+            channel, self.dt_week, members, messages[channel.pk]
+        )
+
+    def test_builds_row_per_member(self):
+        data = self.build_digest()
+        self.assertEqual(data["week"], "2020-01-06")
+        self.assertEqual(data["days"][-1], "2020-01-12")
+        self.assertEqual(
+            [(row["name"], row["messages"]) for row in data["rows"]],
+            [
+                ("Olive Owner", ["", "", "archived", "", "", "", ""]),
+                ("Milo Member", ["", "tuesday", "", "", "", "", "sunday"]),
+            ]
+        )
+
+    def test_recipients_are_owner_and_active_mods(self):
+        members = digest.get_members([self.channel])[self.channel.pk]
+        self.assertEqual(
+            digest.get_recipients(self.channel, members),
+            ["olive@example.com", "milo@example.com"]
+        )
+        members[0].user.is_active = False
+        self.assertEqual(
+            digest.get_recipients(self.channel, members),
+            ["olive@example.com"]
+        )
+
+    def test_renders_formats(self):
+        data = self.build_digest()
+        self.assertTrue(digest.render_pdf(data).startswith(b"%PDF"))
+        self.assertTrue(digest.render_xlsx(data).startswith(b"PK"))
+
+    def test_command_mails_cached_renders(self):
+        stdout = io.StringIO()
+        for _ in range(2):
+            call_command(
+                "send_digests", week="2020-01-08", format="xlsx", workers=1,
+                stdout=stdout
+            )
+        self.assertIn("Sent 1 digests of week 2020-01-06", stdout.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            mail.outbox[0].to, ["olive@example.com", "milo@example.com"]
+        )
+        self.assertEqual(
+            mail.outbox[0].attachments[0][0], "team-2020-01-06.xlsx"
+        )
+        channel_dir = os.path.join(settings.DIGEST_DIR, str(self.channel.pk))
+        self.assertEqual(len(os.listdir(channel_dir)), 1)
+
+        # Weeks edited after rendering are rendered again
+        utils.save_channel_message(
+            self.member, self.channel, dtt.date(2020, 1, 12), "edited"
+        )
+        call_command(
+            "send_digests", week="2020-01-08", format="xlsx", workers=1,
+            stdout=stdout
+        )
+        self.assertEqual(len(os.listdir(channel_dir)), 1)
+        self.assertNotEqual(
+            mail.outbox[2].attachments[0][1], mail.outbox[0].attachments[0][1]
+        )
+
+        with self.assertRaises(CommandError):
+            call_command("send_digests", week="last")
+
+
+class MentionsTest(ApiTestCase):
+    def post(self, message, dt_posted=None):
+        response, _ = self.call(
+            "post", "/channel/message", email=self.member.email,
+            channel_id=self.channel.pk, message=message,
+            dt_posted=(dt_posted or dtt.date.today()).isoformat()
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def get_mentioned(self):
+        return list(models.ChannelMention.objects.values_list(
+            "user__email", flat=True
+        ))
+
+    def get_notified(self):
+        return list(notification.models.Notification.objects.filter(
+            role="MENTION"
+        ).values_list("user__email", flat=True))
+
+    def test_finds_members_mentioned(self):
+        members = [self.owner, self.member]
+        self.assertEqual(
+            mentions.find_mentions(
+                "Thanks @olive, and @MILO@example.com.", members
+            ),
+            {self.owner.pk, self.member.pk}
+        )
+        for message in ("mail milo@example.com", "@nobody", "no mention"):
+            self.assertEqual(mentions.find_mentions(message, members), set())
+
+    def test_posts_record_and_notify_mentions(self):
+        self.post("Paired with @olive, reviewed by @milo")
+        self.assertEqual(self.get_mentioned(), ["olive@example.com"])
+        self.assertEqual(self.get_notified(), ["olive@example.com"])
+
+        # Edits notify no one twice, and drop mentions removed
+        self.post("Paired with @olive all day")
+        self.assertEqual(self.get_notified(), ["olive@example.com"])
+        self.post("Worked alone")
+        self.assertEqual(self.get_mentioned(), [])
+
+    def test_lists_mentions_in_pages(self):
+        for day in (1, 2, 3):
+            dt = dtt.date(2020, 1, day)
+            message = "day %d with @olive" % day
+            utils.save_channel_message(self.member, self.channel, dt, message)
+            mentions.record_mentions(
+                self.member, self.channel, dt, message,
+                [self.owner, self.member]
+            )
+        archive.archive_channel(self.channel.pk, dtt.date(2020, 2, 1))
+        self.addCleanup(archive.load_segment.cache_clear)
+
+        messages = []
+        args = {"limit": 2}
+        while True:
+            response, body = self.call("get", "/channel/mentions", **args)
+            self.assertEqual(response.status_code, 200)
+            messages += [
+                (message["date"], message["message"])
+                for message in body["payload"]["messages"]
+            ]
+            if body["payload"]["cursor"] is None:
+                break
+            args["cursor"] = body["payload"]["cursor"]
+        self.assertEqual(messages, [
+            ("2020-01-03", "day 3 with @olive"),
+            ("2020-01-02", "day 2 with @olive"),
+            ("2020-01-01", "day 1 with @olive"),
+        ])
+
+    def test_rejects_bad_arguments(self):
+        for args in ({"cursor": 5}, {"cursor": "nope"}, {"limit": 0}):
+            response, _ = self.call("get", "/channel/mentions", **args)
+            self.assertEqual(response.status_code, 400, args)
+        response, body = self.call(
+            "get", "/channel/mentions", email="nobody@example.com"
+        )
+        self.assertEqual(
+            body["error"], standup.utils.USER_DOES_NOT_EXIST["error"]
+        )
@@ -12,4 +12,7 @@ urlpatterns = [
     path("invite", views.invite_user_to_channel, name="invite"),
     path("message", views.message_channel, name="message"),
     path("logs/list", views.list_logs, name="list-logs"),
+    path("timeline", views.list_timeline, name="timeline"),
+    path("mentions", views.list_mentions, name="mentions"),
+    path("stats", views.get_channel_stats, name="stats"),
 ]
@@ -1,13 +1,31 @@
+import base64
 import datetime as dtt
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from django.contrib.auth.models import User
+from django.db.models import Q
 from django.http import JsonResponse
+from django.utils import timezone
 
+from channel import archive
+from channel import daycache
 from channel import models
+from channel import rollups
+from channel import shards
+import standup.db
+from standup import timing
 import standup.utils
 
 
+#: Date posted, channel id and author id, the position of a timeline
+#: message
+TimelineKey = Tuple[dtt.date, int, int]
+
+#: Longest message text accepted
+MAX_MESSAGE_LENGTH = models.ChannelMessage._meta.get_field(
+    "message"
+).max_length
+
 ARGS_NO_CHANNEL_NAME = {
     "message": "No channel name given",
     "error": "INVALID_NAME",
@@ -36,6 +54,13 @@ CHANNEL_OWNER_PERMISSION = {
     "http_status": 400
 }
 
+CHANNEL_PURGING = {
+    "message": "Channel is being deleted, retry later",
+    "error": "CHANNEL_PURGING",
+    "json_status": 409,
+    "http_status": 409
+}
+
 CHANNEL_NOT_FOUND = {
     "message": "No channel found for this user",
     "error": "CHANNEL_NOT_FOUND",
@@ -57,14 +82,59 @@ USER_ALREADY_INVITED = {
     "http_status": 400
 }
 
+MESSAGE_TOO_LONG = {
+    "message": "Message is longer than %d characters" % MAX_MESSAGE_LENGTH,
+    "error": "MESSAGE_TOO_LONG",
+    "json_status": 400,
+    "http_status": 400
+}
+
+DATE_FROZEN = {
+    "message": "Messages of this date can no longer be edited",
+    "error": "DATE_FROZEN",
+    "json_status": 400,
+    "http_status": 400
+}
+
 
 def get_channel_members(channel: models.Channel) -> List[User]:
     """ Returns list of members under a channel """
     owner = channel.owner
-    members = channel.channelmember_set.exclude(user=owner)
+    members = channel.channelmember_set.exclude(user=owner).select_related(
+        "user"
+    )
     return [owner] + [member.user for member in members]
 
 
+def get_channel_as_member(
+        user_email: str, channel_id: str
+) -> Tuple[Optional[JsonResponse], Optional[models.Channel]]:
+    """ Fetches channel if user is a member, without loading its members
+
+    :param user_email: Email address to fetch channel as member
+    :param channel_id: ID of channel to lookup
+    :return: error response if request failed, and channel
+    """
+    with timing.phase("member"):
+        try:
+            channel_id_int = int(channel_id)
+        except (ValueError, TypeError):
+            return standup.utils.json_response(**ARGS_INVALID_CHANNEL), None
+
+        channel = models.Channel.objects.select_related("owner").filter(
+            pk=channel_id_int
+        ).first()
+        if channel is None or not (
+                channel.owner is not None
+                and channel.owner.email.lower() == user_email.lower()
+                or channel.channelmember_set.filter(
+                    user__email__iexact=user_email
+                ).exists()
+        ):
+            return standup.utils.json_response(**CHANNEL_NOT_FOUND), None
+        return None, channel
+
+
 def get_channel_by_member(
         user_email: str, channel_id: str
 ) -> Tuple[Optional[JsonResponse], Optional[models.Channel], List[User]]:
@@ -74,27 +144,247 @@ def get_channel_by_member(
     :param channel_id: ID of channel to lookup
     :return: error response if request failed, channel, and member emails
     """
-    # Try to parse channel id
-    try:
-        channel_id_int = int(channel_id)
-    except ValueError:
-        return standup.utils.json_response(**ARGS_INVALID_CHANNEL), None, []
+    with timing.phase("member"):
+        # Try to parse channel id
+        try:
+            channel_id_int = int(channel_id)
+        except ValueError:
+            return (
+                standup.utils.json_response(**ARGS_INVALID_CHANNEL), None, []
+            )
 
-    # Try to fetch channel object by id
-    try:
-        channel = models.Channel.objects.get(pk=channel_id_int)
-    except models.Channel.DoesNotExist:
-        return standup.utils.json_response(**CHANNEL_NOT_FOUND), None, []
+        # Try to fetch channel object by id
+        try:
+            channel = models.Channel.objects.get(pk=channel_id_int)
+        except models.Channel.DoesNotExist:
+            return (
+                standup.utils.json_response(**CHANNEL_NOT_FOUND), None, []
+            )
+
+        # Get list of members for channel to check if user can see channel
+        members = get_channel_members(channel)
+        member_emails = [member.email.lower() for member in members]
+        if user_email.lower() not in member_emails:
+            return (
+                standup.utils.json_response(**CHANNEL_NOT_FOUND), None, []
+            )
+
+        return None, channel, members
+
+
+def get_member_channel_ids(user: User) -> List[int]:
+    """ Returns ids of non-archived channels user owns or is member of """
+    return list(
+        models.Channel.objects.filter(
+            Q(owner=user) | Q(channelmember__user=user), archived=False
+        ).distinct().order_by("pk").values_list("pk", flat=True)
+    )
+
+
+def get_timeline_page(
+        channel_ids: List[int], dt_start: dtt.date, dt_end: dtt.date,
+        after: Optional[TimelineKey], limit: int
+) -> List[Tuple[TimelineKey, str]]:
+    """ Returns messages of channels in date range, archived ones included,
+    ordered by date, channel and author
+
+    Live messages are read a page per shard, and replace archived messages
+    of the same author and day. Past the last message of a full shard page,
+    a live message may still replace an archived one, so messages there
+    are left to the next page.
 
-    # Get list of members for channel to check if user can see channel
-    members = get_channel_members(channel)
-    member_emails = [member.email.lower() for member in members]
-    if user_email.lower() not in member_emails:
-        return standup.utils.json_response(**CHANNEL_NOT_FOUND), None, []
+    :param channel_ids: IDs of channels
+    :param dt_start: First date of range
+    :param dt_end: Last date of range
+    :param after: Optional position of last message of previous page
+    :param limit: Messages per page
+    :return: Up to limit + 1 positions and texts, one more than limit if
+    there is another page
+    """
+    filters = Q(dt_posted__gte=dt_start, dt_posted__lte=dt_end)
+    if after is not None:
+        posted, channel_id, user_id = after
+        filters &= (
+            Q(dt_posted__gt=posted)
+            | Q(dt_posted=posted, channel_id__gt=channel_id)
+            | Q(dt_posted=posted, channel_id=channel_id, user_id__gt=user_id)
+        )
+        dt_start = max(dt_start, posted)
+
+    messages: Dict[TimelineKey, str] = {}
+    for channel_id, archived in archive.get_messages_in(
+            channel_ids, dt_start, dt_end
+    ).items():
+        for user_id, dt_posted, message in archived:
+            key = (dt_posted, channel_id, user_id)
+            if after is None or key > after:
+                messages[key] = message
+
+    horizon: Optional[TimelineKey] = None
+    for shard_messages in shards.messages_in(channel_ids):
+        page = list(
+            shard_messages.filter(filters).order_by(
+                "dt_posted", "channel_id", "user_id"
+            ).values_list(
+                "dt_posted", "channel_id", "user_id", "message"
+            )[:limit + 1]
+        )
+        for dt_posted, channel_id, user_id, message in page:
+            messages[(dt_posted, channel_id, user_id)] = message
+        if len(page) > limit:
+            last = page[-1][:3]
+            horizon = last if horizon is None else min(horizon, last)
+
+    keys = sorted(
+        key for key in messages if horizon is None or key <= horizon
+    )
+    return [(key, messages[key]) for key in keys[:limit + 1]]
 
-    return None, channel, members
+
+def encode_cursor(*values) -> str:
+    """ Encodes pagination position as opaque cursor string """
+    return base64.urlsafe_b64encode(
+        "|".join(str(value) for value in values).encode("utf-8")
+    ).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> List[str]:
+    """ Decodes cursor string into its position values
+
+    :raises ValueError: If cursor is malformed, or not a string
+    """
+    if not isinstance(cursor, str):
+        raise ValueError("Invalid cursor")
+    try:
+        return base64.urlsafe_b64decode(
+            cursor.encode("ascii")
+        ).decode("utf-8").split("|")
+    except (TypeError, UnicodeError, base64.binascii.Error):
+        raise ValueError("Invalid cursor")
 
 
 def parse_iso_date_str(date_str: str):
     """ Parses iso date string """
     return dtt.date(*map(int, date_str.split("-")))
+
+
+@standup.db.write_transaction()
+def save_channel_message(
+        user: User, channel: models.Channel, dt_posted: dtt.date, message: str
+) -> models.ChannelMessage:
+    """ Creates or updates user's message for a channel and date
+
+    The message is committed to its shard before the participation rollup
+    in the default database, see rollups.rebuild to repair a rollup left
+    behind by a failure in between.
+
+    :raises IntegrityError: If message could not be saved
+    """
+    with standup.db.immediate_atomic(shards.get_shard(channel.pk)):
+        channel_message = shards.messages_for(channel.pk).filter(
+            user=user, dt_posted=dt_posted
+        ).first()
+        created = channel_message is None
+        if created:
+            channel_message = models.ChannelMessage(
+                user=user, dt_posted=dt_posted, channel=channel
+            )
+        channel_message.message = message
+        channel_message.save()
+        daycache.invalidate(
+            [(channel.pk, dt_posted)], shards.get_shard(channel.pk)
+        )
+
+    if created:
+        rollups.record_post(channel.pk, user.pk, dt_posted)
+    return channel_message
+
+
+def _upsert_shard_messages(
+        alias: str, pending: Dict[Tuple[int, int, dtt.date], str],
+        batch_size: int
+) -> Tuple[List[models.ChannelMessage], List[models.ChannelMessage]]:
+    """ Writes messages of one shard, returning those created and updated """
+    user_ids = {key[0] for key in pending}
+    channel_ids = {key[1] for key in pending}
+    dates = {key[2] for key in pending}
+
+    shard_messages = models.ChannelMessage.objects.using(alias)
+    existing = {
+        (msg.user_id, msg.channel_id, msg.dt_posted): msg
+        for msg in shard_messages.filter(
+            user_id__in=user_ids, channel_id__in=channel_ids,
+            dt_posted__in=dates
+        )
+    }
+
+    to_create = []
+    to_update = []
+    dt_updated = timezone.now()
+    for key, message in pending.items():
+        channel_message = existing.get(key)
+        if channel_message is None:
+            to_create.append(models.ChannelMessage(
+                user_id=key[0], channel_id=key[1], dt_posted=key[2],
+                message=message
+            ))
+        elif channel_message.message != message:
+            channel_message.message = message
+            # Not set by bulk_update
+            channel_message.dt_updated = dt_updated
+            to_update.append(channel_message)
+
+    # Conflicts can only come from a concurrent writer, which wins
+    shard_messages.bulk_create(
+        to_create, batch_size=batch_size, ignore_conflicts=True
+    )
+    shard_messages.bulk_update(
+        to_update, ["message", "dt_updated"], batch_size=batch_size
+    )
+    return to_create, to_update
+
+
+@standup.db.write_transaction()
+def upsert_messages(
+        rows: Iterable[Tuple[int, int, dtt.date, str]], batch_size: int = 500
+) -> Tuple[int, int]:
+    """ Inserts or updates channel messages in bulk, in one transaction
+
+    Rows are keyed on the (user, channel, dt_posted) unique constraint, so
+    writing the same rows twice leaves the table unchanged. Participation
+    rollups of months with new messages are rebuilt in the same transaction.
+    With message shards, each shard's rows are committed in a transaction of
+    their own before the rollups.
+
+    :param rows: Tuples of (user id, channel id, date posted, message)
+    :param batch_size: Maximum rows per INSERT/UPDATE statement
+    :return: Count of messages created and updated
+    """
+    # Last write wins for duplicate keys within the batch
+    pending: Dict[str, Dict[Tuple[int, int, dtt.date], str]] = {}
+    for user_id, channel_id, dt_posted, message in rows:
+        pending.setdefault(shards.get_shard(channel_id), {})[
+            (user_id, channel_id, dt_posted)
+        ] = message
+    if not pending:
+        return 0, 0
+
+    created = []
+    updated = []
+    for alias, shard_pending in pending.items():
+        with standup.db.immediate_atomic(alias):
+            shard_created, shard_updated = _upsert_shard_messages(
+                alias, shard_pending, batch_size
+            )
+            daycache.invalidate(
+                [(key[1], key[2]) for key in shard_pending], alias
+            )
+        created += shard_created
+        updated += shard_updated
+
+    rollups.refresh_months({
+        (msg.channel_id, msg.dt_posted.year, msg.dt_posted.month)
+        for msg in created
+    })
+
+    return len(created), len(updated)
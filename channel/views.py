@@ -1,13 +1,40 @@
 from django.contrib.auth.models import User
 from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
 import datetime as dtt
+import json
 
+from channel import daycache
+from channel import mentions
 from channel import models
+from channel import purge
+from channel import rollups
+from channel import shards
+from channel import spool
 from channel import utils
 import notification.models
+from standup import coalesce
+from standup import idempotency
+from standup import settings
+from standup import timing
 import standup.utils
 
 
+#: Largest date range served by timeline
+MAX_TIMELINE_DAYS = 366
+
+#: Largest page size served by timeline
+MAX_TIMELINE_LIMIT = 500
+
+#: Largest page size served by members
+MAX_MEMBERS_LIMIT = 500
+
+#: Largest page size served by mentions
+MAX_MENTIONS_LIMIT = 100
+
+
+@idempotency.idempotent
 def create_channel(request):
     """ POST handler for creating new channel
 
@@ -26,10 +53,13 @@ def create_channel(request):
         # Assert that channel name is given
         return standup.utils.json_response(**utils.ARGS_NO_CHANNEL_NAME)
 
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     prexisting = models.Channel.objects.filter(
         owner=user, name__iexact=channel_name
@@ -37,8 +67,11 @@ def create_channel(request):
     if prexisting:
         # Channel already exists
         if prexisting.archived:
+            if purge.is_purging(prexisting):
+                return standup.utils.json_response(**utils.CHANNEL_PURGING)
             # Channel is archived, so restore it
             prexisting.archived = False
+            prexisting.dt_archived = None
             prexisting.save()
             return standup.utils.json_response(
                 payload={"channel_name": channel_name},
@@ -67,28 +100,35 @@ def list_channels(request):
 
     user_email = request.headers.get("X-USER-EMAIL")
 
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
-
-    user_channels = user.channel_set.all()
-    member_channels = [
-        member.channel
-        for member in user.channelmember_set.exclude(channel__in=user_channels)
-    ]
-    channels = [
-        {
-            "channel_name": channel.name,
-            "owner": channel.owner.email,
-            "channel_id": channel.id,
-            "archived": channel.archived,
-        }
-        for channel in list(user_channels) + member_channels
-    ]
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    with timing.phase("query"):
+        user_channels = user.channel_set.all()
+        member_channels = [
+            member.channel
+            for member in user.channelmember_set.exclude(
+                channel__in=user_channels
+            )
+        ]
+        channels = [
+            {
+                "channel_name": channel.name,
+                "owner": channel.owner.email,
+                "channel_id": channel.id,
+                "archived": channel.archived,
+            }
+            for channel in list(user_channels) + member_channels
+        ]
     return standup.utils.json_response(payload=channels)
 
 
+@idempotency.idempotent
 def archive_channel(request):
     """ POST handler to archive a channel for a given user
 
@@ -106,8 +146,9 @@ def archive_channel(request):
         return err_response
 
     if user_email == channel.owner.email:
-        # Archive as owner
+        # Archive as owner, to be purged after PURGE_AFTER_DAYS
         channel.archived = True
+        channel.dt_archived = timezone.now()
         channel.save()
         msg = "Archived channel"
     else:
@@ -128,38 +169,96 @@ def archive_channel(request):
 
 
 def get_channel_users(request):
-    """ GET handler to fetch members of a channel
+    """ GET handler to fetch members of a channel, a page at a time
 
     GET HEADERS:
         - X-USER-EMAIL
 
     PARAMETERS:
-        - owner: Address of owner
-        - channel_name: Name of channel
+        - channel_id: ID of channel
+        - cursor: Optional cursor returned by previous page
+        - limit: Optional maximum number of members per page
     """
     bad_secret, response, args = standup.utils.check_request_secret(request)
     if bad_secret:
         return response
 
-    user_email = request.headers.get("X-USER-EMAIL")
-    owner = request.GET.get("owner", "")
-    channel_name = request.GET.get("channel_name", "")
-
+    user_email = request.headers.get("X-USER-EMAIL", "")
     try:
-        channel = models.Channel.objects.filter(owner=owner, name=channel_name)
-    except models.Channel.DoesNotExist:
-        return standup.utils.json_response(**utils.CHANNEL_NOT_FOUND)
+        limit = min(int(args.get("limit", 100)), MAX_MEMBERS_LIMIT)
+        if limit <= 0:
+            raise ValueError("Limit must be positive")
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Bad value for limit",
+            json_status=400,
+            http_status=400
+        )
+
+    after = 0
+    if args.get("cursor"):
+        # Resume after last membership of previous page
+        try:
+            after, = utils.decode_cursor(args["cursor"])
+            after = int(after)
+        except (ValueError, TypeError):
+            return standup.utils.json_response(
+                error="INVALID_ARG",
+                message="Bad value for cursor",
+                json_status=400,
+                http_status=400
+            )
 
-    members = utils.get_channel_members(channel)
-    member_emails = [member.email.lower() for member in members]
+    err_response, channel = utils.get_channel_as_member(
+        user_email, args.get("channel_id")
+    )
+    if err_response:
+        return err_response
 
-    if user_email in member_emails:
-        # Successfully found channel
-        return standup.utils.json_response(payload=member_emails)
+    def build_response():
+        with timing.phase("query"):
+            members = list(
+                models.ChannelMember.objects.filter(
+                    channel=channel, pk__gt=after
+                ).exclude(user_id=channel.owner_id).order_by("pk").values(
+                    "pk", "role", "is_mod", "dt_joined",
+                    email=F("user__email"),
+                    first_name=F("user__first_name"),
+                    last_name=F("user__last_name")
+                )[:limit + 1]
+            )
 
-    return standup.utils.json_response(**utils.CHANNEL_NOT_FOUND)
+        cursor = None
+        if len(members) > limit:
+            members = members[:limit]
+            cursor = utils.encode_cursor(members[-1]["pk"])
+        for member in members:
+            del member["pk"]
+
+        owner = channel.owner
+        return standup.utils.json_response(
+            payload={
+                "channel_id": channel.pk,
+                "member_count": channel.member_count,
+                "owner": None if owner is None else {
+                    "email": owner.email,
+                    "first_name": owner.first_name,
+                    "last_name": owner.last_name
+                },
+                "members": members,
+                "cursor": cursor
+            }
+        )
+
+    # Membership is checked first, so members of a channel share pages
+    return coalesce.run(
+        coalesce.get_key("channel:members", channel.pk, after, limit),
+        build_response
+    )
 
 
+@idempotency.idempotent
 def invite_user_to_channel(request):
     """ POST handler to handle request to invite user to channel
 
@@ -183,10 +282,13 @@ def invite_user_to_channel(request):
     if err_response:
         return err_response
 
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     # Verification checks
     if user_email != channel.owner.email.lower():
@@ -198,10 +300,13 @@ def invite_user_to_channel(request):
     if invite_email in [member.email.lower() for member in members]:
         return standup.utils.json_response(**utils.USER_ALREADY_INVITED)
 
-    try:
-        invite_user = User.objects.get(email__iexact=invite_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            invite_user = User.objects.get(email__iexact=invite_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     invites = models.ChannelInvite.objects.filter(
         user=invite_user, channel=channel
@@ -240,6 +345,7 @@ def invite_user_to_channel(request):
     )
 
 
+@idempotency.idempotent
 def message_channel(request):
     """ POST handler for posting messages to a channel
 
@@ -272,11 +378,19 @@ def message_channel(request):
             json_status=400,
             http_status=400
         )
+    if len(str(message)) > utils.MAX_MESSAGE_LENGTH:
+        return standup.utils.json_response(**utils.MESSAGE_TOO_LONG)
 
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    if daycache.is_frozen(dt_posted, timezone.now().date()):
+        return standup.utils.json_response(**utils.DATE_FROZEN)
 
     err_response, channel, members = utils.get_channel_by_member(
         user_email, channel_id
@@ -284,27 +398,33 @@ def message_channel(request):
     if err_response:
         return err_response
 
-    # Check to see if message already exists
-    channel_message = models.ChannelMessage.objects.filter(
-        user=user, dt_posted=dt_posted, channel_id=channel_id
-    ).first()
-    if channel_message is None:
-        channel_message = models.ChannelMessage(
-            user=user, dt_posted=dt_posted, channel_id=channel_id
-        )
-    channel_message.message = message
-
-    try:
-        channel_message.save()
-    except IntegrityError:
+    if settings.BURST_POSTING:
+        # Defer write to spool flusher
+        with timing.phase("query"):
+            spool.enqueue(user.pk, channel.pk, dt_posted, message)
+            mentions.record_mentions(
+                user, channel, dt_posted, message, members
+            )
         return standup.utils.json_response(
-            payload={},
-            message="Failed to post message",
-            error="INTERNAL_DB_ERR",
-            json_status=500,
-            http_status=500
+            payload={"message_id": None, "queued": True},
+            message="Queued message"
         )
 
+    with timing.phase("query"):
+        try:
+            channel_message = utils.save_channel_message(
+                user, channel, dt_posted, message
+            )
+        except IntegrityError:
+            return standup.utils.json_response(
+                payload={},
+                message="Failed to post message",
+                error="INTERNAL_DB_ERR",
+                json_status=500,
+                http_status=500
+            )
+        mentions.record_mentions(user, channel, dt_posted, message, members)
+
     return standup.utils.json_response(
         payload={"message_id": channel_message.pk},
         message="Saved message"
@@ -312,7 +432,19 @@ def message_channel(request):
 
 
 def list_logs(request):
-    """ Endpoint to handle request to list logs """
+    """ Endpoint to handle request to list logs
+
+    GET Headers:
+        - X-USER-EMAIL
+
+    Parameters:
+        - dt_start: First date of range
+        - dt_end: Last date of range, at most 31 days after dt_start
+        - channel_id: ID of channel to list logs of
+        - since: Optional cursor returned by a previous call. Only
+          messages created or edited since are listed, by date, along with
+          the dates and author emails of removed messages
+    """
     bad_secret, response, args = standup.utils.check_request_secret(request)
     if bad_secret:
         return response
@@ -356,9 +488,7 @@ def list_logs(request):
 
     if dt_start > dt_end:
         # Swap date range if reversed
-        dt_start, dt_end = dt_end, dt_end
-
-    print("Processing %s - %s" % (args["dt_start"], args["dt_end"]))
+        dt_start, dt_end = dt_end, dt_start
 
     dt_delta = (dt_end - dt_start).days
     if dt_delta > 31:
@@ -369,35 +499,361 @@ def list_logs(request):
             http_status=400
         )
 
-    # Get sorted list of dates
-    dt_range = [
-        {"date": dt_start + dtt.timedelta(i), "messages": []}
-        for i in range(dt_delta+1)
-    ]
-
-    # Get list of logs
-    messages = channel.channelmessage_set.filter(
-        dt_posted__gte=dt_start, dt_posted__lte=dt_end
-    )
-    for message in messages:
-        dt_i = (message.dt_posted - dt_start).days
+    # Cursor of next delta sync, and start of this one
+    cursor = utils.encode_cursor((timezone.now() - dtt.timedelta(
+        seconds=settings.SYNC_CURSOR_LAG_SECONDS
+    )).isoformat())
+    since = None
+    if args.get("since"):
         try:
-            dt_range[dt_i]["messages"].append({
+            since = dtt.datetime.fromisoformat(
+                utils.decode_cursor(args["since"])[0]
+            )
+            if since.tzinfo is None:
+                raise ValueError("Cursor without timezone")
+        except (ValueError, TypeError):
+            return standup.utils.json_response(
+                error="INVALID_ARG",
+                message="Bad value for since",
+                json_status=400,
+                http_status=400
+            )
+
+    pending = {}
+    if settings.BURST_POSTING:
+        # Show user their own posts that are still spooled
+        user = next(
+            member for member in members if member.email.lower() == user_email
+        )
+        for dt_posted, message in spool.get_pending(
+                user.pk, channel.pk, dt_start, dt_end
+        ):
+            pending[dt_posted] = {
                 "user": {
-                    "email": message.user.email,
-                    "first_name": message.user.first_name,
-                    "last_name": message.user.last_name
+                    "email": user.email,
+                    "first_name": user.first_name,
+                    "last_name": user.last_name
                 },
-                "message": message.message
+                "message": message
+            }
+
+    def build_response():
+        if since is not None:
+            # Only messages changed and removed since last sync
+            with timing.phase("query"):
+                days = daycache.load_messages(
+                    channel.pk, dt_start, dt_end, since
+                )
+                removed = models.ChannelMessageTombstone.objects.using(
+                    shards.get_shard(channel.pk)
+                ).filter(
+                    channel=channel, dt_removed__gt=since,
+                    dt_posted__gte=dt_start, dt_posted__lte=dt_end
+                ).values_list("dt_posted", "user_email")
+                removed = [
+                    {"date": dt_posted, "email": email}
+                    for dt_posted, email in removed
+                ]
+            for dt_posted, entry in pending.items():
+                days[dt_posted] = [
+                    other for other in days.get(dt_posted, [])
+                    if other["user"]["email"] != entry["user"]["email"]
+                ] + [entry]
+
+            return standup.utils.json_response(payload={
+                "logs": [
+                    {"date": dt, "messages": days[dt]} for dt in sorted(days)
+                ],
+                "removed": removed,
+                "cursor": cursor
             })
-        except IndexError:
+
+        # Get sorted list of dates, and their serialized messages
+        dates = [dt_start + dtt.timedelta(i) for i in range(dt_delta + 1)]
+        buckets = daycache.get_buckets(
+            channel.pk, dates, timezone.now().date()
+        )
+        for dt_posted, entry in pending.items():
+            buckets[dt_posted] = json.dumps([
+                other for other in json.loads(buckets[dt_posted])
+                if other["user"]["email"] != entry["user"]["email"]
+            ] + [entry])
+
+        logs = ", ".join(
+            '{"date": "%s", "messages": %s}' % (dt.isoformat(), buckets[dt])
+            for dt in dates
+        )
+        return standup.utils.raw_json_response(
+            '{"logs": [%s], "cursor": %s}' % (logs, json.dumps(cursor))
+        )
+
+    # Members see the same logs, except for their own spooled posts
+    scope = user_email if pending else "members"
+    return coalesce.run(
+        coalesce.get_key(
+            "channel:list-logs", channel.pk, scope, dt_start, dt_end, since
+        ),
+        build_response
+    )
+
+
+def list_timeline(request):
+    """ Endpoint to list messages across all of user's channels
+
+    GET Headers:
+        - X-USER-EMAIL
+
+    Parameters:
+        - dt_start: First date of range
+        - dt_end: Last date of range
+        - cursor: Optional cursor returned by previous page
+        - limit: Optional maximum number of messages per page
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    user_email = request.headers.get("X-USER-EMAIL").lower()
+    err = standup.utils.assert_required_args(args, "dt_start", "dt_end")
+    if err:
+        return err
+
+    try:
+        dt_start = utils.parse_iso_date_str(args["dt_start"])
+        dt_end = utils.parse_iso_date_str(args["dt_end"])
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Invalid ISO date range, must be YYYY-MM-DD",
+            json_status=400,
+            http_status=400
+        )
+
+    if dt_start > dt_end:
+        dt_start, dt_end = dt_end, dt_start
+
+    if (dt_end - dt_start).days > MAX_TIMELINE_DAYS:
+        return standup.utils.json_response(
+            error="INVALID_RANGE",
+            message="Date range too large",
+            json_status=400,
+            http_status=400
+        )
+
+    try:
+        limit = min(int(args.get("limit", 100)), MAX_TIMELINE_LIMIT)
+        if limit <= 0:
+            raise ValueError("Limit must be positive")
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Bad value for limit",
+            json_status=400,
+            http_status=400
+        )
+
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
             return standup.utils.json_response(
-                error="INTERNAL EXC",
-                message="Internal error loading dates of messages",
-                json_status=500,
-                http_status=500
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    after = None
+    if args.get("cursor"):
+        # Resume after last message of previous page
+        try:
+            posted, channel_id, user_id = utils.decode_cursor(args["cursor"])
+            after = (
+                utils.parse_iso_date_str(posted), int(channel_id),
+                int(user_id)
+            )
+        except (ValueError, TypeError):
+            return standup.utils.json_response(
+                error="INVALID_ARG",
+                message="Bad value for cursor",
+                json_status=400,
+                http_status=400
+            )
+
+    with timing.phase("query"):
+        page = utils.get_timeline_page(
+            utils.get_member_channel_ids(user), dt_start, dt_end, after, limit
+        )
+        users = User.objects.in_bulk({user_id for (_, _, user_id), _ in page})
+        channels = models.Channel.objects.in_bulk(
+            {channel_id for (_, channel_id, _), _ in page}
+        )
+
+    cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        dt_posted, channel_id, user_id = page[-1][0]
+        cursor = utils.encode_cursor(
+            dt_posted.isoformat(), channel_id, user_id
+        )
+
+    return standup.utils.json_response(
+        payload={
+            "messages": [
+                {
+                    "channel": {
+                        "channel_id": channel_id,
+                        "channel_name": channels[channel_id].name
+                    },
+                    "date": dt_posted,
+                    "user": {
+                        "email": users[user_id].email,
+                        "first_name": users[user_id].first_name,
+                        "last_name": users[user_id].last_name
+                    },
+                    "message": message
+                }
+                for (dt_posted, channel_id, user_id), message in page
+                # Archived messages of deleted users are left out
+                if user_id in users
+            ],
+            "cursor": cursor
+        }
+    )
+
+
+def get_channel_stats(request):
+    """ Endpoint to fetch participation stats of channel members
+
+    GET Headers:
+        - X-USER-EMAIL
+
+    Parameters:
+        - channel_id: ID of channel to fetch stats for
+        - year: Optional year of stats, defaults to current year
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    user_email = request.headers.get("X-USER-EMAIL").lower()
+    err = standup.utils.assert_required_args(args, "channel_id")
+    if err:
+        return err
+
+    err_response, channel, members = utils.get_channel_by_member(
+        user_email, args["channel_id"]
+    )
+    if err_response:
+        return err_response
+
+    today = timezone.now().date()
+    try:
+        year = int(args.get("year", today.year))
+        if not rollups.MIN_STATS_YEAR <= year <= rollups.MAX_STATS_YEAR:
+            raise ValueError("Year out of range")
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Bad value for year",
+            json_status=400,
+            http_status=400
+        )
+
+    with timing.phase("query"):
+        stats = rollups.get_channel_stats(channel, members, year, today)
+
+    return standup.utils.json_response(payload=stats)
+
+
+def list_mentions(request):
+    """ Endpoint to list messages mentioning user, newest first
+
+    GET Headers:
+        - X-USER-EMAIL
+
+    Parameters:
+        - cursor: Optional cursor returned by previous page
+        - limit: Optional maximum number of messages per page
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    user_email = request.headers.get("X-USER-EMAIL", "")
+    try:
+        limit = min(int(args.get("limit", 25)), MAX_MENTIONS_LIMIT)
+        if limit <= 0:
+            raise ValueError("Limit must be positive")
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Bad value for limit",
+            json_status=400,
+            http_status=400
+        )
+
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    filters = Q(user=user, channel__archived=False)
+    if args.get("cursor"):
+        # Resume before last mention of previous page
+        try:
+            posted, mention_id = utils.decode_cursor(args["cursor"])
+            posted = utils.parse_iso_date_str(posted)
+            mention_id = int(mention_id)
+        except (ValueError, TypeError):
+            return standup.utils.json_response(
+                error="INVALID_ARG",
+                message="Bad value for cursor",
+                json_status=400,
+                http_status=400
+            )
+        filters &= (
+            Q(dt_posted__lt=posted) | Q(dt_posted=posted, pk__lt=mention_id)
+        )
+
+    with timing.phase("query"):
+        page = list(
+            models.ChannelMention.objects.filter(filters).select_related(
+                "channel", "author"
+            ).order_by("-dt_posted", "-pk")[:limit + 1]
+        )
+        cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            cursor = utils.encode_cursor(
+                page[-1].dt_posted.isoformat(), page[-1].pk
             )
+        texts = mentions.get_messages([
+            (mention.channel_id, mention.author_id, mention.dt_posted)
+            for mention in page
+        ])
 
     return standup.utils.json_response(
-        payload={"logs": dt_range}
+        payload={
+            "messages": [
+                {
+                    "channel": {
+                        "channel_id": mention.channel_id,
+                        "channel_name": mention.channel.name
+                    },
+                    "date": mention.dt_posted,
+                    "user": {
+                        "email": mention.author.email,
+                        "first_name": mention.author.first_name,
+                        "last_name": mention.author.last_name
+                    },
+                    "message": texts.get((
+                        mention.channel_id, mention.author_id,
+                        mention.dt_posted
+                    ))
+                }
+                for mention in page
+            ],
+            "cursor": cursor
+        }
     )
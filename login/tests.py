@@ -1,3 +1,27 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
 
-# Create your tests here.
+from standup.testing import ApiTestCase
+
+
+class RegisterUserTest(ApiTestCase):
+    def register(self, **headers):
+        return self.call(
+            "post", "/auth/user/register", headers=headers,
+            user_email="nina@example.com", user_pass="secret",
+            user_fname="Nina"
+        )
+
+    def test_replays_retried_registration(self):
+        response, body = self.register(HTTP_IDEMPOTENCY_KEY="register")
+        self.assertEqual(response.status_code, 200)
+        retry, retry_body = self.register(HTTP_IDEMPOTENCY_KEY="register")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry_body, body)
+        self.assertEqual(
+            User.objects.filter(email="nina@example.com").count(), 1
+        )
+
+        # Without a key, the retry is a new registration
+        response, body = self.register()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(body["error"], "EMAIL_USED")
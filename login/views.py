@@ -1,6 +1,8 @@
 from django.contrib import auth
 from django.contrib.auth.models import User
 
+from standup import idempotency
+from standup import timing
 import standup.utils
 
 
@@ -12,6 +14,7 @@ ARGS_INVALID_EMAIL = {
 }
 
 
+@idempotency.idempotent
 def register_user(request):
     """ POST handler for registering a user
 
@@ -116,10 +119,13 @@ def get_user_settings(request):
         return response
 
     user_email = request.headers.get("X-USER-EMAIL").lower()
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     return standup.utils.json_response(
         payload={
@@ -132,6 +138,7 @@ def get_user_settings(request):
     )
 
 
+@idempotency.idempotent
 def set_user_name(request):
     """ POST hander for setting user's name """
     bad_secret, response, args = standup.utils.check_request_secret(request)
@@ -145,10 +152,13 @@ def set_user_name(request):
     first_name = args["first_name"].strip()
     last_name = args["last_name"].strip()
     user_email = request.headers.get("X-USER-EMAIL").lower()
-    try:
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     name_len = len(user.first_name) + len(user.last_name)
     if name_len > 32:
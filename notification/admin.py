@@ -4,3 +4,4 @@ from notification import models
 
 
 admin.site.register(models.Notification)
+admin.site.register(models.Reminder)
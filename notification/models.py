@@ -24,3 +24,18 @@ class Notification(models.Model):
 
     def __str__(self):
         return "[%s] %s" % (self.user.email, self.title)
+
+
+class Reminder(models.Model):
+    """ Standup reminder sent to user for a date, at most one per date """
+    #: Reminded user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
+
+    #: Date user was reminded to post for
+    dt_date = models.DateField(null=False)
+
+    def __str__(self):
+        return "%s: %s" % (self.user.email, self.dt_date)
+
+    class Meta:
+        unique_together = ("user", "dt_date")
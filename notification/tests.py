@@ -1,3 +1,64 @@
-from django.test import TestCase
+import io
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+
+import channel.models
+from notification import models
+from standup.testing import ApiTestCase
+
+
+class NotificationResponseTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.nina = User.objects.create_user(
+            username="nina@example.com", email="nina@example.com"
+        )
+        self.note = models.Notification.objects.create(
+            user=self.nina, title="Invite", message="Join team"
+        )
+        channel.models.ChannelInvite.objects.create(
+            note=self.note, user=self.nina, channel=self.channel
+        )
+
+    def respond(self, **args):
+        return self.call(
+            "post", "/notify/response", email=self.nina.email,
+            headers={"HTTP_IDEMPOTENCY_KEY": "accept"},
+            notification_id=self.note.pk, **args
+        )
+
+    def test_replays_retried_acceptance(self):
+        response, _ = self.respond(invite="accept", dismissed=True)
+        self.assertEqual(response.status_code, 200)
+        retry, _ = self.respond(invite="accept", dismissed=True)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+
+        self.assertEqual(
+            channel.models.ChannelMember.objects.filter(
+                user=self.nina, channel=self.channel
+            ).count(), 1
+        )
+        self.assertEqual(
+            channel.models.Channel.objects.get(
+                pk=self.channel.pk
+            ).member_count, 3
+        )
+        self.assertTrue(models.Notification.objects.get(
+            pk=self.note.pk
+        ).dismissed)
+
+        response, body = self.respond(invite="decline")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(body["error"], "IDEMPOTENCY_KEY_REUSED")
+
+    def test_logs_response_instead_of_printing(self):
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertLogs("notification.views", "DEBUG") as logs:
+                response, _ = self.call(
+                    "post", "/notify/response", email=self.nina.email,
+                    notification_id=self.note.pk, dismissed=True
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Notification %d updated" % self.note.pk, logs.output[0])
+        self.assertEqual(stdout.getvalue(), "")
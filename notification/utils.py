@@ -0,0 +1,33 @@
+import base64
+import hashlib
+from typing import Dict, Iterable, List
+
+from notification import models
+
+
+#: Maximum unread notifications returned in a listing
+MAX_UNREAD = 25
+
+
+def serialize_notifications(
+        notes: Iterable[models.Notification]
+) -> List[Dict]:
+    """ Returns list of notifications as response dictionaries """
+    return [
+        {
+            "id": note.pk,
+            "timestamp": note.dt_created,
+            "message": note.message,
+            "role": note.role,
+            "title": note.title
+        }
+        for note in notes
+    ]
+
+
+def hash_notifications(notifications: List[Dict]) -> str:
+    """ Returns hash of notification ids, to detect changes in listing """
+    pks = sorted([note["id"] for note in notifications])
+    return base64.b64encode(
+        hashlib.md5(",".join(str(pk) for pk in pks).encode("utf8")).digest()
+    ).decode()
@@ -1,10 +1,16 @@
-import base64
+import logging
+
 from django.contrib.auth.models import User
-import hashlib
 
 import channel.models
+from standup import idempotency
+from standup import timing
 import standup.utils
 from notification import models
+from notification import utils
+
+
+logger = logging.getLogger(__name__)
 
 
 def get_unread_notifications(request):
@@ -17,32 +23,29 @@ def get_unread_notifications(request):
     if bad_secret:
         return response
 
-    try:
-        user_email = request.headers.get("X-USER-EMAIL")
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
-
-    notifications = [
-        {
-            "id": note.pk,
-            "timestamp": note.dt_created,
-            "message": note.message,
-            "role": note.role,
-            "title": note.title
-        }
-        for note in user.notification_set.filter(dismissed=False)[:25]
-    ]
-    pks = sorted([note["id"] for note in notifications])
-    pk_hash = base64.b64encode(
-        hashlib.md5(",".join(str(pk) for pk in pks).encode("utf8")).digest()
-    ).decode()
+    with timing.phase("user"):
+        try:
+            user_email = request.headers.get("X-USER-EMAIL")
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    with timing.phase("query"):
+        notifications = utils.serialize_notifications(
+            user.notification_set.filter(dismissed=False)[:utils.MAX_UNREAD]
+        )
 
     return standup.utils.json_response(
-        payload={"notifications": notifications, "hash": pk_hash}
+        payload={
+            "notifications": notifications,
+            "hash": utils.hash_notifications(notifications)
+        }
     )
 
 
+@idempotency.idempotent
 def handle_notification_response(request):
     """ POST hander for user's response to a notification
 
@@ -56,11 +59,14 @@ def handle_notification_response(request):
         return response
 
     note_id = args.get("notification_id", "")
-    try:
-        user_email = request.headers.get("X-USER-EMAIL")
-        user = User.objects.get(email__iexact=user_email)
-    except User.DoesNotExist:
-        return standup.utils.json_response(**standup.utils.USER_DOES_NOT_EXIST)
+    with timing.phase("user"):
+        try:
+            user_email = request.headers.get("X-USER-EMAIL")
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
 
     # Fetch notification
     try:
@@ -106,6 +112,6 @@ def handle_notification_response(request):
         except channel.models.ChannelInvite.DoesNotExist:
             pass
 
-    print("Notification: %s" % note_id)
+    logger.debug("Notification %s updated by %s", note.pk, user.email)
     note.save()
     return standup.utils.json_response(payload={})
@@ -0,0 +1,215 @@
+""" Admission control of API requests
+
+Each requester, the user of X-USER-EMAIL or else the backend secret, gets a
+token bucket per endpoint class, RATE_LIMITS, so a client polling for
+notifications cannot starve its own writes, nor other users. Independent
+of the requester, MAX_CONCURRENT_PER_VIEW bounds the requests a view
+serves at once, so a slow endpoint sheds load before it holds every
+worker. State is kept by the store of ADMISSION_STORE, in-process, or in
+the Django cache to be shared by the worker processes using it.
+
+Only requests with a valid backend secret are counted, so a client without
+it cannot drain the buckets of the users it names. A batch request is not
+counted itself, its sub-requests are, each against its own endpoint class.
+"""
+import collections
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union
+
+from django.core.cache import cache
+
+from standup import settings
+import standup.utils
+
+
+#: Endpoint class of routes by view name, other routes are "read" for GET
+#: requests and "write" otherwise
+ENDPOINT_CLASSES = {
+    "notificiations:get-unread": "poll",
+    "dashboard": "poll",
+}
+
+#: Routes never limited, e.g. for monitoring
+EXEMPT_VIEWS = {"metrics"}
+
+#: Namespaces of routes never limited
+EXEMPT_NAMESPACES = {"admin"}
+
+#: Routes whose requests are counted by their sub-requests
+BATCH_VIEWS = {"batch"}
+
+
+def get_endpoint_class(view_name: str, method: str) -> str:
+    """ Returns rate limit class of route for request method """
+    endpoint_class = ENDPOINT_CLASSES.get(view_name)
+    if endpoint_class is not None:
+        return endpoint_class
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+def is_authenticated(request) -> bool:
+    """ Checks if request has the backend secret, which its view also does
+
+    Requests whose arguments cannot be parsed are left to their view.
+    """
+    try:
+        bad_secret, _, _ = standup.utils.check_request_secret(request)
+    except ValueError:
+        return False
+    return not bad_secret
+
+
+def get_identity(request) -> str:
+    """ Returns key of requester, its user or else its backend secret """
+    email = request.headers.get("X-USER-EMAIL")
+    if email:
+        return "user:" + email.strip().lower()
+    secret = request.headers.get("X-BACKEND-SECRET", "")
+    return "secret:" + hashlib.sha256(
+        secret.encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def refill(
+        tokens: float, t_last: float, now: float, rate: float, burst: int
+) -> float:
+    """ Returns tokens of bucket after refilling it from t_last to now """
+    return min(float(burst), tokens + max(0.0, now - t_last) * rate)
+
+
+class LocalStore:
+    """ Buckets and slot counts of this process
+
+    Buckets are kept in order of last use. Least recently used buckets are
+    dropped once they have refilled, as a new bucket is full too, or once
+    there are more than ADMISSION_MAX_BUCKETS. Slot counts are dropped when
+    their last slot is freed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #: Tokens, time of last use and time full again, by key
+        self.buckets: Dict[str, Tuple[float, float, float]] = (
+            collections.OrderedDict()
+        )
+        self.slots: Dict[str, int] = {}
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """ Takes a token from bucket of key
+
+        :return: Seconds until a token is available, 0 if one was taken
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, t_last, _ = self.buckets.pop(
+                key, (float(burst), now, now)
+            )
+            tokens = refill(tokens, t_last, now, rate, burst)
+            wait = 0.0
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            self._evict(now)
+            return wait
+
+    def _evict(self, now: float):
+        """ Drops stale buckets, called with lock held """
+        while self.buckets:
+            key, (_, _, t_full) = next(iter(self.buckets.items()))
+            if t_full > now and (
+                    len(self.buckets) <= settings.ADMISSION_MAX_BUCKETS
+            ):
+                break
+            del self.buckets[key]
+
+    def acquire(self, key: str, limit: int) -> bool:
+        """ Takes one of limit slots of key, if any is free """
+        with self.lock:
+            used = self.slots.get(key, 0)
+            if used >= limit:
+                return False
+            self.slots[key] = used + 1
+            return True
+
+    def release(self, key: str):
+        """ Frees slot of key taken by acquire """
+        with self.lock:
+            used = self.slots.get(key, 0) - 1
+            if used > 0:
+                self.slots[key] = used
+            else:
+                self.slots.pop(key, None)
+
+
+class CacheStore:
+    """ Buckets and slot counts in the Django cache, shared by workers
+
+    Buckets are read and written without a lock, so requests racing on one
+    bucket may each take the same token, and limits are approximate. Slot
+    counts use the cache's atomic increments and expire after
+    ADMISSION_SLOT_SECONDS, so slots of a killed worker are not lost.
+    """
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """ Takes a token from bucket of key, see LocalStore.take """
+        cache_key = "admission:bucket:" + key
+        now = time.time()
+        tokens, t_last = cache.get(cache_key, (float(burst), now))
+        tokens = refill(tokens, t_last, now, rate, burst)
+        timeout = int(burst / rate) + 1
+        if tokens < 1:
+            cache.set(cache_key, (tokens, now), timeout)
+            return (1 - tokens) / rate
+        cache.set(cache_key, (tokens - 1, now), timeout)
+        return 0.0
+
+    def acquire(self, key: str, limit: int) -> bool:
+        """ Takes one of limit slots of key, if any is free """
+        cache_key = "admission:slots:" + key
+        cache.add(cache_key, 0, settings.ADMISSION_SLOT_SECONDS)
+        try:
+            used = cache.incr(cache_key)
+        except ValueError:
+            # Expired between add and incr
+            cache.add(cache_key, 1, settings.ADMISSION_SLOT_SECONDS)
+            return True
+        if used > limit:
+            self.release(key)
+            return False
+        return True
+
+    def release(self, key: str):
+        """ Frees slot of key taken by acquire """
+        try:
+            cache.decr("admission:slots:" + key)
+        except ValueError:
+            pass
+
+
+_stores = {"local": LocalStore(), "cache": CacheStore()}
+
+
+def get_store() -> Optional[Union[LocalStore, CacheStore]]:
+    """ Returns store of ADMISSION_STORE, None if admission is disabled """
+    return _stores.get(settings.ADMISSION_STORE)
+
+
+def take_token(request, view_name: str, method: str) -> float:
+    """ Takes a token for request from its requester's bucket of the
+    endpoint class of its route
+
+    :return: Seconds until a token is available, 0 if one was taken or the
+    class is not limited
+    """
+    store = get_store()
+    if store is None:
+        return 0.0
+    endpoint_class = get_endpoint_class(view_name, method)
+    rate, burst = settings.RATE_LIMITS[endpoint_class]
+    if rate <= 0:
+        return 0.0
+    return store.take(
+        "%s:%s" % (get_identity(request), endpoint_class), rate, burst
+    )
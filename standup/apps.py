@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.core.signals import request_started
+
+
+class StandupConfig(AppConfig):
+    name = 'standup'
+
+    def ready(self):
+        from standup import settings
+        import standup.db
+
+        if settings.DB_CONN_HEALTH_CHECKS:
+            request_started.connect(
+                standup.db.close_unhealthy_connections,
+                dispatch_uid="standup.db.close_unhealthy_connections"
+            )
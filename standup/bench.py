@@ -0,0 +1,143 @@
+""" Helpers for benchmark management commands
+
+Benchmarks that depend on settings read at startup run each configuration
+in a fresh interpreter, which reports its timings back as JSON on stdout.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+from standup import settings
+
+
+def run_python(code: str, env: Optional[Dict[str, str]] = None) -> Dict:
+    """ Runs code in new interpreter from project directory
+
+    :param code: Python source which prints a JSON object as its last line
+    :param env: Environment variables to override for child process
+    :return: Decoded JSON object printed by child
+    """
+    child_env = dict(os.environ, **(env or {}))
+    child_env.setdefault("DJANGO_SETTINGS_MODULE", "standup.settings")
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=settings.BASE_DIR, env=child_env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+        universal_newlines=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples: List[float]) -> str:
+    """ Formats timing samples in seconds as millisecond summary """
+    return "median %.1fms  min %.1fms  max %.1fms" % (
+        statistics.median(samples) * 1000, min(samples) * 1000,
+        max(samples) * 1000
+    )
+
+
+#: Path of first request of each deployment profile, one it routes
+COLD_START_PATHS = {
+    "full": "/auth/user/settings/get",
+    "api": "/auth/user/settings/get",
+    "admin": "/admin/login/",
+}
+
+
+#: Child script timing WSGI application load and its first request
+COLD_START_SCRIPT = """
+import io, json, os, sys, time
+t_start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+t_loaded = time.perf_counter()
+
+from standup import settings
+environ = {
+    "REQUEST_METHOD": "GET",
+    "PATH_INFO": os.environ["BENCH_PATH"],
+    "QUERY_STRING": "",
+    "SERVER_NAME": "localhost",
+    "SERVER_PORT": "80",
+    "HTTP_HOST": "localhost",
+    "HTTP_X_BACKEND_SECRET": settings.BACKEND_SECRET,
+    "HTTP_X_USER_EMAIL": os.environ.get("BENCH_USER_EMAIL", ""),
+    "wsgi.input": io.BytesIO(b""),
+    "wsgi.errors": sys.stderr,
+    "wsgi.url_scheme": "http",
+}
+status = []
+body = b"".join(application(environ, lambda s, h: status.append(s)))
+t_done = time.perf_counter()
+print(json.dumps({
+    "load": t_loaded - t_start,
+    "first_request": t_done - t_loaded,
+    "status": status[0],
+}))
+"""
+
+
+#: Child script timing sequential or threaded requests through the WSGI
+#: application, with optional simulated connect latency
+CONNECTION_SCRIPT = """
+import io, json, os, sys, threading, time
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+
+from django.db import connections
+from standup import settings
+
+delay = float(os.environ.get("BENCH_CONNECT_DELAY_MS", "0")) / 1000
+if delay:
+    wrapper_class = type(connections["default"])
+    create = wrapper_class.create_connection
+    def slow_create(self, conn_params):
+        time.sleep(delay)
+        return create(self, conn_params)
+    wrapper_class.create_connection = slow_create
+
+def request():
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": os.environ["BENCH_PATH"],
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "HTTP_HOST": "localhost",
+        "HTTP_X_BACKEND_SECRET": settings.BACKEND_SECRET,
+        "HTTP_X_USER_EMAIL": os.environ.get("BENCH_USER_EMAIL", ""),
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": "http",
+    }
+    t_start = time.perf_counter()
+    response = application(environ, lambda s, h: None)
+    b"".join(response)
+    response.close()
+    return time.perf_counter() - t_start
+
+n_requests = int(os.environ["BENCH_REQUESTS"])
+n_threads = int(os.environ["BENCH_THREADS"])
+latencies = []
+lock = threading.Lock()
+
+def worker():
+    for _ in range(n_requests // n_threads):
+        latency = request()
+        with lock:
+            latencies.append(latency)
+
+request()
+threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+t_start = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(json.dumps({
+    "latencies": latencies,
+    "elapsed": time.perf_counter() - t_start,
+}))
+"""
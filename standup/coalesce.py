@@ -0,0 +1,142 @@
+""" Single-flight execution of identical concurrent reads
+
+Views pass the work of building a response to run, keyed on everything the
+response depends on, including the requester's visibility scope. While one
+call for a key is in flight, identical calls in the same process wait for
+it and answer with a copy of its response. With COALESCE_CACHE set, a lock
+in the Django cache extends this to the worker processes sharing the
+cache. Waiters that time out, or whose leader failed, build the response
+themselves.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from standup import metrics
+from standup import settings
+from standup import timing
+
+
+#: Frozen response shared with waiters
+Result = Dict
+
+
+class Flight:
+    """ Computation in flight for a key """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Result] = None
+
+
+_flights: Dict[str, Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_key(view: str, *parts) -> str:
+    """ Returns key of view's response for normalized arguments """
+    return "coalesce:%s:%s" % (view, hashlib.md5(
+        "|".join(str(part) for part in parts).encode("utf-8")
+    ).hexdigest())
+
+
+def freeze(response: HttpResponse) -> Optional[Result]:
+    """ Returns shareable copy of response, or None if it is a failure """
+    if response.status_code >= 500 or response.streaming:
+        return None
+    return {
+        "content": response.content,
+        "status": response.status_code,
+        "content_type": response["Content-Type"],
+        "error": getattr(response, "error_label", None),
+    }
+
+
+def thaw(result: Result) -> HttpResponse:
+    """ Builds response of waiter from shared copy """
+    response = HttpResponse(
+        result["content"], status=result["status"],
+        content_type=result["content_type"]
+    )
+    response.error_label = result["error"]
+    response["Server-Timing"] = timing.get_header()
+    return response
+
+
+def run(key: str, compute: Callable[[], HttpResponse]) -> HttpResponse:
+    """ Calls compute once for concurrent calls with the same key
+
+    :param key: Key of response, see get_key
+    :param compute: Function building the response
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _flights[key] = Flight()
+
+    if not is_leader:
+        with timing.phase("coalesce"):
+            flight.done.wait(settings.COALESCE_WAIT_SECONDS)
+        metrics.record_cache("coalesce", flight.result is not None)
+        if flight.result is not None:
+            return thaw(flight.result)
+        return compute()
+
+    try:
+        if settings.COALESCE_CACHE:
+            response = run_shared(key, compute)
+        else:
+            response = compute()
+        flight.result = freeze(response)
+        return response
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def run_shared(key: str, compute: Callable[[], HttpResponse]) -> HttpResponse:
+    """ Calls compute once for concurrent calls across processes
+
+    The first process takes the key's lock in the cache and publishes its
+    response under the lock's token, the others poll for it.
+    """
+    lock_key = key + ":lock"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, settings.COALESCE_WAIT_SECONDS):
+        try:
+            response = compute()
+            result = freeze(response)
+            if result is not None:
+                cache.set(
+                    "%s:%s" % (key, token), result,
+                    settings.COALESCE_WAIT_SECONDS
+                )
+            return response
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    leader_token = cache.get(lock_key)
+    result_key = "%s:%s" % (key, leader_token)
+    deadline = time.monotonic() + settings.COALESCE_WAIT_SECONDS
+    with timing.phase("coalesce"):
+        while leader_token is not None and time.monotonic() < deadline:
+            # Lock is read first, as the result is set before its release
+            is_locked = cache.get(lock_key) == leader_token
+            result = cache.get(result_key)
+            if result is not None:
+                metrics.record_cache("coalesce", True)
+                return thaw(result)
+            if not is_locked:
+                # Leader finished without a shareable response
+                break
+            time.sleep(settings.COALESCE_POLL_SECONDS)
+
+    metrics.record_cache("coalesce", False)
+    return compute()
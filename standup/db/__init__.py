@@ -0,0 +1,106 @@
+""" Database helpers shared by the apps """
+import contextlib
+import functools
+import random
+import time
+
+from django.db import connections, transaction
+
+from standup import settings
+
+
+def is_lock_error(ex: Exception) -> bool:
+    """ Checks if error was raised by SQLite lock contention """
+    message = str(ex).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def retry_locked(func, *args, **kwargs):
+    """ Calls function, retrying with jittered backoff on lock contention
+
+    Tries up to SQLITE_WRITE_RETRIES more times while the error raised is
+    a SQLite lock error, either Django's or the DB-API's OperationalError.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as ex:
+            if not is_lock_error(ex) or (
+                    attempt >= settings.SQLITE_WRITE_RETRIES
+            ):
+                raise
+        attempt += 1
+        time.sleep(random.uniform(0.5, 1.5) * 0.05 * 2 ** attempt)
+
+
+@contextlib.contextmanager
+def immediate_atomic(using: str = None):
+    """ Atomic block whose transaction takes the write lock on entry
+
+    Used by write_transaction, and directly for writes to a second database
+    inside a write transaction. Nested blocks join the outer transaction.
+    """
+    connection = connections[using or "default"]
+    if connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    connection.immediate_transactions = True
+    try:
+        with transaction.atomic(using=using):
+            connection.immediate_transactions = False
+            yield
+    finally:
+        connection.immediate_transactions = False
+
+
+def write_transaction(using: str = None):
+    """ Decorator running function in a write transaction, with retries
+
+    On the tuned SQLite backend the transaction starts with BEGIN
+    IMMEDIATE, taking the write lock before the first read so that it
+    cannot fail to upgrade a read lock halfway through. If the lock is
+    still contended after the busy timeout, the whole function is retried,
+    see retry_locked. Nested calls join the outer transaction and leave
+    retries to it.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            connection = connections[using or "default"]
+            if connection.in_atomic_block:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+
+            def attempt():
+                with immediate_atomic(using):
+                    return func(*args, **kwargs)
+
+            return retry_locked(attempt)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def execute_wrapper(wrapper):
+    """ Installs query execution wrapper on every configured database """
+    with contextlib.ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(wrapper))
+        yield
+
+
+def close_unhealthy_connections(**kwargs):
+    """ Closes reused connections that fail their health check
+
+    Connected to request_started when DB_CONN_HEALTH_CHECKS is set, so a
+    connection kept by CONN_MAX_AGE that the server dropped meanwhile is
+    reopened instead of failing the request's first query.
+    """
+    for conn in connections.all():
+        if conn.connection is None or conn.in_atomic_block:
+            continue
+        if not conn.is_usable():
+            conn.close()
@@ -0,0 +1,116 @@
+""" In-process pool of DB-API connections for threaded servers
+
+Django opens a connection per thread and closes it at the end of each
+request, unless CONN_MAX_AGE keeps it for the thread's next request. With
+DB_POOL_SIZE set, closed connections are instead kept by a process wide
+pool and handed to whichever thread connects next, health checked first
+if DB_CONN_HEALTH_CHECKS is set.
+"""
+import queue
+import threading
+from typing import Dict
+
+from django.conf import settings
+
+
+class ConnectionPool:
+    """ LIFO pool of idle DB-API connections, most recent reused first """
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = queue.LifoQueue()
+
+    def get(self, create, check):
+        """ Returns idle connection that passes check, or a new one
+
+        :param create: Function creating a new connection
+        :param check: Function testing if idle connection is usable
+        """
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return create()
+            if check(conn):
+                return conn
+            _close_quietly(conn)
+
+    def put(self, conn):
+        """ Returns connection to pool, closing it if pool is full """
+        if self.idle.qsize() >= self.size:
+            _close_quietly(conn)
+        else:
+            self.idle.put(conn)
+
+    def clear(self):
+        """ Closes all idle connections """
+        while True:
+            try:
+                _close_quietly(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str):
+    """ Returns pool of database alias, or None if pooling is disabled """
+    size = getattr(settings, "DB_POOL_SIZE", 0)
+    if not size:
+        return None
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(size)
+        return pool
+
+
+class PooledConnectionMixin:
+    """ Database wrapper mixin taking connections from the process pool """
+    def create_connection(self, conn_params):
+        """ Opens new DB-API connection, bypassing the pool """
+        return super().get_new_connection(conn_params)
+
+    def check_connection(self, conn) -> bool:
+        """ Tests that idle DB-API connection still works """
+        if not getattr(settings, "DB_CONN_HEALTH_CHECKS", False):
+            return True
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias)
+        if pool is None:
+            return self.create_connection(conn_params)
+        return pool.get(
+            lambda: self.create_connection(conn_params), self.check_connection
+        )
+
+    def _close(self):
+        pool = get_pool(self.alias)
+        if pool is None or self.connection is None or (
+                self.in_atomic_block or self.errors_occurred
+        ):
+            return super()._close()
+
+        try:
+            # End any transaction left open outside of atomic blocks
+            self.connection.rollback()
+        except Exception:
+            return super()._close()
+        pool.put(self.connection)
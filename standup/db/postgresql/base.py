@@ -0,0 +1,12 @@
+""" PostgreSQL backend with optional in-process connection pooling
+
+Drop-in replacement for django.db.backends.postgresql, see
+standup.db.pool.
+"""
+from django.db.backends.postgresql import base
+
+from standup.db import pool
+
+
+class DatabaseWrapper(pool.PooledConnectionMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,49 @@
+""" SQLite backend tuned for concurrent writers
+
+Drop-in replacement for django.db.backends.sqlite3. New connections get the
+PRAGMAs of settings.SQLITE_PRAGMAS, WAL journal and busy timeout by default,
+and transactions can take the write lock up front with BEGIN IMMEDIATE, see
+standup.db.write_transaction. Connections may be pooled, see standup.db.pool.
+"""
+import re
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+from standup.db import pool
+
+
+#: PRAGMAs that may be configured, to keep settings out of the SQL
+ALLOWED_PRAGMAS = (
+    "journal_mode", "busy_timeout", "synchronous", "mmap_size", "cache_size",
+    "temp_store", "wal_autocheckpoint",
+)
+
+_PRAGMA_VALUE = re.compile(r"^-?[A-Za-z0-9_]+$")
+
+
+def apply_pragmas(conn, pragmas: Dict[str, Optional[str]]):
+    """ Sets PRAGMAs on DB-API SQLite connection, skipping unset values """
+    for name, value in pragmas.items():
+        if value is None or value == "":
+            continue
+        if name not in ALLOWED_PRAGMAS or not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError("Invalid SQLite pragma %s=%s" % (name, value))
+        conn.execute("PRAGMA %s = %s" % (name, value))
+
+
+class DatabaseWrapper(pool.PooledConnectionMixin, base.DatabaseWrapper):
+    #: Set while the next transaction should start with BEGIN IMMEDIATE
+    immediate_transactions = False
+
+    def create_connection(self, conn_params):
+        conn = super().create_connection(conn_params)
+        apply_pragmas(conn, getattr(settings, "SQLITE_PRAGMAS", {}))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.immediate_transactions:
+            self.cursor().execute("BEGIN IMMEDIATE")
+        else:
+            super()._start_transaction_under_autocommit()
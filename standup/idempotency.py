@@ -0,0 +1,175 @@
+""" Replay of POST responses for retried requests
+
+Clients retrying a POST send the Idempotency-Key header of the first
+attempt. Views wrapped with idempotent store their response in the
+IdempotencyKey table for IDEMPOTENCY_TTL_SECONDS, under the requester,
+route and key, and answer retries from it without running again, in any
+worker process. The unique key of the table lets only the first attempt
+run, a retry arriving while it is still running is rejected with
+IDEMPOTENCY_IN_PROGRESS, and a key reused for a different request with
+IDEMPOTENCY_KEY_REUSED. Server errors are not stored, so their retries run
+again. Expired keys are taken over by the next request using them, and
+deleted by run_purges.
+"""
+import datetime as dtt
+import functools
+import hashlib
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from standup import admission
+from standup import coalesce
+from standup import metrics
+from standup import models
+from standup import settings
+from standup import timing
+import standup.utils
+
+
+#: Longest accepted Idempotency-Key
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_KEY_INVALID = {
+    "message": "Idempotency-Key must be 1 to %d characters" % MAX_KEY_LENGTH,
+    "error": "INVALID_ARG",
+    "json_status": 400,
+    "http_status": 400
+}
+
+IDEMPOTENCY_IN_PROGRESS = {
+    "message": "Request with this Idempotency-Key is still in progress",
+    "error": "IDEMPOTENCY_IN_PROGRESS",
+    "json_status": 409,
+    "http_status": 409
+}
+
+IDEMPOTENCY_KEY_REUSED = {
+    "message": "Idempotency-Key was used for a different request",
+    "error": "IDEMPOTENCY_KEY_REUSED",
+    "json_status": 422,
+    "http_status": 422
+}
+
+
+def get_key(request, idempotency_key: str) -> str:
+    """ Returns stored key of response for requester, route and key """
+    return "idempotency:%s" % hashlib.md5("|".join((
+        admission.get_identity(request), request.path_info, idempotency_key
+    )).encode("utf-8")).hexdigest()
+
+
+def get_fingerprint(request) -> str:
+    """ Returns digest of the arguments of request """
+    digest = hashlib.sha256(request.method.encode("utf-8"))
+    digest.update(request.META.get("QUERY_STRING", "").encode("utf-8"))
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """ Decorates POST view to replay its response to retries
+
+    Requests without Idempotency-Key, and batch sub-requests, which are
+    covered by the key of their batch, run the view as is.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if idempotency_key is None or request.method != "POST" or getattr(
+                request, "backend_authenticated", False
+        ):
+            return view(request, *args, **kwargs)
+
+        # Only authenticated requests may read stored responses
+        bad_secret, response, _ = standup.utils.check_request_secret(request)
+        if bad_secret:
+            return response
+        if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            return standup.utils.json_response(**IDEMPOTENCY_KEY_INVALID)
+
+        key = get_key(request, idempotency_key)
+        fingerprint = get_fingerprint(request)
+        with timing.phase("query"):
+            stored = claim(key, fingerprint)
+        if stored is not None:
+            metrics.record_cache("idempotency", True)
+            return replay(stored, fingerprint)
+        metrics.record_cache("idempotency", False)
+
+        stored_keys = models.IdempotencyKey.objects.filter(key=key)
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            stored_keys.delete()
+            raise
+        result = coalesce.freeze(response)
+        with timing.phase("query"):
+            if result is None:
+                stored_keys.delete()
+            else:
+                stored_keys.update(
+                    status=result["status"], content=result["content"],
+                    content_type=result["content_type"],
+                    error=result["error"] or "",
+                    dt_expires=timezone.now() + dtt.timedelta(
+                        seconds=settings.IDEMPOTENCY_TTL_SECONDS
+                    )
+                )
+        return response
+    return wrapper
+
+
+def claim(key: str, fingerprint: str) -> Optional[models.IdempotencyKey]:
+    """ Holds key for a running request
+
+    :returns: None if request may run, else the stored state of its key
+    """
+    now = timezone.now()
+    dt_expires = now + dtt.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        with transaction.atomic():
+            models.IdempotencyKey.objects.create(
+                key=key, fingerprint=fingerprint, dt_expires=dt_expires
+            )
+        return None
+    except IntegrityError:
+        pass
+
+    # Expired keys are taken over as new
+    if models.IdempotencyKey.objects.filter(
+            key=key, dt_expires__lte=now
+    ).update(
+        fingerprint=fingerprint, status=None, content=b"", content_type="",
+        error="", dt_expires=dt_expires
+    ):
+        return None
+    return models.IdempotencyKey.objects.filter(key=key).first()
+
+
+def replay(stored: models.IdempotencyKey, fingerprint: str) -> HttpResponse:
+    """ Builds response to retry from the stored state of its key """
+    if stored.fingerprint != fingerprint:
+        return standup.utils.json_response(**IDEMPOTENCY_KEY_REUSED)
+    if stored.status is None:
+        response = standup.utils.json_response(**IDEMPOTENCY_IN_PROGRESS)
+        response["Retry-After"] = "1"
+        return response
+    response = coalesce.thaw({
+        "content": bytes(stored.content),
+        "status": stored.status,
+        "content_type": stored.content_type,
+        "error": stored.error or None,
+    })
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def delete_expired(now: dtt.datetime) -> int:
+    """ Deletes keys expired by now, returns their count """
+    deleted, _ = models.IdempotencyKey.objects.filter(
+        dt_expires__lte=now
+    ).delete()
+    return deleted
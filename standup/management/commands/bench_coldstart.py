@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from standup import bench
+
+
+class Command(BaseCommand):
+    """ Benchmarks worker cold start for each deployment profile """
+    help = "Measure import and first request time per deployment profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runs", type=int, default=10,
+            help="Number of fresh interpreters started per profile"
+        )
+        parser.add_argument(
+            "--profile", action="append", dest="profiles",
+            choices=["full", "api", "admin"],
+            help="Profile to benchmark, may be repeated. Defaults to all"
+        )
+        parser.add_argument(
+            "--user-email", default="",
+            help="Account address sent with the first request, needed by "
+            "the full and api profiles"
+        )
+
+    def handle(self, *args, **options):
+        profiles = options["profiles"] or ["full", "api", "admin"]
+        for profile in profiles:
+            loads = []
+            firsts = []
+            for _ in range(options["runs"]):
+                result = bench.run_python(bench.COLD_START_SCRIPT, {
+                    "DEPLOY_PROFILE": profile,
+                    "ALLOWED_HOSTS": "localhost",
+                    "BENCH_PATH": bench.COLD_START_PATHS[profile],
+                    "BENCH_USER_EMAIL": options["user_email"],
+                })
+                if not 200 <= int(result["status"].split()[0]) < 400:
+                    raise CommandError(
+                        "First request of %s profile to %s failed with %s, "
+                        "pass the --user-email of an existing account" % (
+                            profile, bench.COLD_START_PATHS[profile],
+                            result["status"]
+                        )
+                    )
+                loads.append(result["load"])
+                firsts.append(result["first_request"])
+
+            self.stdout.write("%s (first response %s)" % (
+                profile, result["status"]
+            ))
+            self.stdout.write("  load:          " + bench.summarize(loads))
+            self.stdout.write("  first request: " + bench.summarize(firsts))
+            self.stdout.write("  total:         " + bench.summarize(
+                [load + first for load, first in zip(loads, firsts)]
+            ))
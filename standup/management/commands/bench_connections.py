@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from standup import bench
+
+
+#: Environment of each connection reuse policy
+MODES = {
+    "no-reuse": {"DB_CONN_MAX_AGE": "0", "DB_POOL_SIZE": "0"},
+    "persistent": {"DB_CONN_MAX_AGE": "600", "DB_POOL_SIZE": "0"},
+    "pooled": {"DB_CONN_MAX_AGE": "0", "DB_POOL_SIZE": "8"},
+}
+
+
+class Command(BaseCommand):
+    """ Benchmarks per-request latency under each connection reuse policy
+
+    Runs the get_user_settings endpoint through the WSGI application of a
+    fresh worker per policy, against the configured database. A remote
+    database can be approximated on a local stand-in with --connect-delay.
+    """
+    help = "Compare request latency with and without connection reuse"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=500,
+            help="Requests sent per policy"
+        )
+        parser.add_argument(
+            "--threads", type=int, default=1,
+            help="Concurrent request threads, as in a threaded server"
+        )
+        parser.add_argument(
+            "--connect-delay", type=float, default=0,
+            help="Milliseconds added to each new connection"
+        )
+        parser.add_argument(
+            "--user-email", default="",
+            help="Account address sent with requests"
+        )
+        parser.add_argument(
+            "--mode", action="append", dest="modes", choices=list(MODES),
+            help="Policy to benchmark, may be repeated. Defaults to all"
+        )
+
+    def handle(self, *args, **options):
+        for mode in options["modes"] or list(MODES):
+            result = bench.run_python(bench.CONNECTION_SCRIPT, dict(
+                MODES[mode],
+                ALLOWED_HOSTS="localhost",
+                BENCH_REQUESTS=str(options["requests"]),
+                BENCH_THREADS=str(options["threads"]),
+                BENCH_CONNECT_DELAY_MS=str(options["connect_delay"]),
+                BENCH_USER_EMAIL=options["user_email"],
+            ))
+            latencies = result["latencies"]
+            self.stdout.write(self.style.MIGRATE_HEADING(mode))
+            self.stdout.write("  %s  %.0f requests/s" % (
+                bench.summarize(latencies),
+                len(latencies) / result["elapsed"]
+            ))
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from standup import bench
+from standup import settings
+import standup.db
+from standup.db.sqlite3.base import apply_pragmas
+
+
+#: Schema standing in for the channel message table
+SCHEMA = """
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    dt_posted TEXT NOT NULL,
+    message TEXT NOT NULL,
+    UNIQUE (user_id, channel_id, dt_posted)
+)
+"""
+
+
+class Command(BaseCommand):
+    """ Benchmarks concurrent standup posting against a SQLite file
+
+    Each writer thread repeats the queries of message_channel, a SELECT of
+    the existing message then an INSERT or UPDATE in one transaction. The
+    "default" mode uses stock sqlite3 settings and deferred transactions,
+    the "tuned" mode the PRAGMAs of SQLITE_PRAGMAS with BEGIN IMMEDIATE and
+    retries, as done by standup.db.write_transaction.
+    """
+    help = "Compare concurrent writers on stock and tuned SQLite settings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--writers", type=int, default=16,
+            help="Number of concurrent writer threads"
+        )
+        parser.add_argument(
+            "--posts", type=int, default=50,
+            help="Messages posted by each writer"
+        )
+        parser.add_argument(
+            "--mode", action="append", dest="modes",
+            choices=["default", "tuned"],
+            help="Mode to benchmark, may be repeated. Defaults to both"
+        )
+
+    def handle(self, *args, **options):
+        for mode in options["modes"] or ["default", "tuned"]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, "bench.sqlite3")
+                conn = sqlite3.connect(path)
+                conn.executescript(SCHEMA)
+                conn.close()
+                self.run_mode(mode, path, options["writers"], options["posts"])
+
+    def run_mode(self, mode: str, path: str, writers: int, posts: int):
+        barrier = threading.Barrier(writers)
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def post(conn, user_id, day):
+            conn.execute("BEGIN IMMEDIATE" if mode == "tuned" else "BEGIN")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM message WHERE user_id = ? "
+                    "AND channel_id = 1 AND dt_posted = ?", (user_id, day)
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO message "
+                        "(user_id, channel_id, dt_posted, message) "
+                        "VALUES (?, 1, ?, ?)", (user_id, day, "x" * 200)
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE message SET message = ? WHERE id = ?",
+                        ("y" * 200, row[0])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        def writer(user_id):
+            conn = sqlite3.connect(path, isolation_level=None)
+            if mode == "tuned":
+                apply_pragmas(conn, settings.SQLITE_PRAGMAS)
+            barrier.wait()
+            for i in range(posts):
+                day = "2020-01-%02d" % (i % 28 + 1)
+                t_start = time.perf_counter()
+                try:
+                    if mode == "tuned":
+                        standup.db.retry_locked(post, conn, user_id, day)
+                    else:
+                        post(conn, user_id, day)
+                except sqlite3.OperationalError as ex:
+                    with lock:
+                        errors.append(str(ex))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - t_start)
+            conn.close()
+
+        threads = [
+            threading.Thread(target=writer, args=(user_id,))
+            for user_id in range(writers)
+        ]
+        t_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t_start
+
+        self.stdout.write(self.style.MIGRATE_HEADING(mode))
+        self.stdout.write("  posted: %d/%d  errors: %d  %.0f posts/s" % (
+            len(latencies), writers * posts, len(errors),
+            len(latencies) / elapsed
+        ))
+        if latencies:
+            latencies.sort()
+            self.stdout.write("  latency: %s  p99 %.1fms" % (
+                bench.summarize(latencies),
+                latencies[int(len(latencies) * 0.99) - 1] * 1000
+            ))
+        if errors:
+            self.stdout.write("  first error: %s" % errors[0])
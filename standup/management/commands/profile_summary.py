@@ -0,0 +1,86 @@
+import io
+import json
+import os
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from standup import settings
+
+
+class Command(BaseCommand):
+    """ Summarizes profiles collected by ProfilingMiddleware """
+    help = "Show hottest functions and SQL counts per profiled route"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dir", default=settings.PROFILE_DIR,
+            help="Profile directory, defaults to PROFILE_DIR"
+        )
+        parser.add_argument(
+            "--route", action="append", dest="routes",
+            help="Route to summarize, eg channel:list-logs. Defaults to all"
+        )
+        parser.add_argument(
+            "--top", type=int, default=15,
+            help="Number of functions listed per route"
+        )
+        parser.add_argument(
+            "--sort", default="tottime", choices=["tottime", "cumulative"],
+            help="Order of listed functions"
+        )
+
+    def handle(self, *args, **options):
+        profile_dir = options["dir"]
+        if not profile_dir or not os.path.isdir(profile_dir):
+            raise CommandError("No profile directory found")
+
+        routes = options["routes"]
+        route_dirs = sorted(os.listdir(profile_dir))
+        if routes:
+            route_dirs = [r.replace(":", ".") for r in routes]
+
+        for route in route_dirs:
+            route_dir = os.path.join(profile_dir, route)
+            if not os.path.isdir(route_dir):
+                self.stderr.write("No profiles for %s" % route)
+                continue
+
+            files = sorted(os.listdir(route_dir))
+            profiles = [
+                os.path.join(route_dir, f) for f in files
+                if f.endswith(".prof")
+            ]
+            if not profiles:
+                continue
+
+            query_counts = []
+            query_time = 0.0
+            for f in files:
+                if not f.endswith(".sql.json"):
+                    continue
+                with open(os.path.join(route_dir, f)) as fh:
+                    queries = json.load(fh)["queries"]
+                query_counts.append(len(queries))
+                query_time += sum(q["duration"] for q in queries)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "%s: %d profiles" % (route.replace(".", ":", 1), len(profiles))
+            ))
+            if query_counts:
+                self.stdout.write(
+                    "  SQL per request: %.1f queries, %.2fms" % (
+                        sum(query_counts) / len(query_counts),
+                        query_time * 1000 / len(query_counts)
+                    )
+                )
+
+            out = io.StringIO()
+            stats = pstats.Stats(*profiles, stream=out)
+            stats.strip_dirs().sort_stats(options["sort"]).print_stats(
+                options["top"]
+            )
+            # Skip pstats preamble, down to the table header
+            report = out.getvalue()
+            self.stdout.write(report[report.find("   ncalls"):].rstrip())
+            self.stdout.write("")
@@ -0,0 +1,60 @@
+from typing import Dict
+
+from django.core.management.base import BaseCommand
+
+from standup import slowlog
+
+
+class Command(BaseCommand):
+    """ Summarizes slow query log grouped by normalized statement """
+    help = "Rank slow statements by total time, grouped by fingerprint"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top", type=int, default=20,
+            help="Number of statements listed"
+        )
+        parser.add_argument(
+            "--route", default=None,
+            help="Only include statements run by route, eg channel:list-logs"
+        )
+
+    def handle(self, *args, **options):
+        groups: Dict[str, Dict] = {}
+        for record in slowlog.get_sink().read():
+            if options["route"] and record["route"] != options["route"]:
+                continue
+            group = groups.setdefault(record["fingerprint"], {
+                "sql": slowlog.fingerprint(record["sql"]),
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "views": {},
+                "stack": record["stack"],
+            })
+            group["count"] += 1
+            group["total_ms"] += record["duration_ms"]
+            group["max_ms"] = max(group["max_ms"], record["duration_ms"])
+            view = record["view"] or record["route"]
+            group["views"][view] = group["views"].get(view, 0) + 1
+
+        ranked = sorted(
+            groups.items(), key=lambda item: item[1]["total_ms"], reverse=True
+        )
+        for fingerprint_id, group in ranked[:options["top"]]:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "[%s] %d calls, total %.1fms, mean %.1fms, max %.1fms" % (
+                    fingerprint_id, group["count"], group["total_ms"],
+                    group["total_ms"] / group["count"], group["max_ms"]
+                )
+            ))
+            self.stdout.write("  " + group["sql"][:500])
+            for view, count in sorted(
+                    group["views"].items(), key=lambda item: -item[1]
+            ):
+                self.stdout.write("  %6d  %s" % (count, view))
+            for frame in group["stack"][-3:]:
+                self.stdout.write("    at %s" % frame)
+
+        if not ranked:
+            self.stdout.write("No slow queries recorded")
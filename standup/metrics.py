@@ -0,0 +1,329 @@
+""" In-process metrics registry, exposed in Prometheus text format
+
+Each worker process keeps its own counters and histograms. When
+METRICS_DIR is set, workers periodically write a snapshot to a file of
+their own in that directory, and the metrics endpoint sums the snapshots of
+every worker, so totals survive preforking servers and recycled workers.
+A forked worker starts with an empty registry and a snapshot file of its
+own, and snapshots of exited workers are merged into RETIRED_NAME, so the
+directory does not grow with every recycled worker.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from standup import settings
+
+
+#: Metric name and sorted label pairs
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+#: Request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+#: Response size histogram buckets, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+#: Help text of exported metrics
+METRIC_HELP = {
+    "standup_request_duration_seconds": "Request latency by route",
+    "standup_response_bytes": "Response body size by route",
+    "standup_responses_total": "Responses by route, status and error",
+    "standup_db_seconds_total": "Time spent in database queries by route",
+    "standup_db_queries_total": "Database queries by route",
+    "standup_cache_requests_total": "Cache lookups by cache and result",
+}
+
+#: Snapshot file of a worker process, by pid
+SNAPSHOT_PATTERN = re.compile(r"^metrics-(\d+)-[0-9a-f]+\.json(\.tmp)?$")
+
+#: Snapshot file holding the sum of metrics of exited workers
+RETIRED_NAME = "metrics-retired.json"
+
+
+class Registry:
+    """ Thread safe store of counters and histograms for one process """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.histograms: Dict[MetricKey, Dict] = {}
+
+    @staticmethod
+    def key(name: str, labels: Dict[str, str]) -> MetricKey:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1):
+        """ Increments counter """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(
+            self, name: str, labels: Dict[str, str], value: float,
+            buckets: Tuple[float, ...]
+    ):
+        """ Records value in histogram """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": list(buckets),
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0
+                }
+            i = bisect.bisect_left(histogram["buckets"], value)
+            if i < len(buckets):
+                histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self) -> Dict:
+        """ Returns JSON serializable copy of metrics """
+        with self.lock:
+            return {
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "histograms": [
+                    [name, labels, dict(h, counts=list(h["counts"]))]
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot: Dict):
+        """ Adds metrics of a snapshot """
+        with self.lock:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, histogram in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = self.histograms.get(key)
+                if total is None:
+                    self.histograms[key] = dict(
+                        histogram, counts=list(histogram["counts"])
+                    )
+                    continue
+                total["counts"] = [
+                    a + b
+                    for a, b in zip(total["counts"], histogram["counts"])
+                ]
+                total["sum"] += histogram["sum"]
+                total["count"] += histogram["count"]
+
+
+def _new_snapshot_name() -> str:
+    """ Returns snapshot file name unique to this process, even if its pid
+    is reused """
+    return "metrics-%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8])
+
+
+#: Metrics of this process
+REGISTRY = Registry()
+
+#: Snapshot file of this process
+_snapshot_name = _new_snapshot_name()
+_last_flush = 0.0
+
+
+def _reset_after_fork():
+    """ Starts forked worker with no metrics and a snapshot file of its own
+
+    Otherwise workers forked from a server that imported this module would
+    report the parent's metrics as their own, and overwrite each other's
+    snapshots.
+    """
+    global REGISTRY, _snapshot_name, _last_flush
+    REGISTRY = Registry()
+    _snapshot_name = _new_snapshot_name()
+    _last_flush = 0.0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def observe_request(
+        route: str, status: int, error: Optional[str], duration: float,
+        size: int, db_time: float, db_queries: int
+):
+    """ Records metrics of a finished request """
+    labels = {"route": route}
+    REGISTRY.observe(
+        "standup_request_duration_seconds", labels, duration, LATENCY_BUCKETS
+    )
+    REGISTRY.observe("standup_response_bytes", labels, size, SIZE_BUCKETS)
+    REGISTRY.inc("standup_responses_total", {
+        "route": route, "status": status, "error": error or ""
+    })
+    REGISTRY.inc("standup_db_seconds_total", labels, db_time)
+    REGISTRY.inc("standup_db_queries_total", labels, db_queries)
+    maybe_flush()
+
+
+def record_cache(cache: str, hit: bool):
+    """ Records a cache lookup """
+    REGISTRY.inc("standup_cache_requests_total", {
+        "cache": cache, "result": "hit" if hit else "miss"
+    })
+
+
+def maybe_flush(force: bool = False):
+    """ Writes process snapshot to metrics directory if flush is due """
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_SECONDS:
+        return
+    _last_flush = now
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, _snapshot_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(REGISTRY.snapshot(), fh)
+    os.replace(tmp_path, path)
+
+
+atexit.register(maybe_flush, force=True)
+
+
+def _load_snapshot(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        # Snapshot being replaced or removed
+        return None
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def retire_snapshots():
+    """ Merges snapshots of exited workers into RETIRED_NAME
+
+    Holds a lock on the metrics directory, so concurrent scrapes do not
+    count an exited worker twice.
+    """
+    directory = settings.METRICS_DIR
+    with open(os.path.join(directory, "metrics.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [
+            name for name in os.listdir(directory)
+            if SNAPSHOT_PATTERN.match(name) and not _is_running(
+                int(SNAPSHOT_PATTERN.match(name).group(1))
+            )
+        ]
+        if not exited:
+            return
+
+        retired = Registry()
+        retired_path = os.path.join(directory, RETIRED_NAME)
+        for name in [RETIRED_NAME] + exited:
+            if name.endswith(".json"):
+                snapshot = _load_snapshot(os.path.join(directory, name))
+                if snapshot is not None:
+                    retired.merge(snapshot)
+        tmp_path = retired_path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(retired.snapshot(), fh)
+        os.replace(tmp_path, retired_path)
+        for name in exited:
+            os.remove(os.path.join(directory, name))
+
+
+def collect() -> Registry:
+    """ Merges metrics of all worker processes into one registry """
+    merged = Registry()
+    merged.merge(REGISTRY.snapshot())
+    if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+        retire_snapshots()
+        for name in os.listdir(settings.METRICS_DIR):
+            if name == _snapshot_name or not name.endswith(".json"):
+                continue
+            snapshot = _load_snapshot(
+                os.path.join(settings.METRICS_DIR, name)
+            )
+            if snapshot is not None:
+                merged.merge(snapshot)
+    return merged
+
+
+def _format_labels(labels, extra: Tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (
+            k, str(v).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+        for k, v in pairs
+    )
+
+
+def render(registry: Registry) -> str:
+    """ Formats registry in Prometheus text exposition format """
+    lines: List[str] = []
+    names = sorted(
+        {name for name, _ in registry.counters}
+        | {name for name, _ in registry.histograms}
+    )
+    for name in names:
+        is_histogram = any(key[0] == name for key in registry.histograms)
+        if name in METRIC_HELP:
+            lines.append("# HELP %s %s" % (name, METRIC_HELP[name]))
+        lines.append("# TYPE %s %s" % (
+            name, "histogram" if is_histogram else "counter"
+        ))
+
+        if not is_histogram:
+            for (metric, labels), value in sorted(registry.counters.items()):
+                if metric == name:
+                    lines.append("%s%s %s" % (
+                        name, _format_labels(labels), repr(float(value))
+                    ))
+            continue
+
+        for (metric, labels), h in sorted(
+                registry.histograms.items(), key=lambda item: item[0]
+        ):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(h["buckets"], h["counts"]):
+                cumulative += count
+                le = (("le", repr(float(bound))),)
+                lines.append("%s_bucket%s %d" % (
+                    name, _format_labels(labels, le), cumulative
+                ))
+            lines.append("%s_bucket%s %d" % (
+                name, _format_labels(labels, (("le", "+Inf"),)), h["count"]
+            ))
+            lines.append("%s_sum%s %s" % (
+                name, _format_labels(labels), repr(float(h["sum"]))
+            ))
+            lines.append("%s_count%s %d" % (
+                name, _format_labels(labels), h["count"]
+            ))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,248 @@
+import cProfile
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import time
+
+from django.urls import resolve, Resolver404
+
+import standup.db
+import standup.utils
+from standup import admission
+from standup import metrics
+from standup import settings
+from standup import slowlog
+from standup import timing
+
+
+class MetricsMiddleware:
+    """ Records latency, size, error and database metrics per route """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db_stats = {"time": 0.0, "queries": 0}
+
+        def time_query(execute, sql, params, many, context):
+            t_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db_stats["time"] += time.perf_counter() - t_start
+                db_stats["queries"] += 1
+
+        t_start = time.perf_counter()
+        with standup.db.execute_wrapper(time_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - t_start
+
+        match = getattr(request, "resolver_match", None)
+        metrics.observe_request(
+            route=match.view_name if match else "unresolved",
+            status=response.status_code,
+            error=getattr(response, "error_label", None),
+            duration=duration,
+            size=0 if response.streaming else len(response.content),
+            db_time=db_stats["time"],
+            db_queries=db_stats["queries"]
+        )
+        return response
+
+
+def get_profile_signature(path: str) -> str:
+    """ Returns signature of request path that enables its profiling """
+    return hmac.new(
+        settings.BACKEND_SECRET.encode("utf-8"), path.encode("utf-8"),
+        hashlib.sha256
+    ).hexdigest()
+
+
+class ProfilingMiddleware:
+    """ Runs sampled or explicitly requested views under cProfile
+
+    A request is profiled when its X-PROFILE-SIGNATURE header matches
+    get_profile_signature of its path, or at random with probability
+    PROFILE_SAMPLE_RATE. The profile and the SQL run by the view are saved
+    under PROFILE_DIR, in a directory per route.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    @staticmethod
+    def should_profile(request) -> bool:
+        if not settings.PROFILE_DIR:
+            return False
+        signature = request.headers.get("X-PROFILE-SIGNATURE")
+        if signature is not None:
+            # compare_digest rejects non-ASCII str, compare as bytes
+            return hmac.compare_digest(
+                signature.encode("utf-8"),
+                get_profile_signature(request.path).encode("utf-8")
+            )
+        return random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.should_profile(request):
+            return None
+
+        queries = []
+
+        def capture_query(execute, sql, params, many, context):
+            t_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append({
+                    "sql": sql,
+                    "params": repr(params)[:1024],
+                    "many": many,
+                    "duration": time.perf_counter() - t_start
+                })
+
+        profiler = cProfile.Profile()
+        with standup.db.execute_wrapper(capture_query):
+            response = profiler.runcall(
+                view_func, request, *view_args, **view_kwargs
+            )
+
+        route = request.resolver_match.view_name.replace(":", ".")
+        route_dir = os.path.join(settings.PROFILE_DIR, route)
+        os.makedirs(route_dir, exist_ok=True)
+        base_name = os.path.join(route_dir, "%d-%d" % (
+            time.time() * 1000, os.getpid()
+        ))
+        profiler.dump_stats(base_name + ".prof")
+        with open(base_name + ".sql.json", "w") as fh:
+            json.dump({
+                "path": request.path,
+                "status": response.status_code,
+                "queries": queries
+            }, fh, indent=1)
+        return response
+
+
+class ServerTimingMiddleware:
+    """ Collects phase timings of request for the Server-Timing header
+
+    Responses built by standup.utils.json_response carry the phases timed
+    so far, this adds the total time of the view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = timing.start()
+        t_start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.stop(token)
+
+        if response.has_header("Server-Timing"):
+            response["Server-Timing"] += ", " + timing.format_header({
+                "total": time.perf_counter() - t_start
+            })
+        return response
+
+
+def get_view_path(match) -> str:
+    """ Returns dotted path of view function of resolved route """
+    func = match.func
+    if not hasattr(func, "__qualname__"):
+        # Instance of a callable class
+        func = type(func)
+    return "%s.%s" % (func.__module__, func.__qualname__)
+
+
+class SlowQueryMiddleware:
+    """ Records statements slower than SLOW_QUERY_MS to the slow query log
+
+    Records name the route and view function of the request that ran them.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_MS is None:
+            return self.get_response(request)
+
+        threshold = settings.SLOW_QUERY_MS / 1000
+
+        def time_query(execute, sql, params, many, context):
+            t_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - t_start
+                if duration >= threshold:
+                    match = getattr(request, "resolver_match", None)
+                    slowlog.record(
+                        sql, params, duration,
+                        route=match.view_name if match else "unresolved",
+                        view=get_view_path(match) if match else ""
+                    )
+
+        with standup.db.execute_wrapper(time_query):
+            return self.get_response(request)
+
+
+class AdmissionMiddleware:
+    """ Sheds requests over the rate or concurrency limits of their route
+
+    Requests over the rate limit of their requester are answered with
+    RATE_LIMITED, those over the concurrency limit of their view with
+    OVERLOADED, both with a Retry-After header, see standup.admission.
+    Requests without the backend secret are passed to their view to be
+    rejected. Sub-requests of batches are limited by dispatch_sub_request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        store = admission.get_store()
+        if store is None:
+            return self.get_response(request)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        if match.view_name in admission.EXEMPT_VIEWS or (
+                admission.EXEMPT_NAMESPACES & set(match.namespaces)
+        ):
+            return self.get_response(request)
+        # Labels metrics of rejected requests with their route
+        request.resolver_match = match
+        if not admission.is_authenticated(request):
+            # Rejected by the view, without counting against the user named
+            return self.get_response(request)
+
+        if match.view_name not in admission.BATCH_VIEWS:
+            wait = admission.take_token(
+                request, match.view_name, request.method
+            )
+            if wait > 0:
+                response = standup.utils.json_response(
+                    **standup.utils.RATE_LIMITED
+                )
+                response["Retry-After"] = str(math.ceil(wait))
+                return response
+
+        limit = settings.MAX_CONCURRENT_PER_VIEW
+        if limit <= 0:
+            return self.get_response(request)
+        if not store.acquire(match.view_name, limit):
+            response = standup.utils.json_response(
+                **standup.utils.OVERLOADED
+            )
+            response["Retry-After"] = "1"
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            store.release(match.view_name)
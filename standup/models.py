@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class IdempotencyKey(models.Model):
+    """ Response stored for retries of a POST, see standup.idempotency """
+    #: Digest of requester, route and Idempotency-Key
+    key = models.CharField(max_length=32, unique=True)
+
+    #: Digest of the arguments of request
+    fingerprint = models.CharField(max_length=64)
+
+    #: Status of stored response, null while request is running
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    #: Body of stored response
+    content = models.BinaryField(default=b"")
+
+    #: Content-Type of stored response
+    content_type = models.CharField(max_length=128, default="", blank=True)
+
+    #: Error label of stored response, empty for success
+    error = models.CharField(max_length=64, default="", blank=True)
+
+    #: When key may be used again, and is deleted by run_purges
+    dt_expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "%s: %s" % (self.key, self.status or "-")
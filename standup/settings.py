@@ -30,29 +30,63 @@ DEBUG = os.environ.get("DEBUG", "FALSE").upper() == "TRUE"
 ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS", "").split(";")
 
 
+# Deployment profile
+#   - full: JSON API and admin site
+#   - api: JSON API only, without session/admin apps and middleware
+#   - admin: Admin site only
+DEPLOY_PROFILE = os.environ.get("DEPLOY_PROFILE", "full").lower()
+if DEPLOY_PROFILE not in ("full", "api", "admin"):
+    raise Exception("Error, unknown deploy profile %s" % DEPLOY_PROFILE)
+
+SERVE_API = DEPLOY_PROFILE in ("full", "api")
+SERVE_ADMIN = DEPLOY_PROFILE in ("full", "admin")
+
+
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
+    "standup",
     "channel",
     "login",
     "notification",
 ]
-
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    # 'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-]
+if SERVE_ADMIN:
+    INSTALLED_APPS = [
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    ] + INSTALLED_APPS
+
+if SERVE_ADMIN:
+    MIDDLEWARE = [
+        'standup.middleware.MetricsMiddleware',
+        'standup.middleware.ServerTimingMiddleware',
+        'standup.middleware.SlowQueryMiddleware',
+        'standup.middleware.AdmissionMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        # 'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'standup.middleware.ProfilingMiddleware',
+    ]
+else:
+    # JSON endpoints authenticate by backend secret, so skip the session,
+    # auth and message middleware
+    MIDDLEWARE = [
+        'standup.middleware.MetricsMiddleware',
+        'standup.middleware.ServerTimingMiddleware',
+        'standup.middleware.SlowQueryMiddleware',
+        'standup.middleware.AdmissionMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'standup.middleware.ProfilingMiddleware',
+    ]
 
 ROOT_URLCONF = 'standup.urls'
 
@@ -70,7 +104,7 @@ TEMPLATES = [
             ],
         },
     },
-]
+] if SERVE_ADMIN else []
 
 WSGI_APPLICATION = 'standup.wsgi.application'
 
@@ -78,12 +112,16 @@ WSGI_APPLICATION = 'standup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DB_ENGINE = os.environ.get("DB_ENGINE", "django.db.backends.sqlite3")
+# The standup.db.sqlite3 and standup.db.postgresql engines extend Django's
+# with SQLite tuning and optional connection pooling
+DB_ENGINE = os.environ.get("DB_ENGINE", "standup.db.sqlite3")
 DB_NAME = os.environ.get("DB_NAME", os.path.join(BASE_DIR, "db.sqlite3"))
 DB_HOSTNAME = os.environ.get("DB_HOSTNAME")
 DB_PORT = os.environ.get("DB_PORT")
 DB_USERNAME = os.environ.get("DB_USERNAME")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
+# Seconds to keep a connection open across requests, "none" for unlimited
+DB_CONN_MAX_AGE = os.environ.get("DB_CONN_MAX_AGE", "0")
 DATABASES = {
     'default': {
         'ENGINE': DB_ENGINE,
@@ -92,9 +130,217 @@ DATABASES = {
         "PORT": DB_PORT,
         "USER": DB_USERNAME,
         "PASSWORD": DB_PASSWORD,
+        "CONN_MAX_AGE": (
+            None if DB_CONN_MAX_AGE.lower() == "none"
+            else int(DB_CONN_MAX_AGE)
+        ),
     }
 }
 
+# Check reused connections still work before handing them to a request
+DB_CONN_HEALTH_CHECKS = os.environ.get(
+    "DB_CONN_HEALTH_CHECKS", "TRUE"
+).upper() == "TRUE"
+# Idle connections kept by the in-process pool of the standup.db backends,
+# shared by the threads of a worker. Pooling is disabled if 0
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "0"))
+
+# PRAGMAs set on new connections by the standup.db.sqlite3 backend, the
+# WAL journal lets readers run alongside a writer. Empty values are skipped
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": os.environ.get("SQLITE_CACHE_SIZE", "-20000"),
+}
+# Retries of write transactions that still find the database locked
+SQLITE_WRITE_RETRIES = int(os.environ.get("SQLITE_WRITE_RETRIES", "5"))
+
+# Channel messages are spread over DB_SHARDS databases by channel id, each
+# using the default database's settings with NAME set to DB_SHARD_NAME % i.
+# Messages stay in the default database if 0, see channel.shards
+DB_SHARDS = int(os.environ.get("DB_SHARDS", "0"))
+DB_SHARD_NAME = os.environ.get(
+    "DB_SHARD_NAME", os.path.join(BASE_DIR, "shard_%d.sqlite3")
+)
+MESSAGE_SHARDS = ["shard_%d" % i for i in range(DB_SHARDS)]
+DATABASES.update({
+    alias: dict(DATABASES["default"], NAME=DB_SHARD_NAME % i)
+    for i, alias in enumerate(MESSAGE_SHARDS)
+})
+
+DATABASE_ROUTERS = ["channel.shards.ShardRouter"]
+
+
+# Cache
+# Django cache backend, e.g. django.core.cache.backends.memcached.
+# MemcachedCache with CACHE_LOCATION of the server, to share entries across
+# worker processes. Defaults to a memory cache per process
+CACHE_BACKEND = os.environ.get(
+    "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+)
+CACHE_LOCATION = os.environ.get("CACHE_LOCATION", "")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": CACHE_LOCATION,
+    }
+}
+if CACHE_BACKEND.endswith(".LocMemCache"):
+    CACHES["default"]["OPTIONS"] = {
+        "MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+    }
+
+# Days before today that messages can still be posted or edited for, or
+# "none" for no limit. Cached days of list_logs expire after
+# DAY_CACHE_SECONDS even if not invalidated by a post, and are only cached
+# with a shared CACHE_BACKEND, or not at all with 0
+EDIT_FREEZE_DAYS = os.environ.get("EDIT_FREEZE_DAYS", "7")
+EDIT_FREEZE_DAYS = (
+    None if EDIT_FREEZE_DAYS.lower() == "none" else int(EDIT_FREEZE_DAYS)
+)
+DAY_CACHE_SECONDS = int(os.environ.get("DAY_CACHE_SECONDS", "86400"))
+# Seconds list_logs sync cursors trail the clock by, so that messages still
+# being committed as a sync reads are sent again by the next one
+SYNC_CURSOR_LAG_SECONDS = float(
+    os.environ.get("SYNC_CURSOR_LAG_SECONDS", "5")
+)
+
+
+# Admission control
+# Store of rate limit and concurrency state, "local" to each process,
+# "cache" for the Django cache shared by workers, or "none" to disable
+ADMISSION_STORE = os.environ.get("ADMISSION_STORE", "local")
+# Token bucket refill rate per second and burst size of requests per user,
+# or per backend secret for requests without user, by endpoint class, see
+# standup.admission. Classes with a rate of 0 are not limited
+RATE_LIMITS = {
+    "poll": (
+        float(os.environ.get("RATE_LIMIT_POLL_RATE", "1")),
+        int(os.environ.get("RATE_LIMIT_POLL_BURST", "10")),
+    ),
+    "read": (
+        float(os.environ.get("RATE_LIMIT_READ_RATE", "10")),
+        int(os.environ.get("RATE_LIMIT_READ_BURST", "50")),
+    ),
+    "write": (
+        float(os.environ.get("RATE_LIMIT_WRITE_RATE", "5")),
+        int(os.environ.get("RATE_LIMIT_WRITE_BURST", "20")),
+    ),
+}
+# Requests served at once per view, by each process with the local store
+# and by all workers with the cache store. Unlimited if 0
+MAX_CONCURRENT_PER_VIEW = int(os.environ.get("MAX_CONCURRENT_PER_VIEW", "0"))
+# Seconds after which slots of the cache store are freed, should exceed the
+# longest request
+ADMISSION_SLOT_SECONDS = 300
+# Rate limit buckets kept by each process with the local store, least
+# recently used ones are dropped first
+ADMISSION_MAX_BUCKETS = int(os.environ.get("ADMISSION_MAX_BUCKETS", "10000"))
+
+
+# Idempotency keys
+# Seconds responses of POST requests with an Idempotency-Key are replayed,
+# and seconds a request holds its key while running, should exceed the
+# longest request. Expired keys are deleted by run_purges
+IDEMPOTENCY_TTL_SECONDS = int(
+    os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400")
+)
+IDEMPOTENCY_LOCK_SECONDS = 300
+
+
+# Request coalescing
+# Seconds identical read requests wait for the one in flight, and if the
+# Django cache also coalesces them across processes, polling it every
+# COALESCE_POLL_SECONDS
+COALESCE_WAIT_SECONDS = float(os.environ.get("COALESCE_WAIT_SECONDS", "5"))
+COALESCE_CACHE = os.environ.get("COALESCE_CACHE", "FALSE").upper() == "TRUE"
+COALESCE_POLL_SECONDS = float(
+    os.environ.get("COALESCE_POLL_SECONDS", "0.01")
+)
+
+
+# Message archive
+# Age in days after which archive_messages moves messages, by whole months,
+# to compressed archive segments, and number of decoded segments cached per
+# process for reads
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_CACHE_SEGMENTS = int(os.environ.get("ARCHIVE_CACHE_SEGMENTS", "256"))
+
+
+# Purging
+# Days after which archived channels are purged by run_purges, or "none" to
+# keep them, and rows deleted per transaction of a purge
+PURGE_AFTER_DAYS = os.environ.get("PURGE_AFTER_DAYS", "90")
+PURGE_AFTER_DAYS = (
+    None if PURGE_AFTER_DAYS.lower() == "none" else int(PURGE_AFTER_DAYS)
+)
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "1000"))
+
+
+# Weekly digests
+# Directory caching rendered digests, and processes rendering them, the
+# number of cores if 0
+DIGEST_DIR = os.environ.get("DIGEST_DIR", os.path.join(BASE_DIR, "digests"))
+DIGEST_WORKERS = int(os.environ.get("DIGEST_WORKERS", "0"))
+
+
+# Email
+# Backend delivering digests, a local backend by default
+EMAIL_BACKEND = os.environ.get(
+    "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
+)
+# Directory of the file backend
+EMAIL_FILE_PATH = os.environ.get(
+    "EMAIL_FILE_PATH", os.path.join(BASE_DIR, "mail")
+)
+DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", "standup@localhost")
+
+
+# Burst posting
+# Queue posted messages in a local spool, written to the database in batches
+# by the flush_message_spool command
+BURST_POSTING = os.environ.get("BURST_POSTING", "FALSE").upper() == "TRUE"
+MESSAGE_SPOOL_PATH = os.environ.get(
+    "MESSAGE_SPOOL_PATH", os.path.join(BASE_DIR, "message_spool.sqlite3")
+)
+
+
+# Metrics
+# Directory shared by worker processes to aggregate metrics, if any. Only
+# shared by processes of one host, which tell exited workers by their pid
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+
+# Request profiling
+# Directory to save profiles to, profiling is disabled if not set
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+# Fraction of requests to profile without a signed profiling header
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+
+
+# Slow query log
+# Threshold in milliseconds, slow queries are not recorded if not set
+SLOW_QUERY_MS = (
+    float(os.environ["SLOW_QUERY_MS"]) if os.environ.get("SLOW_QUERY_MS")
+    else None
+)
+# Sink of records, either "file" for rotated JSON lines or "sqlite"
+SLOW_QUERY_SINK = os.environ.get("SLOW_QUERY_SINK", "file").lower()
+SLOW_QUERY_LOG = os.environ.get(
+    "SLOW_QUERY_LOG", os.path.join(
+        BASE_DIR,
+        "slow_queries.sqlite3" if SLOW_QUERY_SINK == "sqlite"
+        else "slow_queries.log"
+    )
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(
+    os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024))
+)
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", "5"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -0,0 +1,201 @@
+""" Recorder of slow SQL statements, attributed to the requesting view
+
+Statements slower than SLOW_QUERY_MS are written with the route and view
+that ran them, the shapes of their bound parameters and the project frames
+of the stack, either as JSON lines to a rotating file or to a SQLite
+database, depending on SLOW_QUERY_SINK.
+"""
+import datetime as dtt
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import threading
+import traceback
+from typing import Dict, Iterator, List
+
+from standup import settings
+
+
+#: Maximum number of project frames kept per record
+MAX_STACK_FRAMES = 8
+
+#: Maximum length of SQL kept per record
+MAX_SQL_LENGTH = 4096
+
+#: Project modules that only wrap query execution, left out of stacks
+WRAPPER_MODULES = (
+    os.path.join(settings.BASE_DIR, "standup", "middleware.py"),
+    os.path.join(settings.BASE_DIR, "standup", "slowlog.py"),
+)
+
+
+def get_param_shapes(params) -> List[str]:
+    """ Describes bound parameters by type and size, never by value """
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        params = params.values()
+
+    shapes = []
+    for param in params:
+        if isinstance(param, (str, bytes)):
+            shapes.append("%s(%d)" % (type(param).__name__, len(param)))
+        elif isinstance(param, (list, tuple)):
+            shapes.append("%s[%d]" % (type(param).__name__, len(param)))
+        else:
+            shapes.append(type(param).__name__)
+    return shapes
+
+
+def get_project_stack() -> List[str]:
+    """ Returns innermost frames of current stack within project code """
+    frames = []
+    for frame in traceback.extract_stack()[:-1]:
+        filename = frame.filename
+        if not filename.startswith(settings.BASE_DIR):
+            continue
+        if "site-packages" in filename or filename in WRAPPER_MODULES:
+            continue
+        frames.append("%s:%d %s" % (
+            os.path.relpath(filename, settings.BASE_DIR), frame.lineno,
+            frame.name
+        ))
+    return frames[-MAX_STACK_FRAMES:]
+
+
+_FINGERPRINT_SUBS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def fingerprint(sql: str) -> str:
+    """ Normalizes SQL by removing literals, placeholders and IN lists """
+    for pattern, replacement in _FINGERPRINT_SUBS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint_id(normalized_sql: str) -> str:
+    """ Returns short id of normalized SQL """
+    return hashlib.md5(normalized_sql.encode("utf-8")).hexdigest()[:12]
+
+
+class FileSink:
+    """ Writes records as JSON lines to a size-rotated file """
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = logging.getLogger("standup.slowlog.%s" % path)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                backupCount=settings.SLOW_QUERY_LOG_BACKUPS
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def write(self, record: Dict):
+        self.logger.info(json.dumps(record))
+
+    def read(self) -> Iterator[Dict]:
+        paths = [self.path] + [
+            "%s.%d" % (self.path, i)
+            for i in range(1, settings.SLOW_QUERY_LOG_BACKUPS + 1)
+        ]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path) as fh:
+                for line in fh:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+class SqliteSink:
+    """ Writes records to table of a local SQLite database """
+    COLUMNS = (
+        "ts", "duration_ms", "route", "view", "fingerprint", "sql",
+        "params", "stack"
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slow_queries (%s)"
+                % ", ".join(self.COLUMNS)
+            )
+        return conn
+
+    def write(self, record: Dict):
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO slow_queries VALUES (%s)"
+                % ", ".join("?" * len(self.COLUMNS)),
+                [
+                    json.dumps(record[c]) if c in ("params", "stack")
+                    else record[c]
+                    for c in self.COLUMNS
+                ]
+            )
+
+    def read(self) -> Iterator[Dict]:
+        if not os.path.exists(self.path):
+            return
+        for row in self.connect().execute(
+                "SELECT %s FROM slow_queries" % ", ".join(self.COLUMNS)
+        ):
+            record = dict(zip(self.COLUMNS, row))
+            record["params"] = json.loads(record["params"])
+            record["stack"] = json.loads(record["stack"])
+            yield record
+
+
+def get_sink():
+    """ Returns configured sink of slow query records """
+    if settings.SLOW_QUERY_SINK == "sqlite":
+        return SqliteSink(settings.SLOW_QUERY_LOG)
+    return FileSink(settings.SLOW_QUERY_LOG)
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def record(
+        sql: str, params, duration: float, route: str, view: str
+):
+    """ Writes record of slow statement to sink """
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = get_sink()
+
+    normalized = fingerprint(sql)
+    _sink.write({
+        "ts": dtt.datetime.utcnow().isoformat(),
+        "duration_ms": round(duration * 1000, 3),
+        "route": route,
+        "view": view,
+        "fingerprint": fingerprint_id(normalized),
+        "sql": sql[:MAX_SQL_LENGTH],
+        "params": get_param_shapes(params),
+        "stack": get_project_stack(),
+    })
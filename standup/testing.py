@@ -0,0 +1,74 @@
+""" Helpers for the tests of the apps
+
+ApiTestCase creates an owner, a member and their channel, and calls the
+JSON API with the backend secret and a user's X-USER-EMAIL header. Caches
+are cleared and admission control is disabled for every test, tests of
+either enable them again with mock.patch on standup.settings.
+"""
+import json
+from typing import Dict, Optional, Tuple
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase
+
+from channel import models
+from standup import settings
+
+
+class ApiTestCase(TestCase):
+    """ Test case with a channel of two users and an API client """
+    databases = "__all__"
+
+    def setUp(self):
+        cache.clear()
+        self.patch_settings(ADMISSION_STORE="none")
+        self.owner = User.objects.create_user(
+            username="olive@example.com", email="olive@example.com",
+            first_name="Olive", last_name="Owner"
+        )
+        self.member = User.objects.create_user(
+            username="milo@example.com", email="milo@example.com",
+            first_name="Milo", last_name="Member"
+        )
+        self.channel = models.Channel.objects.create(
+            owner=self.owner, name="team"
+        )
+        models.ChannelMember.objects.create(
+            user=self.member, channel=self.channel
+        )
+
+    def patch_settings(self, **values):
+        """ Overrides standup.settings for the rest of the test """
+        patcher = mock.patch.multiple(settings, **values)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(
+            self, method: str, path: str, email: Optional[str] = None,
+            headers: Optional[Dict[str, str]] = None, **args
+    ) -> Tuple[HttpResponse, Dict]:
+        """ Calls API as user with JSON arguments
+
+        :param method: HTTP method
+        :param path: Path of route
+        :param email: Address of requesting user, defaults to the owner
+        :param headers: Extra headers by WSGI name, e.g. HTTP_X_USER_EMAIL
+        :return: Response and its decoded JSON body, None if not JSON
+        """
+        extra = {
+            "HTTP_X_BACKEND_SECRET": settings.BACKEND_SECRET,
+            "HTTP_X_USER_EMAIL": email or self.owner.email,
+        }
+        extra.update(headers or {})
+        response = self.client.generic(
+            method.upper(), path, json.dumps(args),
+            content_type="application/json", **extra
+        )
+        try:
+            body = json.loads(response.content.decode("utf-8"))
+        except ValueError:
+            body = None
+        return response, body
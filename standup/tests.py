@@ -0,0 +1,882 @@
+import datetime as dtt
+import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import ResolverMatch
+from django.utils import timezone
+
+from channel import models
+from channel import utils
+import notification.models
+from standup import admission
+from standup import bench
+from standup import coalesce
+from standup import idempotency
+from standup import metrics
+from standup import middleware
+from standup import settings
+from standup import slowlog
+from standup import timing
+from standup.testing import ApiTestCase
+import standup.db
+from standup.db import pool as db_pool
+from standup.db.sqlite3 import base as sqlite_base
+import standup.models
+import standup.utils
+import standup.views
+
+
+class DashboardTest(ApiTestCase):
+    def test_combines_channels_and_notifications(self):
+        dt = dtt.date(2020, 1, 6)
+        utils.save_channel_message(self.member, self.channel, dt, "done")
+        ops = models.Channel.objects.create(owner=self.owner, name="ops")
+        notification.models.Notification.objects.create(
+            user=self.owner, title="Hello", message="Welcome"
+        )
+        notification.models.Notification.objects.create(
+            user=self.owner, title="Old", message="Read", dismissed=True
+        )
+
+        response, body = self.call("get", "/dashboard", date=dt.isoformat())
+        self.assertEqual(response.status_code, 200)
+        payload = body["payload"]
+        self.assertEqual(payload["user"]["email"], "olive@example.com")
+        self.assertEqual(payload["date"], dt.isoformat())
+        self.assertEqual(
+            [
+                (c["channel_id"], c["posted"], c["posted_count"])
+                for c in payload["channels"]
+            ],
+            [(self.channel.pk, False, 1), (ops.pk, False, 0)]
+        )
+        self.assertEqual(payload["notifications"]["unread_count"], 1)
+        self.assertEqual(
+            [n["title"] for n in payload["notifications"]["notifications"]],
+            ["Hello"]
+        )
+
+    def test_lists_channels_of_member(self):
+        dt = dtt.date(2020, 1, 6)
+        utils.save_channel_message(self.member, self.channel, dt, "done")
+        response, body = self.call(
+            "get", "/dashboard", email=self.member.email, date=dt.isoformat()
+        )
+        self.assertEqual(
+            [
+                (c["channel_name"], c["owner"], c["posted"])
+                for c in body["payload"]["channels"]
+            ],
+            [("team", "olive@example.com", True)]
+        )
+
+    def test_rejects_bad_requests(self):
+        response, _ = self.call("get", "/dashboard", date="Monday")
+        self.assertEqual(response.status_code, 400)
+        response, body = self.call(
+            "get", "/dashboard", email="nobody@example.com"
+        )
+        self.assertEqual(body["error"], "NO_USER")
+        response, _ = self.call(
+            "get", "/dashboard", headers={"HTTP_X_BACKEND_SECRET": "wrong"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class BatchTest(ApiTestCase):
+    def batch(self, requests, **args):
+        response, body = self.call("post", "/batch", requests=requests, **args)
+        return response, body
+
+    def test_dispatches_sub_requests(self):
+        response, body = self.batch([
+            {"route": "channel:list"},
+            {
+                "route": "channel:create", "method": "POST",
+                "args": {
+                    "user_email": "olive@example.com", "channel_name": "ops"
+                }
+            },
+            {"route": "channel:nope"},
+            {"route": "admin:index"},
+            "channel:list",
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = body["payload"]["responses"]
+        self.assertEqual(
+            [result["status"] for result in results], [200, 200, 404, 404, 400]
+        )
+        self.assertEqual(
+            [c["channel_name"] for c in results[0]["response"]["payload"]],
+            ["team"]
+        )
+        self.assertTrue(models.Channel.objects.filter(name="ops").exists())
+
+    def test_rejects_bad_batches(self):
+        response, _ = self.call("post", "/batch", requests="channel:list")
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.batch(
+            [{"route": "channel:list"}] * (standup.views.MAX_BATCH_SIZE + 1)
+        )
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.call(
+            "post", "/batch", requests=[],
+            headers={"HTTP_X_BACKEND_SECRET": "wrong"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_failed_sub_request_gets_500(self):
+        with self.assertLogs("standup.views", "ERROR"):
+            response, body = self.batch([
+                {
+                    "route": "channel:invite", "method": "POST",
+                    "args": {"channel_id": self.channel.pk}
+                },
+                {"route": "channel:list"},
+            ])
+        self.assertEqual(response.status_code, 200)
+        results = body["payload"]["responses"]
+        self.assertEqual(results[0]["status"], 500)
+        self.assertEqual(results[0]["response"]["error"], "INTERNAL_ERROR")
+        self.assertEqual(results[1]["status"], 200)
+
+    def test_atomic_batch_rolls_back(self):
+        with self.assertLogs("standup.views", "ERROR"):
+            response, body = self.batch([
+                {
+                    "route": "channel:create", "method": "POST",
+                    "args": {
+                        "user_email": "olive@example.com",
+                        "channel_name": "ops"
+                    }
+                },
+                {
+                    "route": "channel:invite", "method": "POST",
+                    "args": {"channel_id": self.channel.pk}
+                },
+                {"route": "channel:list"},
+            ], atomic=True)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(body["error"], "BATCH_ROLLED_BACK")
+        self.assertEqual(
+            [result["status"] for result in body["payload"]["responses"]],
+            [200, 500]
+        )
+        self.assertFalse(models.Channel.objects.filter(name="ops").exists())
+
+    def test_sub_request_gets_own_meta(self):
+        seen = {}
+
+        def view(request):
+            seen.update(request.META)
+            return standup.utils.json_response(payload=request.GET.dict())
+
+        parent = RequestFactory().post(
+            "/batch", data="{}", content_type="application/json",
+            HTTP_X_USER_EMAIL="olive@example.com",
+            HTTP_X_BACKEND_SECRET=settings.BACKEND_SECRET
+        )
+        match = ResolverMatch(
+            view, (), {}, url_name="list", app_names=["channel"],
+            namespaces=["channel"]
+        )
+        with mock.patch.object(standup.views, "resolve", return_value=match):
+            result = standup.views.dispatch_sub_request(
+                parent, {"route": "channel:list", "args": {"limit": 5}}
+            )
+
+        self.assertEqual(result["response"]["payload"], {"limit": "5"})
+        self.assertEqual(seen["CONTENT_LENGTH"], str(len(b'{"limit": 5}')))
+        self.assertEqual(seen["REQUEST_METHOD"], "GET")
+        self.assertEqual(seen["HTTP_X_USER_EMAIL"], "olive@example.com")
+        self.assertNotIn("wsgi.input", seen)
+
+
+class DeployProfileTest(SimpleTestCase):
+    #: Child script reporting apps, middleware and routes of its profile
+    SCRIPT = """
+import django, json
+django.setup()
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+def serves(path):
+    try:
+        resolve(path)
+    except Resolver404:
+        return False
+    return True
+
+print(json.dumps({
+    "apps": settings.INSTALLED_APPS,
+    "middleware": settings.MIDDLEWARE,
+    "api": serves("/channel/list"),
+    "admin": serves("/admin/"),
+    "metrics": serves("/metrics"),
+}))
+"""
+
+    def load_profile(self, profile):
+        return bench.run_python(self.SCRIPT, {"DEPLOY_PROFILE": profile})
+
+    def test_api_profile_is_lean(self):
+        result = self.load_profile("api")
+        self.assertNotIn("django.contrib.admin", result["apps"])
+        self.assertNotIn("django.contrib.sessions", result["apps"])
+        self.assertFalse(any(
+            "SessionMiddleware" in name for name in result["middleware"]
+        ))
+        self.assertEqual(
+            (result["api"], result["admin"], result["metrics"]),
+            (True, False, True)
+        )
+
+    def test_full_and_admin_profiles(self):
+        full = self.load_profile("full")
+        self.assertIn("django.contrib.admin", full["apps"])
+        self.assertEqual((full["api"], full["admin"]), (True, True))
+        admin = self.load_profile("admin")
+        self.assertEqual((admin["api"], admin["admin"]), (False, True))
+
+    def test_rejects_unknown_profile(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.load_profile("tiny")
+
+    def test_admin_cold_start_serves_login(self):
+        result = bench.run_python(bench.COLD_START_SCRIPT, {
+            "DEPLOY_PROFILE": "admin",
+            "ALLOWED_HOSTS": "localhost",
+            "BENCH_PATH": bench.COLD_START_PATHS["admin"],
+            "BENCH_USER_EMAIL": "",
+        })
+        self.assertEqual(result["status"], "200 OK")
+
+
+class MetricsTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, value in (
+                ("REGISTRY", metrics.Registry()),
+                ("_snapshot_name", metrics._new_snapshot_name()),
+        ):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_snapshot(self, directory, name, hits):
+        registry = metrics.Registry()
+        registry.inc("standup_cache_requests_total", {
+            "cache": "test", "result": "hit"
+        }, hits)
+        with open(os.path.join(directory, name), "w") as fh:
+            json.dump(registry.snapshot(), fh)
+
+    def get_hits(self):
+        return metrics.collect().counters.get((
+            "standup_cache_requests_total",
+            (("cache", "test"), ("result", "hit"))
+        ), 0)
+
+    def test_endpoint_exports_route_metrics(self):
+        self.call("get", "/channel/list")
+        response = self.client.get(
+            "/metrics", HTTP_X_BACKEND_SECRET=settings.BACKEND_SECRET
+        )
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode("utf-8")
+        self.assertIn(
+            "# TYPE standup_request_duration_seconds histogram", text
+        )
+        self.assertIn(
+            'standup_request_duration_seconds_count{route="channel:list"} 1',
+            text
+        )
+        self.assertIn(
+            'standup_responses_total{error="",route="channel:list",'
+            'status="200"} 1.0', text
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 403)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        for value in (0.001, 0.02, 20):
+            registry.observe("latency", {"route": "x"}, value, (0.01, 0.1))
+        text = metrics.render(registry)
+        self.assertIn('latency_bucket{route="x",le="0.01"} 1', text)
+        self.assertIn('latency_bucket{route="x",le="0.1"} 2', text)
+        self.assertIn('latency_bucket{route="x",le="+Inf"} 3', text)
+        self.assertIn('latency_count{route="x"} 3', text)
+
+    def test_forked_worker_starts_empty(self):
+        metrics.record_cache("test", True)
+        name = metrics._snapshot_name
+        metrics._reset_after_fork()
+        self.assertEqual(metrics.REGISTRY.counters, {})
+        self.assertNotEqual(metrics._snapshot_name, name)
+
+    def test_merges_snapshots_of_exited_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_settings(METRICS_DIR=directory)
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        self.write_snapshot(
+            directory, "metrics-%d-0000aaaa.json" % exited.pid, 2
+        )
+        self.write_snapshot(
+            directory, "metrics-%d-0000bbbb.json" % os.getppid(), 3
+        )
+        metrics.record_cache("test", True)
+
+        self.assertEqual(self.get_hits(), 6)
+        self.assertEqual(sorted(
+            name for name in os.listdir(directory) if name.endswith(".json")
+        ), [
+            "metrics-%d-0000bbbb.json" % os.getppid(), metrics.RETIRED_NAME
+        ])
+        # Retired snapshots are counted once
+        self.assertEqual(self.get_hits(), 6)
+
+
+class ProfilingTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.patch_settings(PROFILE_DIR=self.directory)
+
+    def get_profiles(self):
+        route_dir = os.path.join(self.directory, "channel.list")
+        if not os.path.isdir(route_dir):
+            return []
+        return sorted(name.split(".", 1)[1] for name in os.listdir(route_dir))
+
+    def test_profiles_signed_request(self):
+        signature = middleware.get_profile_signature("/channel/list")
+        response, _ = self.call(
+            "get", "/channel/list",
+            headers={"HTTP_X_PROFILE_SIGNATURE": signature}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_profiles(), ["prof", "sql.json"])
+
+        route_dir = os.path.join(self.directory, "channel.list")
+        sql_path = [
+            name for name in os.listdir(route_dir) if name.endswith(".json")
+        ][0]
+        with open(os.path.join(route_dir, sql_path)) as fh:
+            self.assertTrue(json.load(fh)["queries"])
+
+        stdout = io.StringIO()
+        call_command("profile_summary", dir=self.directory, stdout=stdout)
+        self.assertIn("channel:list: 1 profiles", stdout.getvalue())
+
+    def test_skips_unsigned_requests(self):
+        self.call(
+            "get", "/channel/list",
+            headers={"HTTP_X_PROFILE_SIGNATURE": "forged"}
+        )
+        self.call("get", "/channel/list")
+        self.assertEqual(self.get_profiles(), [])
+
+    def test_skips_non_ascii_signatures(self):
+        response, _ = self.call(
+            "get", "/channel/list",
+            headers={"HTTP_X_PROFILE_SIGNATURE": "sign\u00e9"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_profiles(), [])
+
+    def test_samples_requests(self):
+        self.patch_settings(PROFILE_SAMPLE_RATE=1.0)
+        self.call("get", "/channel/list")
+        self.assertEqual(self.get_profiles(), ["prof", "sql.json"])
+
+
+class ServerTimingTest(ApiTestCase):
+    def get_phases(self, response):
+        return [
+            entry.strip().split(";")[0]
+            for entry in response["Server-Timing"].split(",")
+        ]
+
+    def test_reports_phases_of_json_responses(self):
+        response, _ = self.call("get", "/channel/list")
+        phases = self.get_phases(response)
+        for name in ("auth", "user", "query", "serialize"):
+            self.assertIn(name, phases)
+        self.assertEqual(phases[-1], "total")
+        self.assertIn('desc="Main query"', response["Server-Timing"])
+
+    def test_reports_phases_of_errors(self):
+        response, _ = self.call("get", "/channel/list", email="x@example.com")
+        phases = self.get_phases(response)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((phases[0], phases[-1]), ("auth", "total"))
+
+    def test_phases_sum_within_request_only(self):
+        timing.record("query", 1.0)
+        self.assertEqual(timing.get_header(), "")
+        token = timing.start()
+        try:
+            timing.record("query", 0.001)
+            timing.record("query", 0.002)
+            self.assertEqual(
+                timing.get_header(), 'query;dur=3.00;desc="Main query"'
+            )
+        finally:
+            timing.stop(token)
+
+
+class SlowQueryLogTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_settings(
+            SLOW_QUERY_MS=0.0, SLOW_QUERY_SINK="sqlite",
+            SLOW_QUERY_LOG=os.path.join(directory, "slow.sqlite3")
+        )
+        patcher = mock.patch.object(slowlog, "_sink", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_records_route_and_view(self):
+        self.call("get", "/channel/list")
+        records = list(slowlog.get_sink().read())
+        self.assertTrue(records)
+        user_query = [
+            record for record in records if "auth_user" in record["sql"]
+        ][0]
+        self.assertEqual(user_query["route"], "channel:list")
+        self.assertEqual(user_query["view"], "channel.views.list_channels")
+        self.assertEqual(user_query["params"], ["str(17)"])
+        self.assertTrue(any(
+            frame.startswith("channel/views.py") for frame in
+            user_query["stack"]
+        ))
+
+        stdout = io.StringIO()
+        call_command(
+            "slow_query_summary", route="channel:list", stdout=stdout
+        )
+        self.assertIn("channel.views.list_channels", stdout.getvalue())
+
+    def test_view_path_of_decorated_and_callable_views(self):
+        match = mock.Mock(func=standup.views.batch)
+        self.assertEqual(
+            middleware.get_view_path(match), "standup.views.batch"
+        )
+        match = mock.Mock(func=middleware.MetricsMiddleware(None))
+        self.assertEqual(
+            middleware.get_view_path(match),
+            "standup.middleware.MetricsMiddleware"
+        )
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(
+            slowlog.fingerprint(
+                "SELECT a FROM t WHERE b = 'x' AND c IN (1,2)"
+            ),
+            slowlog.fingerprint("SELECT a FROM t WHERE b = 'y'  AND c IN (3)")
+        )
+
+
+class SqliteWritersTest(TransactionTestCase):
+    def test_applies_pragmas(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        conn = sqlite3.connect(os.path.join(directory, "db.sqlite3"))
+        self.addCleanup(conn.close)
+        sqlite_base.apply_pragmas(conn, {
+            "journal_mode": "WAL", "busy_timeout": "1234", "mmap_size": ""
+        })
+        self.assertEqual(
+            conn.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+        )
+        self.assertEqual(
+            conn.execute("PRAGMA busy_timeout").fetchone()[0], 1234
+        )
+
+        for pragmas in ({"user_version": "1"}, {"cache_size": "1; DROP"}):
+            with self.assertRaises(ValueError):
+                sqlite_base.apply_pragmas(conn, pragmas)
+
+    def test_write_transaction_takes_write_lock(self):
+        @standup.db.write_transaction()
+        def write():
+            models.Channel.objects.create(name="ops")
+
+        with CaptureQueriesContext(connection) as queries:
+            write()
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+        self.assertTrue(models.Channel.objects.filter(name="ops").exists())
+        self.assertFalse(connection.immediate_transactions)
+
+    @mock.patch("time.sleep")
+    def test_retries_lock_errors(self, sleep):
+        func = mock.Mock(side_effect=[
+            OperationalError("database is locked"), "done"
+        ])
+        self.assertEqual(standup.db.retry_locked(func), "done")
+        self.assertEqual(func.call_count, 2)
+
+        func = mock.Mock(side_effect=OperationalError("database is busy"))
+        with mock.patch.object(settings, "SQLITE_WRITE_RETRIES", 2):
+            with self.assertRaises(OperationalError):
+                standup.db.retry_locked(func)
+        self.assertEqual(func.call_count, 3)
+
+        func = mock.Mock(side_effect=OperationalError("no such table: x"))
+        with self.assertRaises(OperationalError):
+            standup.db.retry_locked(func)
+        self.assertEqual(func.call_count, 1)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def test_reuses_latest_healthy_connection(self):
+        pool = db_pool.ConnectionPool(2)
+        first, second, third = mock.Mock(), mock.Mock(), mock.Mock()
+        for conn in (first, second, third):
+            pool.put(conn)
+        third.close.assert_called_once_with()
+
+        self.assertIs(pool.get(mock.Mock(), lambda conn: True), second)
+        broken = mock.Mock(return_value=False)
+        created = mock.Mock()
+        self.assertIs(pool.get(lambda: created, broken), created)
+        first.close.assert_called_once_with()
+
+    def test_clear_closes_idle_connections(self):
+        pool = db_pool.ConnectionPool(2)
+        conn = mock.Mock()
+        conn.close.side_effect = OSError
+        pool.put(conn)
+        pool.clear()
+        conn.close.assert_called_once_with()
+        self.assertTrue(pool.idle.empty())
+
+    @override_settings(DB_POOL_SIZE=0)
+    def test_pool_disabled_without_size(self):
+        self.assertIsNone(db_pool.get_pool("default"))
+
+    @override_settings(DB_POOL_SIZE=1)
+    def test_pool_per_database(self):
+        self.addCleanup(db_pool._pools.clear)
+        pool = db_pool.get_pool("default")
+        self.assertIs(db_pool.get_pool("default"), pool)
+        self.assertEqual(pool.size, 1)
+
+    def test_closes_unhealthy_connections(self):
+        healthy = mock.Mock(in_atomic_block=False)
+        healthy.is_usable.return_value = True
+        dropped = mock.Mock(in_atomic_block=False)
+        dropped.is_usable.return_value = False
+        in_transaction = mock.Mock(in_atomic_block=True)
+        closed = mock.Mock(connection=None)
+        all_connections = [healthy, dropped, in_transaction, closed]
+        with mock.patch("standup.db.connections") as connections:
+            connections.all.return_value = all_connections
+            standup.db.close_unhealthy_connections()
+
+        healthy.close.assert_not_called()
+        dropped.close.assert_called_once_with()
+        in_transaction.is_usable.assert_not_called()
+        closed.is_usable.assert_not_called()
+
+
+class CoalesceTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.multiple(
+            settings, COALESCE_CACHE=False, COALESCE_WAIT_SECONDS=5,
+            COALESCE_POLL_SECONDS=0.001
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = coalesce.get_key("channel:list-logs", 1, "members")
+
+    def test_freezes_only_successful_responses(self):
+        response = standup.utils.json_response(
+            **standup.utils.USER_DOES_NOT_EXIST
+        )
+        thawed = coalesce.thaw(coalesce.freeze(response))
+        self.assertEqual(thawed.content, response.content)
+        self.assertEqual(thawed.status_code, response.status_code)
+        self.assertEqual(thawed.error_label, response.error_label)
+
+        self.assertIsNone(coalesce.freeze(HttpResponse(status=503)))
+
+    def test_concurrent_calls_share_response(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(threading.current_thread().name)
+            started.set()
+            release.wait(5)
+            return HttpResponse(b"logs", content_type="application/json")
+
+        responses = []
+        leader = threading.Thread(
+            target=lambda: responses.append(coalesce.run(self.key, compute))
+        )
+        leader.start()
+        started.wait(5)
+
+        # Releases the leader once the waiter blocks on its flight
+        done = coalesce._flights[self.key].done
+        wait = done.wait
+        done.wait = lambda timeout: release.set() or wait(timeout)
+        waiter = threading.Thread(
+            target=lambda: responses.append(coalesce.run(self.key, compute))
+        )
+        waiter.start()
+        leader.join(5)
+        waiter.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.content for r in responses], [b"logs", b"logs"])
+        self.assertNotIn(self.key, coalesce._flights)
+
+    def test_waiters_compute_when_leader_fails(self):
+        flight = coalesce._flights[self.key] = coalesce.Flight()
+        self.addCleanup(coalesce._flights.pop, self.key, None)
+        flight.done.set()
+        response = coalesce.run(self.key, lambda: HttpResponse(b"own"))
+        self.assertEqual(response.content, b"own")
+
+    def test_polls_response_of_other_process(self):
+        self.patch_cache_coalescing()
+        cache.add(self.key + ":lock", "token")
+        cache.set(self.key + ":token", coalesce.freeze(HttpResponse(b"x")))
+        compute = mock.Mock()
+        self.assertEqual(coalesce.run(self.key, compute).content, b"x")
+        compute.assert_not_called()
+
+        # Lock released without a result
+        cache.delete(self.key + ":token")
+        cache.delete(self.key + ":lock")
+        cache.add(self.key + ":lock", "failed")
+        with mock.patch.object(
+                coalesce.cache, "get", side_effect=["failed", None, None]
+        ):
+            response = coalesce.run_shared(
+                self.key, lambda: HttpResponse(b"own")
+            )
+        self.assertEqual(response.content, b"own")
+
+    def test_leader_publishes_response(self):
+        self.patch_cache_coalescing()
+        response = coalesce.run(self.key, lambda: HttpResponse(b"logs"))
+        self.assertEqual(response.content, b"logs")
+        self.assertIsNone(cache.get(self.key + ":lock"))
+
+    def patch_cache_coalescing(self):
+        patcher = mock.patch.object(settings, "COALESCE_CACHE", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class AdmissionTest(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = admission.LocalStore()
+        self.patch_settings(
+            ADMISSION_STORE="local", MAX_CONCURRENT_PER_VIEW=0,
+            RATE_LIMITS={
+                "poll": (0.01, 2), "read": (0.01, 2), "write": (0.01, 2)
+            }
+        )
+        patcher = mock.patch.dict(admission._stores, local=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_limits_requests_over_burst(self):
+        for _ in range(2):
+            response, _ = self.call("get", "/channel/list")
+            self.assertEqual(response.status_code, 200)
+        response, body = self.call("get", "/channel/list")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(body["error"], "RATE_LIMITED")
+        self.assertEqual(response["Retry-After"], "100")
+
+        # Writes and other users have buckets of their own
+        response, _ = self.call(
+            "post", "/channel/create", user_email="olive@example.com",
+            channel_name="ops"
+        )
+        self.assertEqual(response.status_code, 200)
+        response, _ = self.call(
+            "get", "/channel/list", email=self.member.email
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_bad_secret_takes_no_token(self):
+        for _ in range(3):
+            response, _ = self.call(
+                "get", "/channel/list",
+                headers={"HTTP_X_BACKEND_SECRET": "wrong"}
+            )
+            self.assertEqual(response.status_code, 403)
+        response, _ = self.call("get", "/channel/list")
+        self.assertEqual(response.status_code, 200)
+
+    def test_counts_batch_sub_requests(self):
+        response, body = self.call(
+            "post", "/batch", requests=[{"route": "channel:list"}] * 3
+        )
+        self.assertEqual(response.status_code, 200)
+        results = body["payload"]["responses"]
+        self.assertEqual(
+            [result["status"] for result in results], [200, 200, 429]
+        )
+        self.assertEqual(results[2]["retry_after"], 100)
+
+    def test_sheds_requests_over_concurrency_limit(self):
+        self.patch_settings(MAX_CONCURRENT_PER_VIEW=1)
+        self.assertTrue(self.store.acquire("channel:list", 1))
+        response, body = self.call("get", "/channel/list")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(body["error"], "OVERLOADED")
+        self.assertEqual(response["Retry-After"], "1")
+
+        self.store.release("channel:list")
+        response, _ = self.call("get", "/channel/list")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.store.slots, {})
+
+    def test_evicts_buckets(self):
+        self.patch_settings(ADMISSION_MAX_BUCKETS=2)
+        for key in ("a", "b", "c"):
+            self.assertEqual(self.store.take(key, 0.01, 2), 0)
+        self.assertEqual(list(self.store.buckets), ["b", "c"])
+
+        # Refilled buckets are dropped under the limit too
+        self.store.take("d", 1000000, 2)
+        time.sleep(0.001)
+        self.store.take("b", 0.01, 2)
+        self.assertEqual(list(self.store.buckets), ["b"])
+
+
+class IdempotencyTest(ApiTestCase):
+    @staticmethod
+    def post(view, key):
+        """ Calls view with request of idempotency key """
+        return view(RequestFactory().post(
+            "/channel/create", b"{}", content_type="application/json",
+            HTTP_X_BACKEND_SECRET=settings.BACKEND_SECRET,
+            HTTP_IDEMPOTENCY_KEY=key
+        ))
+
+    def create_channel(self, key, name="ops", **kwargs):
+        return self.call(
+            "post", "/channel/create", headers={"HTTP_IDEMPOTENCY_KEY": key},
+            user_email="olive@example.com", channel_name=name, **kwargs
+        )
+
+    def test_replays_response_to_retries(self):
+        response, body = self.create_channel("create-ops")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+
+        # Stored in the database, so retries on other workers see it
+        cache.clear()
+        retry, retry_body = self.create_channel("create-ops")
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry_body, body)
+        self.assertEqual(models.Channel.objects.filter(name="ops").count(), 1)
+
+        # Keys are scoped to their requester
+        response, _ = self.call(
+            "post", "/channel/create", email=self.member.email,
+            headers={"HTTP_IDEMPOTENCY_KEY": "create-ops"},
+            user_email=self.member.email, channel_name="dev"
+        )
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertTrue(models.Channel.objects.filter(name="dev").exists())
+
+    def test_rejects_reused_keys(self):
+        self.create_channel("create")
+        response, body = self.create_channel("create", name="other")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(body["error"], "IDEMPOTENCY_KEY_REUSED")
+
+    def test_rejects_retries_while_running(self):
+        retries = []
+
+        def view(request):
+            retries.append(self.post(wrapper, "running"))
+            return HttpResponse(b"ok")
+
+        wrapper = idempotency.idempotent(view)
+        self.assertEqual(self.post(wrapper, "running").content, b"ok")
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertEqual(retries[0]["Retry-After"], "1")
+        self.assertEqual(
+            json.loads(retries[0].content)["error"], "IDEMPOTENCY_IN_PROGRESS"
+        )
+
+    def test_rejects_bad_keys_and_secrets(self):
+        for key in ("", "x" * (idempotency.MAX_KEY_LENGTH + 1)):
+            response, _ = self.create_channel(key)
+            self.assertEqual(response.status_code, 400)
+        response, _ = self.call(
+            "post", "/channel/create", headers={
+                "HTTP_IDEMPOTENCY_KEY": "create",
+                "HTTP_X_BACKEND_SECRET": "wrong"
+            }, user_email="olive@example.com", channel_name="ops"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(models.Channel.objects.filter(name="ops").exists())
+
+    def test_takes_over_and_purges_expired_keys(self):
+        view = mock.Mock(
+            side_effect=[HttpResponse(b"ok"), HttpResponse(b"new")]
+        )
+        wrapper = idempotency.idempotent(view)
+        self.assertEqual(self.post(wrapper, "expiring").content, b"ok")
+        stored = standup.models.IdempotencyKey.objects.get()
+        self.assertEqual(stored.status, 200)
+
+        stored.dt_expires = timezone.now()
+        stored.save()
+        self.assertEqual(self.post(wrapper, "expiring").content, b"new")
+        self.assertEqual(view.call_count, 2)
+
+        standup.models.IdempotencyKey.objects.update(
+            dt_expires=timezone.now()
+        )
+        out = io.StringIO()
+        call_command("run_purges", stdout=out)
+        self.assertIn("Deleted 1 expired idempotency keys", out.getvalue())
+        self.assertFalse(standup.models.IdempotencyKey.objects.exists())
+
+    def test_runs_again_after_server_error(self):
+        view = mock.Mock(side_effect=[
+            HttpResponse(status=500), HttpResponse(b"ok"),
+            HttpResponse(b"again")
+        ])
+        wrapper = idempotency.idempotent(view)
+        self.assertEqual(self.post(wrapper, "retry").status_code, 500)
+        self.assertEqual(self.post(wrapper, "retry").content, b"ok")
+        self.assertEqual(self.post(wrapper, "retry").content, b"ok")
+        self.assertEqual(view.call_count, 2)
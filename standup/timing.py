@@ -0,0 +1,75 @@
+""" Per-request phase timings, reported in the Server-Timing header
+
+Views wrap the work of each phase in ``phase(name)``. Repeated phases are
+summed. Timings are only kept while ServerTimingMiddleware has started
+them for the current request.
+"""
+import contextlib
+import contextvars
+import time
+from typing import Dict, Optional
+
+#: Phase durations of current request in seconds, in order of first use
+_timings: contextvars.ContextVar = contextvars.ContextVar(
+    "standup_timings", default=None
+)
+
+#: Descriptions of known phases
+PHASE_DESCRIPTIONS = {
+    "auth": "Body parse and secret check",
+    "user": "User lookup",
+    "member": "Channel membership check",
+    "query": "Main query",
+    "cache": "Cache lookups",
+    "coalesce": "Wait for identical request in flight",
+    "serialize": "Response serialization",
+    "total": "Total",
+}
+
+
+def start() -> contextvars.Token:
+    """ Starts collecting timings for a request """
+    return _timings.set({})
+
+
+def stop(token: contextvars.Token):
+    """ Stops collecting timings started with matching call to start """
+    _timings.reset(token)
+
+
+def record(name: str, duration: float):
+    """ Adds duration to phase of current request """
+    timings: Optional[Dict[str, float]] = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """ Context manager timing a phase of current request """
+    t_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t_start)
+
+
+def format_header(timings: Dict[str, float]) -> str:
+    """ Formats phase durations as Server-Timing header value """
+    return ", ".join(
+        '%s;dur=%.2f;desc="%s"' % (
+            name, duration * 1000, PHASE_DESCRIPTIONS.get(name, name)
+        )
+        for name, duration in timings.items()
+    )
+
+
+def get_header(**extra: float) -> str:
+    """ Returns Server-Timing header value of current request
+
+    :param extra: Additional phase durations to report
+    """
+    timings = dict(_timings.get() or {})
+    for name, duration in extra.items():
+        timings[name] = timings.get(name, 0.0) + duration
+    return format_header(timings)
@@ -13,16 +13,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
 
 import channel.urls
 import login.urls
 import notification.urls
+import standup.views
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('auth/', include(login.urls, namespace='auth')),
-    path("channel/", include(channel.urls, namespace="channel")),
-    path("notify/", include(notification.urls, namespace="notificiations")),
+    path("metrics", standup.views.get_metrics, name="metrics"),
 ]
+
+if settings.SERVE_ADMIN:
+    from django.contrib import admin
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+    ]
+
+if settings.SERVE_API:
+    urlpatterns += [
+        path('auth/', include(login.urls, namespace='auth')),
+        path("channel/", include(channel.urls, namespace="channel")),
+        path(
+            "notify/", include(notification.urls, namespace="notificiations")
+        ),
+        path("dashboard", standup.views.dashboard, name="dashboard"),
+        path("batch", standup.views.batch, name="batch"),
+    ]
@@ -1,8 +1,10 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 import json
+import time
 from typing import Dict, List, Optional, Tuple, Union
 
 from standup import settings
+from standup import timing
 
 
 #: Bad secret from external backend
@@ -45,6 +47,52 @@ NOTIFICATION_DOES_NOT_EXIST = {
     "http_status": 404
 }
 
+#: Batch sub-request names unknown route
+BATCH_ROUTE_NOT_FOUND = {
+    "message": "Unknown route for batch request",
+    "error": "BAD_ROUTE",
+    "json_status": 404,
+    "http_status": 404
+}
+
+#: Malformed batch request
+BATCH_INVALID = {
+    "message": "Expected list of requests",
+    "error": "INVALID_BATCH",
+    "json_status": 400,
+    "http_status": 400
+}
+
+#: Batch sub-request raised an error
+BATCH_REQUEST_FAILED = {
+    "message": "Request failed with an internal error",
+    "error": "INTERNAL_ERROR",
+    "json_status": 500,
+    "http_status": 500
+}
+
+#: Atomic batch stopped at a failed sub-request, statuses are set to its own
+BATCH_ROLLED_BACK = {
+    "message": "Batch was rolled back at a failed request",
+    "error": "BATCH_ROLLED_BACK",
+    "json_status": 400,
+    "http_status": 400
+}
+
+RATE_LIMITED = {
+    "message": "Too many requests, retry later",
+    "error": "RATE_LIMITED",
+    "json_status": 429,
+    "http_status": 429
+}
+
+OVERLOADED = {
+    "message": "Server is overloaded, retry later",
+    "error": "OVERLOADED",
+    "json_status": 503,
+    "http_status": 503
+}
+
 
 def json_response(
         payload: Optional[Union[List, Dict]] = None,
@@ -59,6 +107,7 @@ def json_response(
     :param json_status: External response status passed in json response
     :param http_status: Internal response status passed as http code
     """
+    t_start = time.perf_counter()
     response = {
         'payload': {} if payload is None else payload,
         'status': json_status
@@ -70,9 +119,43 @@ def json_response(
 
     j_response = JsonResponse(response)
     j_response.status_code = http_status
+    j_response.error_label = error
+    j_response["Server-Timing"] = timing.get_header(
+        serialize=time.perf_counter() - t_start
+    )
     return j_response
 
 
+def raw_json_response(
+        payload_json: str, message: str = None, error: str = None,
+        json_status: int = 200, http_status: int = 200
+):
+    """ Variant of json_response for a payload already serialized to JSON
+
+    :param payload_json: JSON of response payload
+    :param message: Optional user-friendly message about status of request
+    :param error: Optional error label
+    :param json_status: External response status passed in json response
+    :param http_status: Internal response status passed as http code
+    """
+    t_start = time.perf_counter()
+    fields = ['"payload": ' + payload_json, '"status": %d' % json_status]
+    if message is not None:
+        fields.append('"message": ' + json.dumps(message))
+    if error is not None:
+        fields.append('"error": ' + json.dumps(error))
+
+    response = HttpResponse(
+        "{%s}" % ", ".join(fields), content_type="application/json"
+    )
+    response.status_code = http_status
+    response.error_label = error
+    response["Server-Timing"] = timing.get_header(
+        serialize=time.perf_counter() - t_start
+    )
+    return response
+
+
 def get_request_args(request):
     """ Returns dict of request parameters """
     if request.body:
@@ -84,26 +167,35 @@ def get_request_args(request):
 def check_request_secret(request) -> Tuple[bool, Optional[JsonResponse], Dict]:
     """ Returns boolean check that request has bad backend secret
 
+    Requests dispatched in-process by an already authenticated batch
+    request are flagged with ``backend_authenticated`` and skip the check.
+
     :return: Error flag set to true if auth failed, associated response,
     and parsed args
     """
-    try:
-        request_args = get_request_args(request)
-    except UnicodeDecodeError:
-        error_response = JsonResponse(BAD_ENCODE_RESPONSE)
-        error_response.status_code = 400
-        return True, error_response, {}
-
-    request_secret = request_args.get('BACKEND_SECRET')
-    if request_secret is None:
-        request_secret = request.headers.get("X-BACKEND-SECRET")
-    if request_secret == settings.BACKEND_SECRET:
-        return False, None, request_args
-
-    else:
-        error_response = JsonResponse(BAD_SECRET_RESPONSE)
-        error_response.status_code = 403
-        return True, error_response, request_args
+    with timing.phase("auth"):
+        try:
+            request_args = get_request_args(request)
+        except UnicodeDecodeError:
+            error_response = JsonResponse(BAD_ENCODE_RESPONSE)
+            error_response.status_code = 400
+            error_response.error_label = BAD_ENCODE_RESPONSE["error"]
+            return True, error_response, {}
+
+        if getattr(request, "backend_authenticated", False):
+            return False, None, request_args
+
+        request_secret = request_args.get('BACKEND_SECRET')
+        if request_secret is None:
+            request_secret = request.headers.get("X-BACKEND-SECRET")
+        if request_secret == settings.BACKEND_SECRET:
+            return False, None, request_args
+
+        else:
+            error_response = JsonResponse(BAD_SECRET_RESPONSE)
+            error_response.status_code = 403
+            error_response.error_label = BAD_SECRET_RESPONSE["error"]
+            return True, error_response, request_args
 
 
 def parse_bool(value: Union[bool, str]) -> bool:
@@ -0,0 +1,295 @@
+import contextlib
+import json
+import logging
+import math
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Count, Q
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
+from django.utils import timezone
+
+import channel.models
+import channel.shards
+import channel.utils
+import notification.utils
+from standup import admission
+from standup import idempotency
+from standup import metrics
+from standup import timing
+import standup.utils
+
+
+#: URL namespaces that batch requests may dispatch to
+BATCH_NAMESPACES = ("auth", "channel", "notificiations")
+
+#: Maximum number of sub-requests per batch
+MAX_BATCH_SIZE = 20
+
+#: Keys of the batch request's META passed to sub-requests, besides its
+#: HTTP headers
+SUB_REQUEST_META = (
+    "REMOTE_ADDR", "SERVER_NAME", "SERVER_PORT", "SERVER_PROTOCOL",
+    "wsgi.url_scheme"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def dashboard(request):
+    """ GET handler for the frontend landing page
+
+    Combines user settings, channel listing, unread notifications and the
+    posting status of today's standups in a fixed number of queries.
+
+    GET Headers:
+        - X-USER-EMAIL
+
+    Parameters:
+        - date: Optional ISO date to report standup status for
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    user_email = request.headers.get("X-USER-EMAIL", "").lower()
+    try:
+        dt_today = (
+            channel.utils.parse_iso_date_str(args["date"])
+            if args.get("date") else timezone.now().date()
+        )
+    except (ValueError, TypeError):
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Invalid ISO date, must be YYYY-MM-DD",
+            json_status=400,
+            http_status=400
+        )
+
+    with timing.phase("user"):
+        try:
+            user = User.objects.get(email__iexact=user_email)
+        except User.DoesNotExist:
+            return standup.utils.json_response(
+                **standup.utils.USER_DOES_NOT_EXIST
+            )
+
+    with timing.phase("query"):
+        channels = list(
+            channel.models.Channel.objects.filter(
+                Q(owner=user) | Q(channelmember__user=user)
+            ).distinct().select_related("owner").order_by("pk")
+        )
+        channel_ids = [c.pk for c in channels]
+
+        # Posting status of today's standups, per channel
+        posters = {}
+        for shard_messages in channel.shards.messages_in(channel_ids):
+            today_messages = shard_messages.filter(
+                dt_posted=dt_today
+            ).values_list("channel_id", "user_id")
+            for channel_id, user_id in today_messages:
+                posters.setdefault(channel_id, set()).add(user_id)
+
+        unread = user.notification_set.filter(dismissed=False)
+        notifications = notification.utils.serialize_notifications(
+            unread[:notification.utils.MAX_UNREAD]
+        )
+        unread_count = unread.aggregate(count=Count("pk"))["count"]
+
+    return standup.utils.json_response(
+        payload={
+            "user": {
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "email": user.email
+            },
+            "channels": [
+                {
+                    "channel_name": c.name,
+                    "owner": c.owner.email if c.owner else None,
+                    "channel_id": c.pk,
+                    "archived": c.archived,
+                    "posted": user.pk in posters.get(c.pk, ()),
+                    "posted_count": len(posters.get(c.pk, ())),
+                }
+                for c in channels
+            ],
+            "notifications": {
+                "unread_count": unread_count,
+                "notifications": notifications,
+                "hash": notification.utils.hash_notifications(notifications)
+            },
+            "date": dt_today
+        }
+    )
+
+
+@idempotency.idempotent
+def batch(request):
+    """ POST handler to dispatch several API requests in one round trip
+
+    Sub-requests run in-process with the headers of the batch request, and
+    share its authentication and database connection. Each counts against
+    the rate limit of its own route, and one over it gets a RATE_LIMITED
+    response with retry_after seconds.
+
+    POST Headers:
+        - X-USER-EMAIL
+
+    POST Parameters:
+        - requests: List of sub-requests, each with a route name such as
+          "channel:list-logs", an optional HTTP method and optional args
+        - atomic: Optional flag to run all sub-requests in one transaction,
+          rolled back and stopped at the first failed sub-request, with a
+          BATCH_ROLLED_BACK response of its status
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    sub_requests = args.get("requests")
+    if not isinstance(sub_requests, list):
+        return standup.utils.json_response(**standup.utils.BATCH_INVALID)
+    if len(sub_requests) > MAX_BATCH_SIZE:
+        return standup.utils.json_response(
+            error="INVALID_BATCH",
+            message="Batch is limited to %d requests" % MAX_BATCH_SIZE,
+            json_status=400,
+            http_status=400
+        )
+
+    try:
+        atomic = standup.utils.parse_bool(args.get("atomic", False))
+    except ValueError:
+        return standup.utils.json_response(
+            error="INVALID_ARG",
+            message="Bad value for atomic",
+            json_status=400,
+            http_status=400
+        )
+
+    results = []
+    failed = None
+    with contextlib.ExitStack() as stack:
+        if atomic:
+            # Message shards commit just before the default database, not
+            # in a two-phase commit
+            for alias in connections:
+                stack.enter_context(transaction.atomic(using=alias))
+        for sub_request in sub_requests:
+            result = dispatch_sub_request(request, sub_request)
+            results.append(result)
+            if atomic and result["status"] >= 400:
+                for alias in connections:
+                    transaction.set_rollback(True, using=alias)
+                failed = result
+                break
+
+    if failed is not None:
+        return standup.utils.json_response(
+            payload={"responses": results},
+            **dict(
+                standup.utils.BATCH_ROLLED_BACK,
+                json_status=failed["status"], http_status=failed["status"]
+            )
+        )
+    return standup.utils.json_response(payload={"responses": results})
+
+
+def dispatch_sub_request(request: HttpRequest, sub_request) -> dict:
+    """ Runs a single batch sub-request against its view in-process
+
+    :param request: Parent batch request, already authenticated
+    :param sub_request: Dictionary with route, method and args
+    :return: Dictionary of route, HTTP status and decoded response
+    """
+    if not isinstance(sub_request, dict):
+        return _batch_error(None, standup.utils.BATCH_INVALID)
+
+    route = str(sub_request.get("route", ""))
+    sub_args = sub_request.get("args") or {}
+    method = str(sub_request.get("method", "GET")).upper()
+    if route.split(":")[0] not in BATCH_NAMESPACES or not isinstance(
+            sub_args, dict
+    ):
+        return _batch_error(route, standup.utils.BATCH_ROUTE_NOT_FOUND)
+
+    try:
+        path = reverse(route)
+        match = resolve(path)
+    except (NoReverseMatch, Resolver404):
+        return _batch_error(route, standup.utils.BATCH_ROUTE_NOT_FOUND)
+
+    wait = admission.take_token(request, match.view_name, method)
+    if wait > 0:
+        result = _batch_error(route, standup.utils.RATE_LIMITED)
+        result["retry_after"] = math.ceil(wait)
+        return result
+
+    body = json.dumps(sub_args).encode("utf-8")
+    sub = HttpRequest()
+    sub.method = method
+    sub.path = sub.path_info = path
+    sub.META = {
+        key: value for key, value in request.META.items()
+        if key.startswith("HTTP_") or key in SUB_REQUEST_META
+    }
+    sub.META.update(
+        REQUEST_METHOD=method, PATH_INFO=path,
+        CONTENT_TYPE="application/json", CONTENT_LENGTH=str(len(body)),
+        QUERY_STRING=""
+    )
+    sub._body = body
+    sub.GET = QueryDict(mutable=True)
+    for key, value in sub_args.items():
+        sub.GET[key] = value if isinstance(value, str) else json.dumps(value)
+    sub.resolver_match = match
+    sub.backend_authenticated = True
+
+    try:
+        sub_response = match.func(sub, *match.args, **match.kwargs)
+    except Exception:
+        # Fails this sub-request only, atomic batches are rolled back
+        logger.exception("Batch request to %s failed", route)
+        return _batch_error(route, standup.utils.BATCH_REQUEST_FAILED)
+    try:
+        content = json.loads(sub_response.content.decode("utf-8"))
+    except ValueError:
+        content = None
+    return {
+        "route": route,
+        "status": sub_response.status_code,
+        "response": content
+    }
+
+
+def _batch_error(route, error: dict) -> dict:
+    """ Builds batch result for sub-request that could not be dispatched """
+    return {
+        "route": route,
+        "status": error["http_status"],
+        "response": {
+            "payload": {},
+            "message": error["message"],
+            "error": error["error"],
+            "status": error["json_status"]
+        }
+    }
+
+
+def get_metrics(request):
+    """ GET handler exposing metrics of all workers in Prometheus format
+
+    GET Headers:
+        - X-BACKEND-SECRET
+    """
+    bad_secret, response, args = standup.utils.check_request_secret(request)
+    if bad_secret:
+        return response
+
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8"
+    )